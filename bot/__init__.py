@@ -61,19 +61,26 @@ ffmpeg_file = "ffmpeg.txt"
 ffmpeg_file2 = "ffmpeg2.txt"
 ffmpeg_file3 = "ffmpeg3.txt"
 ffmpeg_file4 = "ffmpeg4.txt"
+ffmpeg_tier1 = "ffmpeg_tier1.txt"
+ffmpeg_tier2 = "ffmpeg_tier2.txt"
 mux_file = "mux.txt"
 filter_file = "filter.txt"
 home_dir = os.getcwd()
 local_cdb = ".crf.pkl"
+local_mdb = ".local_quality.pkl"
+local_ddb = ".local_dead.pkl"
 local_qdb = ".local_queue.pkl"
 local_qdb2 = ".local_bqueue.pkl"
 local_rdb = ".local_rssdb.pkl"
+local_tdb = ".local_tiers.pkl"
+local_xdb = ".local_results.pkl"
 local_udb = ".t_users.pkl"
 log_file_name = "Logs.txt"
 parse_file = "NO_PARSE"
 qb_lock = asyncio.Lock()
 queue_lock = asyncio.Lock()
 rename_file = "filters/Auto-rename.txt"
+resume_dir = "resume"
 rss_dict_lock = asyncio.Lock()
 thumb = "thumb.jpg"
 version_file = "version.txt"
@@ -28,10 +28,12 @@ from .workers.handlers.e_callbacks import pres, skip, skip_jobs, stats
 from .workers.handlers.manage import (
     allowgroupenc,
     auto_rename,
+    bench,
     change,
     check,
     clean,
     custom_rename,
+    dead_letters,
     del_auto_rename,
     discap,
     fc_forward,
@@ -47,6 +49,7 @@ from .workers.handlers.manage import (
     rss_handler,
     save_thumb,
     set_mux_args,
+    tiers,
     update2,
     v_auto_rename,
     version2,
@@ -359,6 +362,21 @@ async def _(e):
     await event_handler(e, en_mux, pyro, require_args=True)
 
 
+@tele.on(events.NewMessage(pattern=command(["bench"])))
+async def _(e):
+    await event_handler(e, bench, pyro)
+
+
+@tele.on(events.NewMessage(pattern=command(["failed"])))
+async def _(e):
+    await event_handler(e, dead_letters, pyro)
+
+
+@tele.on(events.NewMessage(pattern=command(["tiers"])))
+async def _(e):
+    await event_handler(e, tiers, pyro)
+
+
 @pyro.on_message(filters.incoming & filters.command([f"peval{cmd_suffix}"]))
 async def _(pyro, message):
     await event_handler(message, eval_message_p, tele, require_args=True)
@@ -30,26 +30,40 @@ class Config:
                 "API_HASH", default="eb06d4abfb49dc3eeb1aeb98ae0f581e"
             )
             self.ARIA2_PORT = config("ARIA2_PORT", default=6800, cast=int)
+            self.AUTO_CROP = config("AUTO_CROP", default=False, cast=bool)
+            self.AUX_CPUS = config("AUX_CPUS", default=1, cast=int)
             self.BOT_TOKEN = config("BOT_TOKEN")
             self.CACHE_DL = config("CACHE_DL", default=False, cast=bool)
             self.CAP_DECO = config("CAP_DECO", default="◉")
             self.C_LINK = config("C_LINK", default="@Anime_Surge")
+            self.CHUNK_ENCODE = config("CHUNK_ENCODE", default=0, cast=int)
+            self.CHUNK_MIN_DURATION = config(
+                "CHUNK_MIN_DURATION", default=600, cast=int
+            )
             self.CMD_SUFFIX = config("CMD_SUFFIX", default=str())
             self.COMP_MODE = config("COMPATIBILITY_MODE", default=True, cast=bool)
+            self.COPY_CODECS = config("COPY_CODECS", default=str())
             self.CUSTOM_RENAME = config("CUSTOM_RENAME", default=None)
             self.DATABASE_URL = config("DATABASE_URL", default=None)
             self.DBNAME = config("DBNAME", default="ENC")
             self.DEV = config("DEV", default=0, cast=int)
             self.DL_STUFF = config("DL_STUFF", default=None)
+            self.DOWNLOAD_SLOTS = config("DOWNLOAD_SLOTS", default=1, cast=int)
             self.DUMP_CHANNEL = config("DUMP_CHANNEL", default=0, cast=int)
             self.DUMP_LEECH = config("DUMP_LEECH", default=True, cast=bool)
             self.DYNO = config("DYNO", default=None)
             self.ENCODER = config("ENCODER", default=None)
+            self.ENCODE_LOG_LINES = config("ENCODE_LOG_LINES", default=100, cast=int)
+            self.ENCODE_LOG_SIZE = config("ENCODE_LOG_SIZE", default=0, cast=int)
+            self.ENCODE_SLOTS = config("ENCODE_SLOTS", default=1, cast=int)
+            self.ENCODE_WORKERS = config("ENCODE_WORKERS", default=str())
+            self.ENCODE_WORKERS_TOKEN = config("ENCODE_WORKERS_TOKEN", default=None)
             self.EXT_CAP = config("EXTENDED_CAPTIONS", default=True, cast=bool)
             self.FBANNER = config("FBANNER", default=False, cast=bool)
             self.FCHANNEL = config("FCHANNEL", default=0, cast=int)
             self.FCHANNEL_STAT = config("FCHANNEL_STAT", default=0, cast=int)
             self.FCODEC = config("FCODEC", default=None)
+            self.FAIL_BACKOFF = config("FAIL_BACKOFF", default=300, cast=int)
             self.FFMPEG = config(
                 "FFMPEG",
                 default='ffmpeg -i "{}" -preset ultrafast -c:v libx265 -crf 27 -map 0:v -c:a aac -map 0:a -c:s copy -map 0:s? "{}"',
@@ -61,29 +75,52 @@ class Config:
             self.FL_CAP = config("FILENAME_AS_CAPTION", default=False, cast=bool)
             self.FS_THRESHOLD = config("FLOOD_SLEEP_THRESHOLD", default=600, cast=int)
             self.FSTICKER = config("FSTICKER", default=None)
+            self.GOVERNOR = config("GOVERNOR", default=False, cast=bool)
+            self.KEEP_LANGS = config("KEEP_LANGS", default=str())
             self.LOCK_ON_STARTUP = config("LOCK_ON_STARTUP", default=False, cast=bool)
             self.LOG_CHANNEL = config("LOG_CHANNEL", default=0, cast=int)
             self.LOGS_IN_CHANNEL = config("LOGS_IN_CHANNEL", default=False, cast=bool)
+            self.MAX_FAILURES = config("MAX_FAILURES", default=3, cast=int)
             self.MI_CAP = config("MI_IN_CAPTION", default=True, cast=bool)
+            self.MULTI_PROFILE = config("MULTI_PROFILE", default=False, cast=bool)
             self.MUX_ARGS = config("MUX_ARGS", default=None)
             self.NO_BANNER = config("NO_BANNER", default=False, cast=bool)
             self.NO_TEMP_PM = config("NO_TEMP_PM", default=False, cast=bool)
+            self.OVERSIZE_FFMPEG = config("OVERSIZE_FFMPEG", default=None)
+            self.OVERSIZE_RATIO = config("OVERSIZE_RATIO", default=0, cast=float)
             self.OVR = config("OVR", default=None)
             self.OWNER = config("OWNER")
             self.PAUSE_ON_DL_INFO = config("PODI", default=True, cast=bool)
+            self.PIPELINE = config("PIPELINE", default=False, cast=bool)
+            self.PROGRESSIVE_UPLOAD = config(
+                "PROGRESSIVE_UPLOAD", default=False, cast=bool
+            )
             self.QDL_TIMEOUT = config("QBIT_DL_TIMEOUT", default=0, cast=int)
             self.QBIT_PORT = config("QBIT_PORT", default=8090, cast=int)
             self.QBIT_PORT2 = config("QBIT_PORT2", default=9090, cast=int)
             self.QBIT_TIMEOUT = config("QBIT_TIMEOUT", default=20, cast=int)
+            self.QUALITY_LENGTH = config("QUALITY_LENGTH", default=5, cast=int)
+            self.QUALITY_SAMPLES = config("QUALITY_SAMPLES", default=0, cast=int)
             self.RELEASER = config("RELEASER", default="A-M|ANi-MiNE")
             self.REPORT_FAILED = config("REPORT_FAILED", default=True, cast=bool)
             self.REPORT_FAILED_DL = config("REPORT_FAILED_DL", default=False, cast=bool)
             self.REPORT_FAILED_ENC = config(
                 "REPORT_FAILED_ENC", default=False, cast=bool
             )
+            self.RESULT_CACHE = config("RESULT_CACHE", default=0, cast=int)
+            self.RESULT_CACHE_DAYS = config("RESULT_CACHE_DAYS", default=30, cast=int)
+            self.RESUME_ENCODES = config("RESUME_ENCODES", default=False, cast=bool)
             self.RSS_CHAT = config("RSS_CHAT", default=0, cast=str)
             self.RSS_DELAY = config("RSS_DELAY", default=60, cast=int)
             self.RSS_DIRECT = config("RSS_DIRECT", default=True, cast=bool)
+            self.SPLIT_STREAMS = config("SPLIT_STREAMS", default=False, cast=bool)
+            self.STALL_RETRIES = config("STALL_RETRIES", default=1, cast=int)
+            self.STALL_TIMEOUT = config("STALL_TIMEOUT", default=0, cast=int)
+            self.STREAM_ENCODE = config("STREAM_ENCODE", default=False, cast=bool)
+            self.STREAM_LINKS = config("STREAM_LINKS", default=False, cast=bool)
+            self.TARGET_SIZE_TOLERANCE = config(
+                "TARGET_SIZE_TOLERANCE", default=3, cast=float
+            )
             self.TELEGRAPH_API = config(
                 "TELEGRAPH_API", default="https://api.telegra.ph"
             )
@@ -92,13 +129,18 @@ class Config:
             self.TG_DL_CLIENT = config("TG_DL_CLIENT", default="pyrogram")
             self.TG_UL_CLIENT = config("TG_UL_CLIENT", default="pyrogram")
             self.THUMB = config("THUMBNAIL", default=None)
+            self.TIER1_FFMPEG = config("TIER1_FFMPEG", default=None)
+            self.TIER2_FFMPEG = config("TIER2_FFMPEG", default=None)
+            self.TIER_HOURS = config("TIER_HOURS", default=str())
             self.UN_FINISHED_PROGRESS_STR = config(
                 "UN_FINISHED_PROGRESS_STR", default="🤍"
             )
+            self.UPLOAD_SLOTS = config("UPLOAD_SLOTS", default=1, cast=int)
             self.UAV = config("UPLOAD_AS_VIDEO", default=False, cast=bool)
             self.USE_ANILIST = config("USE_ANILIST", default=True, cast=bool)
             self.USE_CAPTION = config("USE_CAPTION", default=True, cast=bool)
             self.UVS = config("UPLOAD_VIDEO_AS_SPOILER", default=False, cast=bool)
+            self.VALIDATE = config("VALIDATE", default=False, cast=bool)
             self.WORKERS = config("WORKERS", default=2, cast=int)
         except Exception:
             print("Environment vars Missing; or")
@@ -115,9 +157,12 @@ class Runtime_Config:
         self.cached = False
         self.cached_dl = False
         self.custom_rename = None
+        self.dead_letters = {}
         self.display_additional_dl_info = False
         self.docker_deployed = False
         self.e_cancel = {}
+        self.e_progress = {}
+        self.failures = {}
         self.group_enc = False
         self.groupenc = []
         self.max_message_length = 4096
@@ -126,10 +171,12 @@ class Runtime_Config:
         self.paused = []
         self.preview_batch = {}
         self.preview_list = []
+        self.quality = {}
         self.queue = {}
         self.queue_status = []
         self.r_queue = []
         self.repo_branch = None
+        self.results = {}
         self.report_failed_dl = False
         self.report_failed_enc = False
         self.rss_dict = {}
@@ -139,6 +186,7 @@ class Runtime_Config:
         self.started = False
         self.temp_only_in_group = False
         self.temp_users = []
+        self.tiers = {}
         self.u_cancel = []
         self.version2 = []
 
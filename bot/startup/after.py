@@ -3,7 +3,7 @@ import time
 from bot.config import _bot, conf
 from bot.fun.emojis import enmoji, enmoji2
 from bot.fun.quips import enquip, enquip2
-from bot.utils.bot_utils import encode_job as ejob
+from bot.utils.bot_utils import reset_jobs
 from bot.utils.log_utils import logger
 from bot.utils.rss_utils import scheduler
 from bot.workers.auto.status import autostat
@@ -158,7 +158,7 @@ async def on_startup():
             await asyncio.sleep(1)
             await onstart()
         await entime.start()
-        ejob.reset(force=True)
+        reset_jobs(force=True)
         await asyncio.sleep(30)
         asyncio.create_task(something())
     except Exception:
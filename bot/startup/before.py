@@ -66,6 +66,17 @@ if not file_exists(ffmpeg_file4) and conf.FFMPEG4:
     with open(ffmpeg_file4, "w") as file:
         file.write(str(conf.FFMPEG4) + "\n")
 
+# the faster tiers can only be set from the environment
+for tier_file, tier_params in (
+    (ffmpeg_tier1, conf.TIER1_FFMPEG),
+    (ffmpeg_tier2, conf.TIER2_FFMPEG),
+):
+    if tier_params:
+        with open(tier_file, "w") as file:
+            file.write(str(tier_params) + "\n")
+    elif file_exists(tier_file):
+        os.remove(tier_file)
+
 if not file_exists(mux_file) and conf.MUX_ARGS:
     with open(mux_file, "w") as file:
         file.write(str(conf.MUX_ARGS) + "\n")
@@ -136,6 +147,10 @@ if conf.DATABASE_URL:
 
     load_db(queuedb, "batches", _bot.batch_queue, "dict")
     load_db(queuedb, "queue", _bot.queue, "dict")
+    load_db(queuedb, "results", _bot.results, "dict")
+    load_db(queuedb, "tiers", _bot.tiers, "dict")
+    load_db(queuedb, "dead_letters", _bot.dead_letters, "dict")
+    load_db(queuedb, "quality", _bot.quality, "dict")
     load_db(userdb, "t_users", _bot.temp_users, "list")
     load_db(filterdb, "autoname", rename_file)
     load_db(filterdb, "cus_rename", None, "cust_r")
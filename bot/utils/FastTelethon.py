@@ -282,6 +282,24 @@ class ParallelTransferrer:
         await self._init_upload(connection_count, file_id, part_count, is_large)
         return part_size, part_count, is_large
 
+    async def init_part_upload(self, connection_count: int = 4) -> None:
+        """Connects senders for uploading parts in any order and count"""
+        self.senders = [
+            await self._create_sender(),
+            *await asyncio.gather(
+                *[self._create_sender() for i in range(1, connection_count)]
+            ),
+        ]
+
+    async def upload_part(
+        self, file_id: int, index: int, total: int, part: bytes
+    ) -> None:
+        # total is -1 while the size of the file isn't known yet
+        sender = self.senders[index % len(self.senders)]
+        await self.client._call(
+            sender, SaveBigFilePartRequest(file_id, index, total, part)
+        )
+
     async def upload(self, part: bytes) -> None:
         await self.senders[self.upload_ticker].next(part)
         self.upload_ticker = (self.upload_ticker + 1) % len(self.senders)
@@ -818,10 +818,11 @@ async def f_post(
     evt=True,
     direct=None,
     p_file=ffmpeg_file,
+    job=encode_job,
 ):
     if conf.NO_BANNER:
         return None, None
-    if encode_job.pending() != ffmpeg_file:
+    if p_file != ffmpeg_file:
         return None, None
     try:
         name = (await filter_name(name, _filter))[0]
@@ -852,7 +853,7 @@ async def f_post(
         tparse, title_ = await auto_rename(title, title, ar, general=True)
         anilist = False if not tparse else anilist
         title = title_
-        codec = fcodec if fcodec else await get_codecs(encode_job.get_pending())
+        codec = fcodec if fcodec else await get_codecs(job.profiles)
 
         try:
             if file_exists(parse_file) or not anilist or direct:
@@ -7,10 +7,10 @@ from bot.config import _bot
 
 from .ani_utils import qparse
 from .bot_utils import (
-    encode_job,
     get_bqueue,
     get_preview,
     get_queue,
+    get_slots,
     is_video_file,
     sdict,
 )
@@ -240,10 +240,10 @@ def get_downloadable_batch(q_id):
     return file_name, k, name
 
 
-def mark_file_as_done(file_id, q_id):
+def mark_file_as_done(file_id, q_id, job=None):
     if file_id is None:
         return
-    if encode_job.pending():
+    if (job or get_slots()[0].job).pending():
         return
     bqueue = get_bqueue()
     value = bqueue.get(q_id, False)
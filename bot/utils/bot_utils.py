@@ -2,6 +2,7 @@ import functools
 import os
 import zlib
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from functools import partial
 from pathlib import Path
 from re import match as re_match
@@ -30,6 +31,8 @@ from bot import (
 )
 from bot.config import _bot, conf
 
+from .governor import BACKGROUND, govern_thread
+
 OK = {}
 suffix = conf.CMD_SUFFIX
 
@@ -51,6 +54,10 @@ def enc_canceller():
     return _bot.e_cancel
 
 
+def enc_progress():
+    return _bot.e_progress
+
+
 def get_f():
     if not Path(filter_file).is_file():
         return
@@ -148,6 +155,8 @@ class Encode_info:
         self.cached_dl = False
         self.qbit = False
         self.select = None
+        self.output = None
+        self.size = None
         self.uri = None
         self._current = None
 
@@ -156,86 +165,54 @@ encode_info = Encode_info()
 
 
 class Encode_job:
+    """Tracks the encode profiles (ffmpeg.txt - ffmpeg4.txt) left for the current item"""
+
+    profile_files = (ffmpeg_file, ffmpeg_file2, ffmpeg_file3, ffmpeg_file4)
+
     def __init__(self):
         self.reset(force=True)
 
-    class Jobs:
-        def __init__(self):
-            self.f1 = True
-            self.f2 = Path(ffmpeg_file2).is_file()
-            self.f3 = Path(ffmpeg_file3).is_file()
-            self.f4 = Path(ffmpeg_file4).is_file()
-
     def jobs(self, list=False):
-        job = []
-        for x in (self.ins.f1, self.ins.f2, self.ins.f3, self.ins.f4):
-            job.append(x) if x else None
         if list:
-            return job
-        return len(job)
+            return self.ins.copy()
+        return len(self.ins)
 
     def complete(self):
-        for i in self.jobs(list=True):
-            self.done()
+        self.ins.clear()
 
     def done(self):
-        if self.ins.f1:
-            self.ins.f1 = None
-        elif self.ins.f2:
-            self.ins.f2 = None
-        elif self.ins.f3:
-            self.ins.f3 = None
-        elif self.ins.f4:
-            self.ins.f4 = None
+        self.ins.pop(0) if self.ins else None
 
     def get_pending(self):
-        list = []
-        if self.ins.f1:
-            list.append(ffmpeg_file)
-        if self.ins.f2:
-            list.append(ffmpeg_file2)
-        if self.ins.f3:
-            list.append(ffmpeg_file3)
-        if self.ins.f4:
-            list.append(ffmpeg_file4)
-        return list
+        return self.ins.copy()
 
     def get_pending_index(self):
-        if self.ins.f1:
-            return 1
-        elif self.ins.f2:
-            return 2
-        elif self.ins.f3:
-            return 3
-        elif self.ins.f4:
-            return 4
+        if self.ins:
+            return self.profile_files.index(self.ins[0]) + 1
 
     def get_pending_pos(self):
-        if self.ins.f1:
+        index = self.get_pending_index()
+        if not index or index == 1:
             return
-        elif self.ins.f2:
-            return "2nd"
-        elif self.ins.f3:
-            return "3rd"
-        elif self.ins.f4:
-            return "4th"
+        return {2: "2nd", 3: "3rd"}.get(index, f"{index}th")
 
     def pending(self):
-        if self.ins.f1:
-            return ffmpeg_file
-        elif self.ins.f2:
-            return ffmpeg_file2
-        elif self.ins.f3:
-            return ffmpeg_file3
-        elif self.ins.f4:
-            return ffmpeg_file4
+        if self.ins:
+            return self.ins[0]
 
     def reset(self, force=False):
         if not force and self.busy:
             return
-        self.ins = self.Jobs()
+        # the first profile is always used, the rest only if they have been set
+        self.profiles = [
+            file
+            for file, i in zip(self.profile_files, itertools.count())
+            if not i or Path(file).is_file()
+        ]
+        self.ins = self.profiles.copy()
         self.busy = False
         self.id = None
+        self.lock = asyncio.Lock()
         self.sminfo = None
         self.prev_dl_client = None
 
@@ -243,6 +220,113 @@ class Encode_job:
 encode_job = Encode_job()
 
 
+class Encode_slot:
+    """An encode slot; each slot works on its own queue item"""
+
+    def __init__(self, index=0):
+        self.index = index
+        # slot 0 keeps the module-wide job context for backwards compatibility
+        self.info = encode_info if not index else Encode_info()
+        self.job = encode_job if not index else Encode_job()
+        self.queue_id = None
+        self.dir = "encode" if not index else f"encode/slot{index}"
+        self.thumb = "thumb2.jpg" if not index else f"thumb2_{index}.jpg"
+        self.stage = None
+
+    def __str__(self):
+        return f"Slot {self.index}"
+
+    def claim(self):
+        """Returns the queue key this slot should work on"""
+        queue = get_queue()
+        if self.queue_id in queue:
+            return self.queue_id
+        self.queue_id = None
+        claimed = active_items()
+        for key in queue.keys():
+            if key not in claimed and not in_backoff(key):
+                self.queue_id = key
+                break
+        return self.queue_id
+
+    def release(self):
+        self.queue_id = None
+
+
+class Pipeline_stage:
+    """
+    Bounds how many queue items can be in a stage (download, encode or upload)
+    at once when PIPELINE is on; items wait for the stage in the order they got there.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.lock = asyncio.Semaphore(max(limit, 1))
+
+    def __str__(self):
+        return self.name
+
+    async def acquire(self, slot):
+        if conf.PIPELINE:
+            await self.lock.acquire()
+        slot.stage = self.name
+
+    def release(self, slot):
+        if conf.PIPELINE:
+            self.lock.release()
+
+    @asynccontextmanager
+    async def enter(self, slot):
+        await self.acquire(slot)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+
+pipeline = {
+    "download": Pipeline_stage("Downloading", conf.DOWNLOAD_SLOTS),
+    "encode": Pipeline_stage("Currently Encoding", conf.ENCODE_SLOTS),
+    "upload": Pipeline_stage("Uploading", conf.UPLOAD_SLOTS),
+}
+slot_count = conf.ENCODE_SLOTS
+if conf.PIPELINE:
+    # enough slots for every stage to be busy at once
+    slot_count += conf.DOWNLOAD_SLOTS + conf.UPLOAD_SLOTS
+encode_slots = [Encode_slot(i) for i in range(max(slot_count, 1))]
+
+
+def get_stage(name):
+    return pipeline[name]
+
+
+def get_slots():
+    return encode_slots
+
+
+def get_slot(job_id=None, queue_id=None):
+    for slot in encode_slots:
+        if job_id and slot.job.id == job_id:
+            return slot
+        if queue_id and slot.queue_id == queue_id:
+            return slot
+
+
+def active_items():
+    return [slot.queue_id for slot in encode_slots if slot.queue_id]
+
+
+def in_backoff(key):
+    """Whether a queue item has failed and must wait before it's tried again"""
+    failure = _bot.failures.get(key)
+    return bool(failure) and failure["retry_at"] > time.time()
+
+
+def reset_jobs(force=False):
+    for slot in encode_slots:
+        slot.job.reset(force)
+
+
 def my_decorator(f):
     @functools.wraps(f)
     def patch_parse(filename, options=None):
@@ -274,6 +358,10 @@ sdict.update(
 
 
 THREADPOOL = ThreadPoolExecutor(max_workers=1000)
+# low priority threads for copies and parsing that shouldn't slow down encodes
+BG_THREADPOOL = ThreadPoolExecutor(
+    max_workers=4, initializer=govern_thread, initargs=(BACKGROUND,)
+)
 MAGNET_REGEX = r"magnet:\?xt=urn:[a-z0-9]+:[a-zA-Z0-9]{32}"
 URL_REGEX = r"^(https?://|ftp://)?(www\.)?[^/\s]+\.[^/\s:]+(:\d+)?(/[^?\s]*[\s\S]*)?(\?[^#\s]*[\s\S]*)?(#.*)?$"
 SIZE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
@@ -644,6 +732,23 @@ def hbs(size: int):
     return str(round(size, 2)) + " " + dict_power_n[raised_to_pow] + "B"
 
 
+def parse_size(value: str):
+    """
+    '350M', '1.2GB', '1T' or '500B' to bytes, binary units as hbs uses;
+    a plain number like '700' is taken as MB; None if invalid
+    """
+    match = re_match(r"(?i)([\d.]+)\s*(?:([KMGT])i?)?(B?)$", str(value).strip())
+    if not match:
+        return
+    try:
+        size = float(match.group(1))
+    except ValueError:
+        return
+    unit = match.group(2) or ("" if match.group(3) else "M")
+    power = "KMGT".find(unit.upper()) + 1 if unit else 0
+    return int(size * 2 ** (10 * power)) or None
+
+
 async def crc32(filename: str, chunksize=65536):
     """Compute the CRC-32 checksum of the contents of the given filename"""
     with open(filename, "rb") as f:
@@ -767,3 +872,10 @@ async def sync_to_async(func, *args, wait=True, **kwargs):
     loop = asyncio.get_event_loop()
     future = loop.run_in_executor(THREADPOOL, pfunc)
     return await future if wait else future
+
+
+async def background_call(func, *args, **kwargs):
+    """sync_to_async for background work; runs with the background role"""
+    pfunc = partial(func, *args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(BG_THREADPOOL, pfunc)
@@ -0,0 +1,76 @@
+import hashlib
+import re
+
+from bot import mux_file, time
+from bot.config import _bot, conf
+
+from .db_utils import save2db
+from .os_utils import file_exists
+
+BTIH_REGEX = r"xt=urn:btih:([a-zA-Z0-9]+)"
+
+
+def source_id(message, uri=None, select=None):
+    """
+    What identifies a source regardless of who sent it or from where:
+    the torrent's infohash, the uri itself or the telegram file's unique id
+    """
+    if uri:
+        source = uri
+        if match := re.search(BTIH_REGEX, uri):
+            source = "btih:" + match.group(1).lower()
+        return source if select is None else f"{source}#{select}"
+    media = message.video or message.document if message else None
+    return f"tg:{media.file_unique_id}" if media else None
+
+
+def params_hash(param_file, size=None):
+    """Hash of everything that decides what an encode looks like"""
+    params = hashlib.sha256()
+    for file in (param_file, mux_file):
+        if file_exists(file):
+            with open(file, "r") as f:
+                params.update(f.read().strip().encode())
+        params.update(b"\0")
+    params.update(f"{size}:{conf.UAV}:{conf.ENCODER}".encode())
+    params.update(f"{conf.AUTO_CROP}:{conf.KEEP_LANGS}:{conf.COPY_CODECS}".encode())
+    return params.hexdigest()
+
+
+def result_key(source, param_file, *naming):
+    """The cache key of a source's output for a profile and naming inputs"""
+    key = hashlib.sha256(f"{source}\0{param_file}\0{naming}".encode())
+    return key.hexdigest()
+
+
+def get_result(key, params):
+    """
+    Returns the cached upload for key or None;
+    entries that are stale or were made with other parameters are dropped
+    """
+    if not (conf.RESULT_CACHE and (result := _bot.results.get(key))):
+        return
+    age = time.time() - result["time"]
+    if result["params"] != params or age > conf.RESULT_CACHE_DAYS * 86400:
+        _bot.results.pop(key, None)
+        return
+    return result
+
+
+async def add_result(key, params, message):
+    """Caches an uploaded output, evicting the oldest entries past the limit"""
+    if not conf.RESULT_CACHE:
+        return
+    media = message.video or message.document
+    if not media:
+        return
+    _bot.results.pop(key, None)
+    _bot.results[key] = {
+        "params": params,
+        "file_id": media.file_id,
+        "caption": message.caption.html if message.caption else None,
+        "time": time.time(),
+    }
+    while len(_bot.results) > conf.RESULT_CACHE:
+        _bot.results.pop(next(iter(_bot.results)))
+    await save2db("results")
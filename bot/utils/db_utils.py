@@ -19,8 +19,15 @@ database = conf.DATABASE_URL
 
 async def save2db(db="queue", retries=3):
     if not database:
-        return await sync_to_async(save2db_lcl)
-    d = {"queue": _bot.queue, "batches": _bot.batch_queue}
+        return await sync_to_async(save2db_lcl, db)
+    d = {
+        "queue": _bot.queue,
+        "batches": _bot.batch_queue,
+        "results": _bot.results,
+        "dead_letters": _bot.dead_letters,
+        "quality": _bot.quality,
+        "tiers": _bot.tiers,
+    }
     data = pickle.dumps(d.get(db))
     _update = {db: data}
     while retries:
@@ -0,0 +1,86 @@
+import errno
+
+from telethon.errors import UnauthorizedError
+
+from bot import pyro_errors, time
+from bot.config import _bot, conf
+
+from .bot_utils import get_bqueue, get_queue, time_formatter
+from .db_utils import save2db
+from .log_utils import log
+
+# errors every other item would run into as well
+GLOBAL_ERRNOS = (errno.ENOSPC, errno.EDQUOT, errno.EROFS)
+
+
+def global_fault(error):
+    """
+    What's wrong if an error isn't the fault of the item being worked on:
+    a full or read-only disk or a dead telegram session; None otherwise
+    """
+    if isinstance(error, OSError) and error.errno in GLOBAL_ERRNOS:
+        return error.strerror or "Disk error"
+    if isinstance(error, (pyro_errors.Unauthorized, UnauthorizedError)):
+        return f"Telegram session is no longer valid ({error.__class__.__name__})"
+
+
+async def item_failed(key, trace, output=None):
+    """
+    Counts a failure of a queue item and holds it back for a while,
+    longer after every failure; after MAX_FAILURES it's moved from the
+    queue to the dead letters with the traceback and the encoder's output
+    and its name is returned
+    """
+    queue = get_queue()
+    if not (item := queue.get(key)):
+        return
+    failure = _bot.failures.setdefault(key, {"count": 0})
+    failure["count"] += 1
+    count = failure["count"]
+    if count < conf.MAX_FAILURES:
+        backoff = conf.FAIL_BACKOFF * 2 ** (count - 1)
+        failure["retry_at"] = time.time() + backoff
+        log(e=f"{item[0]} failed ({count}/{conf.MAX_FAILURES}), retrying in {backoff}s")
+        return
+    _bot.failures.pop(key, None)
+    queue.pop(key, None)
+    batch = get_bqueue().pop(key, None)
+    _bot.dead_letters.pop(key, None)
+    _bot.dead_letters[key] = {
+        "item": item,
+        "batch": batch,
+        "failures": count,
+        "traceback": trace,
+        "output": output.decode(errors="replace") if output else None,
+        "time": time.time(),
+    }
+    log(e=f"{item[0]} failed {count} times, moved to the dead letters")
+    await save2db()
+    await save2db("batches")
+    await save2db("dead_letters")
+    return item[0]
+
+
+def clear_failure(key):
+    """Forgets the failures of an item that's done or no longer queued"""
+    _bot.failures.pop(key, None)
+
+
+async def requeue(key):
+    """Puts a dead letter back at the end of the queue, returns its name"""
+    if not (dead := _bot.dead_letters.pop(key, None)):
+        return
+    get_queue().update({key: dead["item"]})
+    if dead["batch"]:
+        get_bqueue().update({key: dead["batch"]})
+    await save2db()
+    await save2db("batches")
+    await save2db("dead_letters")
+    return dead["item"][0]
+
+
+def dead_letter_summary(dead):
+    """One line about why an item ended in the dead letters"""
+    lines = (dead["traceback"] or str()).strip().splitlines()
+    age = time_formatter(time.time() - dead["time"])
+    return f"{dead['failures']} failures, {age} ago: {lines[-1] if lines else '?'}"
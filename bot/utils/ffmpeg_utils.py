@@ -0,0 +1,1419 @@
+import json
+import os
+import re
+import shlex
+import time
+from collections import deque
+
+# remuxes every stream of the source as it is
+COPY_CMD = 'ffmpeg -i """{}""" -map 0 -c copy """{}""" -y'
+# options that never take a value
+NO_VALUE_OPTS = (
+    "-y",
+    "-n",
+    "-an",
+    "-vn",
+    "-sn",
+    "-dn",
+    "-hide_banner",
+    "-nostdin",
+    "-nostats",
+    "-stats",
+    "-shortest",
+    "-copyts",
+    "-start_at_zero",
+    "-re",
+    "-accurate_seek",
+    "-noaccurate_seek",
+    "-autorotate",
+    "-noautorotate",
+)
+# options that apply to every ffmpeg invocation of a job
+GLOBAL_OPTS = ("-y", "-n", "-hide_banner", "-nostdin", "-loglevel", "-v")
+# options that only matter when muxing the final output
+MUX_OPTS = (
+    "-an",
+    "-sn",
+    "-dn",
+    "-acodec",
+    "-scodec",
+    "-ab",
+    "-ac",
+    "-ar",
+    "-af",
+    "-aq",
+    "-attach",
+    "-avoid_negative_ts",
+    "-copyts",
+    "-default_mode",
+    "-disposition",
+    "-f",
+    "-map",
+    "-map_chapters",
+    "-map_metadata",
+    "-max_interleave_delta",
+    "-max_muxing_queue_size",
+    "-metadata",
+    "-movflags",
+    "-shortest",
+    "-start_at_zero",
+)
+# options that change what gets encoded in ways a chunk can't reproduce
+UNCHUNKABLE_OPTS = (
+    "-filter_complex",
+    "-filter_complex_script",
+    "-frames",
+    "-fs",
+    "-lavfi",
+    "-pass",
+    "-passlogfile",
+    "-ss",
+    "-sseof",
+    "-t",
+    "-to",
+    "-vframes",
+    "-vn",
+)
+# options of a remux that pick inputs, streams or codecs of their own
+REMUX_OWN_OPTS = (
+    "-i",
+    "-map",
+    "-c",
+    "-codec",
+    "-vcodec",
+    "-acodec",
+    "-scodec",
+    "-vf",
+    "-af",
+    "-filter",
+    "-filter_complex",
+    "-lavfi",
+)
+# options that only apply to audio whatever their stream specifier
+AUDIO_OPTS = ("-acodec", "-ab", "-ac", "-af", "-ar", "-aq")
+# options and encoder params that set the video's quality or bitrate
+RATE_OPTS = (
+    "-b",
+    "-bufsize",
+    "-cq",
+    "-crf",
+    "-global_quality",
+    "-maxrate",
+    "-minrate",
+    "-q",
+    "-qp",
+    "-qscale",
+    "-rc",
+)
+RATE_PARAMS = ("bitrate", "cq", "crf", "pass", "qp", "rc", "stats", "vbv-bufsize")
+# encoders that are given two passes when encoding to a size
+TWO_PASS_CODECS = ("libaom-av1", "libvpx", "libvpx-vp9", "libx264", "libx265")
+STREAM_KINDS = {
+    "video": "v",
+    "audio": "a",
+    "subtitle": "s",
+    "attachment": "t",
+    "data": "d",
+}
+# bit/s assumed for audio when the actual rate can't be known in advance
+AUDIO_BITRATE = 128000
+MIN_VIDEO_BITRATE = 50000
+# share of the output taken up by container overhead
+MUX_OVERHEAD = 0.01
+# seconds, and share of the source's duration, an output's duration may be off by
+DURATION_TOLERANCE = 2
+DURATION_SLACK = 0.005
+# pixels a detected crop has to take off a side before it's used
+MIN_CROP = 8
+# options that make an output cover only part of its source
+TRIM_OPTS = ("-frames", "-fs", "-ss", "-sseof", "-t", "-to", "-vframes")
+
+
+MAP_REGEX = re.compile(r"""(?<!\S)-map\s+("[^"]*"|'[^']*'|\S+)\s*""")
+DISPOSITION_REGEX = re.compile(r"(?<!\S)-disposition:([as]):(\d+)\s+(\S+)\s*")
+CROP_REGEX = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+SSIM_REGEX = re.compile(r"SSIM .*All:([\d.]+)")
+PSNR_REGEX = re.compile(r"PSNR .*average:([\d.]+|inf)")
+FF_PROGRESS = re.compile(r"^[a-z0-9_]+=")
+HB_PROGRESS = re.compile(
+    r"Encoding: task \d+ of \d+, ([\d.]+) %"
+    r"(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?"
+)
+
+
+def split_args(cmd):
+    """Splits a shell command into arguments, returns None if it can't be parsed"""
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return None
+
+
+def opt_spec(opt):
+    """Returns the option name and stream specifier of an option (-c:a:0 -> -c, a:0)"""
+    name, _sep, spec = opt.partition(":")
+    return name, spec
+
+
+def pair_args(args):
+    """Groups a list of ffmpeg options into (option, value) pairs"""
+    pairs = []
+    i = 0
+    while i < len(args):
+        opt = args[i]
+        if not opt.startswith("-") or opt_spec(opt)[0] in NO_VALUE_OPTS:
+            pairs.append((opt, None))
+            i += 1
+            continue
+        pairs.append((opt, args[i + 1] if i + 1 < len(args) else None))
+        i += 2
+    return pairs
+
+
+def map_selects(maps, kind, index):
+    """Whether -map values pick the index'th source stream of a kind"""
+    selected = False
+    for value in maps:
+        spec = value.lstrip("-").rstrip("?").split(":")
+        if len(spec) > 1 and spec[1] not in (kind, kind.upper()):
+            continue
+        if len(spec) > 2 and spec[2] != str(index):
+            continue
+        selected = not value.startswith("-")
+    return selected
+
+
+def unpair_args(pairs):
+    args = []
+    for opt, value in pairs:
+        args.append(opt)
+        args.append(value) if value is not None else None
+    return args
+
+
+def is_ffmpeg(args):
+    return bool(args) and os.path.split(args[0])[1] == "ffmpeg"
+
+
+def io_positions(args):
+    """
+    Positions of the '-i' and the output '{}' in the arguments of an
+    'ffmpeg -i {} [options] {}' command, None if it has other inputs or outputs
+    """
+    if args.count("-i") != 1 or args.count("{}") != 2:
+        return
+    i_pos = args.index("-i")
+    o_pos = len(args) - 1 - args[::-1].index("{}")
+    if args[i_pos + 1] != "{}" or o_pos <= i_pos + 1:
+        return
+    return i_pos, o_pos
+
+
+def front_opts(args):
+    """Sorts the options in front of -i into global and input options"""
+    global_opts, input_opts = [], []
+    for opt, value in pair_args(args):
+        opts = global_opts if opt_spec(opt)[0] in GLOBAL_OPTS else input_opts
+        opts.extend(unpair_args([(opt, value)]))
+    return global_opts, input_opts
+
+
+def before_output(cmd, text):
+    """Puts text into a command string right before its output '{}' and quotes"""
+    o_pos = cmd.rfind("{}")
+    while o_pos and cmd[o_pos - 1] in "\"'":
+        o_pos -= 1
+    return f"{cmd[:o_pos]}{text} {cmd[o_pos:]}"
+
+
+class Chunk_plan:
+    """
+    Builds the commands for encoding a single source in keyframe aligned chunks
+    from an ffmpeg command in the 'ffmpeg -i {} [options] {}' form.
+    If the command can't be split 'error' holds the reason.
+    """
+
+    def __init__(self, cmd, infile, outfile, workdir):
+        self.error = None
+        self.infile = infile
+        self.outfile = outfile
+        self.workdir = workdir
+        self.concat_file = os.path.join(workdir, "concat.txt")
+        self.manifest = os.path.join(workdir, "manifest.json")
+        self.video = os.path.join(workdir, "video.mkv")
+        self.exe = None
+        self.global_opts = []
+        self.input_opts = []
+        self.chunk_opts = []
+        self.mux_opts = []
+        self.video_map = "0:v:0"
+        try:
+            self.parse(cmd)
+        except Exception as e:
+            self.error = f"Could not parse command: {e}"
+
+    def __str__(self):
+        return self.error or self.workdir
+
+    def parse(self, cmd):
+        args = split_args(cmd)
+        if not args:
+            self.error = "Could not parse command"
+            return
+        self.exe = args[0]
+        if not is_ffmpeg(args):
+            self.error = "Only ffmpeg commands can be chunked"
+            return
+        if not (positions := io_positions(args)):
+            self.error = "Command must have exactly one input and one output"
+            return
+        i_pos, o_pos = positions
+        self.global_opts, self.input_opts = front_opts(args[1:i_pos])
+        out_pairs = pair_args(args[i_pos + 2 : o_pos]) + pair_args(args[o_pos + 1 :])
+        maps = []
+        for opt, value in out_pairs:
+            name, spec = opt_spec(opt)
+            stype = spec.split(":")[0]
+            if name in UNCHUNKABLE_OPTS:
+                self.error = f"'{opt}' is not supported in chunked mode"
+                return
+            if name in ("-vf", "-filter") and value:
+                if stype not in ("", "v"):
+                    self.mux_opts.append((opt, value))
+                    continue
+                if any(x in value for x in ("subtitles", "ass=", "{}", "movie=")):
+                    self.error = "Filters that read other files can't be chunked"
+                    return
+            if name in GLOBAL_OPTS:
+                self.global_opts.extend(unpair_args([(opt, value)]))
+            elif name == "-map":
+                maps.append(value)
+            elif name in ("-c", "-codec") and not spec:
+                self.chunk_opts.append((opt, value))
+                self.mux_opts.append((opt, value))
+            elif name in MUX_OPTS or stype in ("a", "s", "t", "d"):
+                self.mux_opts.append((opt, value))
+            else:
+                self.chunk_opts.append((opt, value))
+        self.mux_opts = self.remap(maps) + self.mux_opts
+
+    def remap(self, maps):
+        """Rewrites stream maps so video comes from the concatenated chunks"""
+        if not maps:
+            return [("-map", "1:v:0"), ("-map", "0:a:0?"), ("-map", "0:s:0?")]
+        pairs = []
+        video = False
+        for value in maps:
+            spec = value.lstrip("-").rstrip("?").split(":")
+            negative = value.startswith("-")
+            if spec[0] != "0" or (len(spec) > 1 and spec[1].isdigit()):
+                raise ValueError(f"unsupported map '{value}'")
+            if len(spec) > 1 and spec[1] in ("v", "V"):
+                if not (negative or video):
+                    self.video_map = "0:v:" + (spec[2] if len(spec) > 2 else "0")
+                    pairs.append(("-map", "1:v:0"))
+                    video = True
+                continue
+            if len(spec) > 1 and spec[1] in ("a", "s", "t", "d") or negative:
+                pairs.append(("-map", value))
+                continue
+            # maps every stream of a kind not known in advance, video included
+            if not video:
+                pairs.append(("-map", "1:v:0"))
+                video = True
+            pairs.extend((("-map", value), ("-map", "-0:v")))
+        return pairs
+
+    def chunks(self):
+        return sorted(
+            os.path.join(self.workdir, x)
+            for x in os.listdir(self.workdir)
+            if x.startswith("chunk") and x.endswith(".mkv")
+        )
+
+    def encoded(self, chunk):
+        folder, name = os.path.split(chunk)
+        return os.path.join(folder, "enc" + name[len("chunk") :])
+
+    def signature(self, seconds):
+        """What the chunks on disk depend on"""
+        return {
+            "size": os.path.getsize(self.infile),
+            "split": self.split_cmd(seconds),
+            "args": self.encode_args(),
+        }
+
+    def checkpoint(self, seconds, done):
+        """Records the chunks that have been encoded so far"""
+        manifest = {
+            "seconds": seconds,
+            "signature": self.signature(seconds),
+            "done": sorted(done),
+        }
+        with open(self.manifest + ".tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(self.manifest + ".tmp", self.manifest)
+
+    def load_checkpoint(self):
+        """
+        Returns the split length and encoded chunks of an earlier run
+        on the same source and command, or None if there's nothing to resume
+        """
+        try:
+            with open(self.manifest, "r") as file:
+                manifest = json.load(file)
+            seconds = manifest["seconds"]
+            signature = json.loads(json.dumps(self.signature(seconds)))
+            chunks = self.chunks()
+            if manifest["signature"] != signature or not chunks:
+                return None
+            done = {
+                x
+                for x in manifest["done"]
+                if (chunk := os.path.join(self.workdir, x)) in chunks
+                and os.path.isfile(self.encoded(chunk))
+            }
+            return seconds, done
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def split_cmd(self, seconds):
+        return [
+            self.exe,
+            *self.global_opts,
+            "-i",
+            self.infile,
+            "-map",
+            self.video_map,
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_time",
+            str(seconds),
+            "-segment_format",
+            "matroska",
+            "-reset_timestamps",
+            "1",
+            os.path.join(self.workdir, "chunk%05d.mkv"),
+            "-y",
+        ]
+
+    def encode_args(self):
+        """Options for encoding a chunk, grouped by where they go in the command"""
+        return {
+            "global": self.global_opts,
+            "input": self.input_opts,
+            "output": unpair_args(self.chunk_opts)
+            + ["-map", "0:v:0", "-an", "-sn", "-dn", "-f", "matroska"],
+        }
+
+    def encode_cmd(self, chunk):
+        args = self.encode_args()
+        return [
+            self.exe,
+            *args["global"],
+            *args["input"],
+            "-i",
+            chunk,
+            *args["output"],
+            self.encoded(chunk),
+            "-y",
+        ]
+
+    def concat_cmd(self):
+        with open(self.concat_file, "w") as file:
+            for chunk in self.chunks():
+                name = os.path.split(self.encoded(chunk))[1]
+                file.write(f"file '{name}'\n")
+        return [
+            self.exe,
+            *self.global_opts,
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            self.concat_file,
+            "-c",
+            "copy",
+            self.video,
+            "-y",
+        ]
+
+    def mux_cmd(self):
+        return [
+            self.exe,
+            *self.global_opts,
+            "-i",
+            self.infile,
+            "-i",
+            self.video,
+            *unpair_args(self.mux_opts),
+            "-c:v",
+            "copy",
+            self.outfile,
+            "-y",
+        ]
+
+
+class Size_plan:
+    """
+    Builds the commands for encoding a source to a target size (in bytes)
+    from an ffmpeg command in the 'ffmpeg -i {} [options] {}' form;
+    the video bitrate is worked out from the source's duration and what
+    the other streams will take up. Encoders in TWO_PASS_CODECS get two
+    passes, the rest a single pass with a constrained bitrate.
+    If the command can't be used 'error' holds the reason.
+    """
+
+    def __init__(self, cmd, infile, outfile, size, workdir):
+        self.error = None
+        self.infile = infile
+        self.outfile = outfile
+        self.size = size
+        self.workdir = workdir
+        self.passlog = os.path.join(workdir, "pass")
+        self.exe = None
+        self.global_opts = []
+        self.input_opts = []
+        self.out_pairs = []
+        self.codec = None
+        self.audio_codec = None
+        self.audio_bitrate = None
+        self.maps = []
+        self.no_audio = False
+        self.bitrate = None
+        self.duration = None
+        self.overhead = 0
+        try:
+            self.parse(cmd)
+        except Exception as e:
+            self.error = f"Could not parse command: {e}"
+
+    def __str__(self):
+        return self.error or self.outfile
+
+    def parse(self, cmd):
+        args = split_args(cmd)
+        if not args:
+            self.error = "Could not parse command"
+            return
+        self.exe = args[0]
+        if not is_ffmpeg(args):
+            self.error = "Only ffmpeg commands can encode to a size"
+            return
+        if not (positions := io_positions(args)):
+            self.error = "Command must have exactly one input and one output"
+            return
+        i_pos, o_pos = positions
+        self.global_opts, self.input_opts = front_opts(args[1:i_pos])
+        out_pairs = pair_args(args[i_pos + 2 : o_pos]) + pair_args(args[o_pos + 1 :])
+        for opt, value in out_pairs:
+            name, spec = opt_spec(opt)
+            stype = spec.split(":")[0]
+            if name in GLOBAL_OPTS:
+                self.global_opts.extend(unpair_args([(opt, value)]))
+                continue
+            if name in ("-c", "-codec") and stype in ("", "v") or name == "-vcodec":
+                self.codec = value
+            if name in ("-c", "-codec") and stype in ("", "a") or name == "-acodec":
+                self.audio_codec = value
+            if name == "-b" and stype == "a" or name == "-ab":
+                self.audio_bitrate = value
+            if name == "-map":
+                self.maps.append(value)
+            if name == "-an":
+                self.no_audio = True
+            if name in RATE_OPTS and stype in ("", "v"):
+                continue
+            if name in ("-pass", "-passlogfile"):
+                continue
+            if name.endswith("-params") or name == "-x264opts":
+                value = ":".join(
+                    x
+                    for x in (value or "").split(":")
+                    if x.split("=")[0] not in RATE_PARAMS
+                )
+                if not value:
+                    continue
+            self.out_pairs.append((opt, value))
+        if not self.codec or self.codec == "copy":
+            self.error = "Command must set a video encoder"
+
+    def selected(self, stream, index):
+        """Whether a source stream ends up in the output"""
+        kind = STREAM_KINDS.get(stream.get("codec_type"))
+        if kind == "a" and self.no_audio:
+            return False
+        if not self.maps:
+            # ffmpeg picks a stream of each kind by itself
+            return kind in ("a", "s") and not index
+        return map_selects(self.maps, kind, index)
+
+    def stream_bits(self, stream):
+        """Bits a copied or encoded audio, subtitle or attachment stream adds"""
+        tags = {k.split("-")[0].upper(): v for k, v in stream.get("tags", {}).items()}
+        if stream["codec_type"] == "attachment":
+            return int(stream.get("extradata_size") or 0) * 8
+        if stream["codec_type"] == "subtitle":
+            return int(to_float(tags.get("NUMBER_OF_BYTES")) or 0) * 8
+        if self.audio_codec == "copy":
+            bitrate = to_float(stream.get("bit_rate")) or to_float(tags.get("BPS"))
+        else:
+            bitrate = to_bits(self.audio_bitrate)
+        return (bitrate or AUDIO_BITRATE) * self.duration
+
+    def estimate(self, details):
+        """Works out the video bitrate from the source's ffprobe output"""
+        try:
+            self.duration = float(details["format"]["duration"])
+            counts = {}
+            for stream in details["streams"]:
+                kind = stream.get("codec_type")
+                if kind not in ("audio", "subtitle", "attachment"):
+                    continue
+                index = counts[kind] = counts.get(kind, -1) + 1
+                if self.selected(stream, index):
+                    self.overhead += self.stream_bits(stream)
+        except (KeyError, TypeError, ValueError) as e:
+            self.error = f"Could not probe source: {e}"
+            return
+        bits = self.size * 8 * (1 - MUX_OVERHEAD) - self.overhead
+        self.bitrate = int(bits / self.duration) if self.duration else 0
+        if self.bitrate < MIN_VIDEO_BITRATE:
+            self.error = "Target size is too small for the source's duration"
+
+    def adjust(self, actual):
+        """Scales the bitrate by how far an encode was from the target size"""
+        wanted = self.size * 8 * (1 - MUX_OVERHEAD) - self.overhead
+        got = actual * 8 * (1 - MUX_OVERHEAD) - self.overhead
+        if got > 0:
+            self.bitrate = max(int(self.bitrate * wanted / got), MIN_VIDEO_BITRATE)
+
+    def two_pass(self):
+        return self.codec in TWO_PASS_CODECS
+
+    def rate_args(self, npass=None):
+        kbits = f"{self.bitrate // 1000}k"
+        args = ["-b:v", kbits]
+        if not npass:
+            # a single pass can only get close by capping how far it strays
+            args += ["-maxrate:v", f"{self.bitrate * 3 // 2000}k"]
+            args += ["-bufsize:v", f"{self.bitrate * 2 // 1000}k"]
+            if "nvenc" in self.codec:
+                args += ["-rc:v", "vbr", "-multipass:v", "fullres"]
+            return args
+        if self.codec != "libx265":
+            return args + ["-pass", str(npass), "-passlogfile", self.passlog]
+        # libx265 takes its pass options through x265-params
+        params = [f"pass={npass}", f"stats={self.passlog}.log"]
+        if npass == 1:
+            params.append("slow-firstpass=0")
+        for opt, value in self.out_pairs:
+            if opt == "-x265-params":
+                params.append(value)
+        return args + ["-x265-params", ":".join(params)]
+
+    def output_args(self, npass=None):
+        pairs = self.out_pairs
+        if self.codec == "libx265" and npass:
+            pairs = [x for x in pairs if x[0] != "-x265-params"]
+        return unpair_args(pairs) + self.rate_args(npass)
+
+    def first_pass_cmd(self):
+        video = [x for x in self.maps if ":v" in x or ":V" in x]
+        pairs = [
+            x
+            for x in pair_args(self.output_args(1))
+            if opt_spec(x[0])[0] not in MUX_OPTS
+            and opt_spec(x[0])[1].split(":")[0] not in ("a", "s", "t", "d")
+        ]
+        return [
+            self.exe,
+            *self.global_opts,
+            *self.input_opts,
+            "-i",
+            self.infile,
+            "-map",
+            video[0] if video else "0:v:0",
+            *unpair_args(pairs),
+            "-an",
+            "-sn",
+            "-dn",
+            "-f",
+            "null",
+            os.devnull,
+            "-y",
+        ]
+
+    def final_cmd(self):
+        return [
+            self.exe,
+            *self.global_opts,
+            *self.input_opts,
+            "-i",
+            self.infile,
+            *self.output_args(2 if self.two_pass() else None),
+            self.outfile,
+            "-y",
+        ]
+
+
+class Split_plan:
+    """
+    Builds the commands for encoding a source's video and each of its audio
+    tracks in processes of their own from an ffmpeg command in the
+    'ffmpeg -i {} [options] {}' form, and for muxing them with the source's
+    other streams without encoding again; audio that's only copied is taken
+    straight from the source.
+    If the command can't be split 'error' holds the reason.
+    """
+
+    def __init__(self, cmd, infile, outfile, workdir):
+        self.error = None
+        self.infile = infile
+        self.outfile = outfile
+        self.workdir = workdir
+        self.video = os.path.join(workdir, "video.mkv")
+        self.exe = None
+        self.global_opts = []
+        self.input_opts = []
+        self.video_opts = []
+        self.audio_opts = []
+        self.mux_opts = []
+        self.maps = []
+        self.no_audio = False
+        self.video_map = "0:v:0"
+        # (source audio index, output audio index) of the encoded tracks
+        self.tracks = []
+        self.copied = []
+        try:
+            self.parse(cmd)
+        except Exception as e:
+            self.error = f"Could not parse command: {e}"
+
+    def __str__(self):
+        return self.error or self.workdir
+
+    def parse(self, cmd):
+        args = split_args(cmd)
+        if not args:
+            self.error = "Could not parse command"
+            return
+        self.exe = args[0]
+        if not is_ffmpeg(args):
+            self.error = "Only ffmpeg commands can be split"
+            return
+        if not (positions := io_positions(args)):
+            self.error = "Command must have exactly one input and one output"
+            return
+        i_pos, o_pos = positions
+        self.global_opts, self.input_opts = front_opts(args[1:i_pos])
+        out_pairs = pair_args(args[i_pos + 2 : o_pos]) + pair_args(args[o_pos + 1 :])
+        for opt, value in out_pairs:
+            name, spec = opt_spec(opt)
+            stype = spec.split(":")[0]
+            if name in UNCHUNKABLE_OPTS:
+                self.error = f"'{opt}' is not supported when splitting streams"
+                return
+            if name in GLOBAL_OPTS:
+                self.global_opts.extend(unpair_args([(opt, value)]))
+            elif name == "-map":
+                self.maps.append(value)
+            elif name == "-an":
+                self.no_audio = True
+            elif name in ("-c", "-codec") and not spec:
+                self.video_opts.append((opt, value))
+                self.audio_opts.append((opt, value))
+                self.mux_opts.append((opt, value))
+            elif name in AUDIO_OPTS or stype == "a" and name not in MUX_OPTS:
+                if len(spec.split(":")) > 2 or spec[2:] and not spec[2:].isdigit():
+                    self.error = f"'{opt}' is not supported when splitting streams"
+                    return
+                self.audio_opts.append((opt, value))
+            elif name in MUX_OPTS or stype in ("s", "t", "d"):
+                self.mux_opts.append((opt, value))
+            else:
+                self.video_opts.append((opt, value))
+
+    def select(self, details):
+        """Picks the video and audio tracks to encode from the source's ffprobe output"""
+        try:
+            streams = details["streams"]
+        except (KeyError, TypeError) as e:
+            self.error = f"Could not probe source: {e}"
+            return
+        kinds = [STREAM_KINDS.get(x.get("codec_type")) for x in streams]
+        videos = [x for i, x in enumerate(streams) if kinds[i] == "v"]
+        audios = kinds.count("a")
+        if self.maps:
+            picks = [i for i in range(len(videos)) if map_selects(self.maps, "v", i)]
+            if not picks:
+                self.error = "Command must keep a video stream"
+                return
+            self.video_map = f"0:v:{picks[0]}"
+        elif not videos:
+            self.error = "Source has no video stream"
+            return
+        if self.no_audio:
+            audios = 0
+        picks = [
+            i for i in range(audios) if not self.maps or map_selects(self.maps, "a", i)
+        ]
+        # ffmpeg picks a single audio track by itself
+        picks = picks if self.maps else picks[:1]
+        for out_index, index in enumerate(picks):
+            if self.audio_codec(out_index) == "copy":
+                self.copied.append((index, out_index))
+            else:
+                self.tracks.append((index, out_index))
+        if not self.tracks:
+            self.error = "No audio to encode alongside the video"
+
+    def track_opts(self, out_index):
+        """The audio options that apply to an output audio track"""
+        pairs = []
+        for opt, value in self.audio_opts:
+            name, spec = opt_spec(opt)
+            if spec[2:] and spec[2:] != str(out_index):
+                continue
+            pairs.append((f"{name}:a" if spec[2:] else opt, value))
+        return pairs
+
+    def audio_codec(self, out_index):
+        codec = None
+        for opt, value in self.track_opts(out_index):
+            if opt_spec(opt)[0] in ("-c", "-codec", "-acodec"):
+                codec = value
+        return codec
+
+    def track(self, out_index):
+        return os.path.join(self.workdir, f"audio{out_index}.mka")
+
+    def video_cmd(self):
+        return [
+            self.exe,
+            *self.global_opts,
+            *self.input_opts,
+            "-i",
+            self.infile,
+            "-map",
+            self.video_map,
+            "-an",
+            "-sn",
+            "-dn",
+            *unpair_args(self.video_opts),
+            self.video,
+            "-y",
+        ]
+
+    def audio_cmd(self, index, out_index):
+        return [
+            self.exe,
+            *self.global_opts,
+            *self.input_opts,
+            "-i",
+            self.infile,
+            "-map",
+            f"0:a:{index}",
+            "-vn",
+            "-sn",
+            "-dn",
+            *unpair_args(self.track_opts(out_index)),
+            self.track(out_index),
+            "-y",
+        ]
+
+    def other_maps(self):
+        """Maps of the source's subtitles, attachments and data"""
+        if not self.maps:
+            return ["-map", "0:s:0?"]
+        maps = []
+        for value in self.maps:
+            spec = value.lstrip("-").rstrip("?").split(":")
+            if len(spec) == 1 and not value.startswith("-"):
+                maps.extend(("-map", "0:s?", "-map", "0:t?", "-map", "0:d?"))
+            elif len(spec) > 1 and spec[1] in ("s", "t", "d"):
+                maps.extend(("-map", value))
+        return maps
+
+    def mux_cmd(self):
+        inputs = ["-i", self.infile, "-i", self.video]
+        maps = ["-map", "1:v:0"]
+        encoded = {}
+        for i, (index, out_index) in enumerate(self.tracks):
+            inputs.extend(("-i", self.track(out_index)))
+            encoded[out_index] = f"{i + 2}:a:0"
+        copied = {out_index: f"0:a:{index}" for index, out_index in self.copied}
+        for out_index in sorted({**encoded, **copied}):
+            maps.extend(("-map", encoded.get(out_index) or copied[out_index]))
+        return [
+            self.exe,
+            *self.global_opts,
+            *inputs,
+            *maps,
+            *self.other_maps(),
+            *unpair_args(self.mux_opts),
+            "-c:v",
+            "copy",
+            "-c:a",
+            "copy",
+            self.outfile,
+            "-y",
+        ]
+
+
+def copy_rules(text):
+    """'hevc:3000 aac:192 opus' to {codec: max kbit/s or 0 for any bitrate}"""
+    rules = {}
+    for rule in (text or "").split():
+        codec, _sep, kbits = rule.partition(":")
+        rules[codec.lower()] = int(to_float(kbits) or 0)
+    return rules
+
+
+class Stream_plan:
+    """
+    Decides for every source stream whether an ffmpeg command in the
+    'ffmpeg -i {} [options] {}' form copies, encodes or drops it:
+    audio and subtitles in languages outside 'langs' are dropped (unless
+    that would leave no audio) and streams whose codec and bitrate are
+    within the copy rules are copied instead of encoded.
+    If the command can't be planned for 'error' holds the reason.
+    """
+
+    def __init__(self, cmd, details, langs=(), rules=None, copy_video=True):
+        self.error = None
+        self.cmd = cmd
+        self.langs = [x.lower() for x in langs]
+        self.rules = rules or {}
+        self.copy_video = copy_video
+        self.maps = []
+        self.skip = set()
+        self.filtered = set()
+        # [kind, source index, action, stream] with action copy, encode or drop
+        self.streams = []
+        try:
+            self.parse(cmd)
+            if not self.error:
+                self.plan(details)
+        except Exception as e:
+            self.error = f"Could not plan streams: {e}"
+
+    def __str__(self):
+        if self.error:
+            return self.error
+        counts = {}
+        for kind, index, action, stream in self.streams:
+            counts[action] = counts.get(action, 0) + 1
+        return ", ".join(f"{n} {action}" for action, n in counts.items())
+
+    def parse(self, cmd):
+        args = split_args(cmd)
+        if not is_ffmpeg(args) or "{}" not in args:
+            self.error = "Only 'ffmpeg -i {} [options] {}' commands can be planned"
+            return
+        for opt, value in pair_args(args[1:]):
+            name, spec = opt_spec(opt)
+            if name in ("-filter_complex", "-lavfi"):
+                self.filtered.update(("v", "a"))
+            elif name == "-vf" or name == "-filter" and spec[:1] == "v":
+                self.filtered.add("v")
+            elif name == "-af" or name == "-filter" and spec[:1] == "a":
+                self.filtered.add("a")
+            elif name == "-map" and value:
+                if value.startswith("["):
+                    self.error = "Streams come out of a filtergraph"
+                    return
+                self.maps.append(value)
+            elif name in ("-vn", "-an", "-sn", "-dn"):
+                self.skip.add(name[1])
+
+    def language(self, stream):
+        return stream.get("tags", {}).get("language", "und").lower()
+
+    def copyable(self, kind, stream):
+        if kind in self.filtered or kind == "v" and not self.copy_video:
+            return False
+        codec = stream.get("codec_name")
+        if kind not in ("v", "a") or codec not in self.rules:
+            return False
+        if not (cap := self.rules[codec]):
+            return True
+        tags = {k.split("-")[0].upper(): v for k, v in stream.get("tags", {}).items()}
+        bitrate = to_float(stream.get("bit_rate")) or to_float(tags.get("BPS"))
+        return bool(bitrate) and bitrate <= cap * 1000
+
+    def plan(self, details):
+        counts = {}
+        for stream in details["streams"]:
+            kind = STREAM_KINDS.get(stream.get("codec_type"))
+            if not kind:
+                continue
+            index = counts[kind] = counts.get(kind, -1) + 1
+            if kind in self.skip:
+                continue
+            if self.maps:
+                selected = map_selects(self.maps, kind, index)
+            else:
+                # ffmpeg picks a stream of each kind by itself
+                selected = kind in ("v", "a", "s") and not index
+            if not selected:
+                continue
+            action = "copy" if self.copyable(kind, stream) else "encode"
+            if kind == "t":
+                action = "copy"
+            lang = self.language(stream)
+            if self.langs and kind in ("a", "s") and lang != "und":
+                action = action if lang in self.langs else "drop"
+            self.streams.append([kind, index, action, stream])
+        audio = [x for x in self.streams if x[0] == "a"]
+        if audio and all(x[2] == "drop" for x in audio):
+            # no audio in a wanted language, keep what there is
+            for planned in audio:
+                planned[2] = "copy" if self.copyable("a", planned[3]) else "encode"
+        if not any(x[0] == "v" for x in self.streams):
+            self.error = "Command keeps no video stream"
+
+    def args(self):
+        """The -map and -c arguments of the plan in output order"""
+        args = []
+        for kind in ("v", "a", "s", "t", "d"):
+            kept = [x for x in self.streams if x[0] == kind and x[2] != "drop"]
+            for out_index, (kind, index, action, stream) in enumerate(kept):
+                args.extend(("-map", f"0:{kind}:{index}"))
+                if action == "copy" and kind != "t":
+                    args.extend((f"-c:{kind}:{out_index}", "copy"))
+        return args
+
+    def out_index(self, kind, index):
+        """Where a source stream ends up among the output's streams of its kind"""
+        kept = [x[1] for x in self.streams if x[0] == kind and x[2] != "drop"]
+        return kept.index(index) if index in kept else None
+
+    def dispositions(self, text):
+        """
+        Points audio and subtitle dispositions given by source index at
+        the same streams in the output, dropping those of dropped streams
+        """
+
+        def remap(match):
+            kind, index, value = match.groups()
+            out_index = self.out_index(kind, int(index))
+            if out_index is None:
+                return str()
+            return f"-disposition:{kind}:{out_index} {value} "
+
+        return DISPOSITION_REGEX.sub(remap, text)
+
+    def apply(self):
+        """The command with its own maps swapped for the plan's arguments"""
+        cmd = self.dispositions(MAP_REGEX.sub("", self.cmd))
+        return before_output(cmd, shlex.join(self.args()))
+
+
+def sample_cmd(cmd, infile, outfile, start, length, threads=None):
+    """
+    Turns an ffmpeg command in the 'ffmpeg -i {} [options] {}' form into one
+    that encodes 'length' seconds of infile from 'start'
+    returns None if the command isn't in that form
+    """
+    args = split_args(cmd)
+    if not is_ffmpeg(args) or not (positions := io_positions(args)):
+        return
+    i_pos, o_pos = positions
+    output = args[i_pos + 2 : o_pos] + args[o_pos + 1 :]
+    output = [x for x in output if x not in ("-y", "-n")]
+    if threads:
+        output += ["-threads", str(threads), "-filter_threads", str(threads)]
+    return [
+        args[0],
+        "-nostdin",
+        "-progress",
+        "pipe:1",
+        *args[1:i_pos],
+        "-ss",
+        str(start),
+        "-t",
+        str(length),
+        "-i",
+        infile,
+        *output,
+        outfile,
+        "-y",
+    ]
+
+
+def merge_outputs(cmds, infile):
+    """
+    Merges 'ffmpeg -i {} [options] {}' commands into one that decodes
+    infile once and writes every output.
+    cmds: list of (command, output); returns None if they can't be merged.
+    """
+    prefix = None
+    outputs = []
+    for cmd, out in cmds:
+        args = split_args(cmd)
+        if not is_ffmpeg(args) or not (positions := io_positions(args)):
+            return
+        i_pos, o_pos = positions
+        if any(x not in ("-y", "-n") for x in args[o_pos + 1 :]):
+            return
+        # every output has to agree on how the input is read
+        if prefix is not None and args[:i_pos] != prefix:
+            return
+        prefix = args[:i_pos]
+        outputs.extend(args[i_pos + 2 : o_pos] + [out])
+    return shlex.join(prefix + ["-i", infile] + outputs + ["-y"])
+
+
+def merge_mux_args(cmd, mux_args):
+    """
+    Puts the arguments of a '-codec copy' remux of an encode's output into
+    the encode's 'ffmpeg -i {} [options] {}' command so that no second pass
+    is needed; returns None if they have to stay a pass of their own.
+    """
+    args, m_args = split_args(cmd), split_args(mux_args)
+    if not is_ffmpeg(args) or m_args is None:
+        return
+    if "{}" not in args:
+        return
+    if any(opt_spec(x)[0] in REMUX_OWN_OPTS for x in m_args):
+        return
+    # 'auto' dispositions follow the source's stream order which -map can change
+    if "auto" in m_args and "-map" in (opt_spec(x)[0] for x in args):
+        return
+    return before_output(cmd, mux_args)
+
+
+def last_crop(text):
+    """The last crop cropdetect suggested in ffmpeg's output as (w, h, x, y)"""
+    if matches := CROP_REGEX.findall(text):
+        return tuple(int(x) for x in matches[-1])
+
+
+def stable_crop(rects, width, height):
+    """
+    The smallest rectangle that holds every sampled crop so dark scenes
+    don't cut into the picture; None if it hardly takes anything off
+    """
+    if not rects:
+        return
+    x = min(r[2] for r in rects)
+    y = min(r[3] for r in rects)
+    w = max(r[0] + r[2] for r in rects) - x
+    h = max(r[1] + r[3] for r in rects) - y
+    if width - w < MIN_CROP and height - h < MIN_CROP:
+        return
+    return w, h, x, y
+
+
+def quality_filter(width, height, crop=None):
+    """
+    Filtergraph comparing an output's video (input 0) with its source's
+    (input 1), cropped like the encode was and scaled to the output
+    """
+    ref = f"{crop}," if crop else str()
+    return (
+        "[0:v:0]setsar=1,split[d1][d2];"
+        f"[1:v:0]{ref}scale={width}:{height}:flags=bicubic,setsar=1,split[r1][r2];"
+        "[d1][r1]ssim;[d2][r2]psnr"
+    )
+
+
+def quality_scores(text):
+    """The SSIM and PSNR in ffmpeg's output of quality_filter(), None if missing"""
+    ssim, psnr = SSIM_REGEX.findall(text), PSNR_REGEX.findall(text)
+    return (
+        to_float(ssim[-1]) if ssim else None,
+        to_float(psnr[-1]) if psnr else None,
+    )
+
+
+def add_video_filter(cmd, vfilter):
+    """
+    Puts a filter in front of the video filters of an 'ffmpeg -i {} [options] {}'
+    command; returns None if the command filters through -filter_complex
+    """
+    args = split_args(cmd)
+    if not is_ffmpeg(args) or "{}" not in args:
+        return
+    names = [opt_spec(x) for x in args]
+    if any(x[0] in ("-filter_complex", "-lavfi") for x in names):
+        return
+    for i, (name, spec) in enumerate(names[:-1]):
+        if name == "-vf" or name == "-filter" and spec in ("v", "v:0"):
+            value = args[i + 1]
+            if (pos := cmd.find(value, cmd.find(args[i]))) < 0:
+                return
+            return f"{cmd[:pos]}{vfilter},{cmd[pos:]}"
+    return before_output(cmd, f"-vf {vfilter}")
+
+
+def media_duration(details):
+    """A file's duration in seconds from ffprobe's output, 0 if it isn't known"""
+    try:
+        return float(details["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def media_end(details):
+    """Timestamp the last frame of a file should end at"""
+    start = to_float(details.get("format", {}).get("start_time")) or 0
+    return start + media_duration(details)
+
+
+def media_kinds(details):
+    return {
+        STREAM_KINDS[x["codec_type"]]
+        for x in details.get("streams", [])
+        if x.get("codec_type") in STREAM_KINDS
+    }
+
+
+def duration_tolerance(duration):
+    return DURATION_TOLERANCE + duration * DURATION_SLACK
+
+
+def source_problem(details, end=None):
+    """
+    What's wrong with a source going by its ffprobe output and the timestamp
+    of its last video packet, None if nothing is
+    """
+    if not (details and details.get("streams")):
+        return "No streams could be read"
+    if "v" not in media_kinds(details):
+        return "No video stream"
+    if not (duration := media_duration(details)):
+        return "Duration could not be read"
+    wanted = media_end(details)
+    if end is not None and end < wanted - duration_tolerance(duration):
+        return f"Truncated, data ends at {end:.0f}s of {wanted:.0f}s"
+
+
+def expected_kinds(cmd, kinds):
+    """Which of video and audio an encode of a source with 'kinds' should have"""
+    args = split_args(cmd) or []
+    expected = kinds & {"v", "a"}
+    maps = [args[i + 1] for i, x in enumerate(args[:-1]) if x == "-map"]
+    if any(x.startswith("[") for x in maps):
+        # streams come out of a filtergraph
+        return set()
+    if maps:
+        wanted = set()
+        for value in maps:
+            spec = value.lstrip("-").split(":")
+            kind = spec[1].lower() if len(spec) > 1 else None
+            if value.startswith("-"):
+                wanted.discard(kind) if len(spec) == 2 else None
+            elif not value.endswith("?") and kind in (None, "v", "a"):
+                wanted |= {kind} if kind else {"v", "a"}
+        expected &= wanted
+    if "-vn" in args:
+        expected.discard("v")
+    if "-an" in args:
+        expected.discard("a")
+    return expected
+
+
+def output_problem(cmd, source, output):
+    """
+    What's wrong with an encode's output compared to its source going by
+    the ffprobe output of both, None if nothing is
+    """
+    if not (output and output.get("streams")):
+        return "No streams could be read"
+    names = [opt_spec(x)[0] for x in split_args(cmd) or []]
+    duration, o_duration = media_duration(source), media_duration(output)
+    if not any(x in TRIM_OPTS for x in names):
+        if abs(duration - o_duration) > duration_tolerance(duration):
+            return f"Output is {o_duration:.1f}s long, the source {duration:.1f}s"
+    kinds = {v: k for k, v in STREAM_KINDS.items()}
+    missing = expected_kinds(cmd, media_kinds(source)) - media_kinds(output)
+    if missing:
+        return "No " + " or ".join(kinds[x] for x in sorted(missing)) + " stream"
+
+
+def with_progress(cmd):
+    """Makes an ffmpeg command write machine readable progress to stdout"""
+    exe, _sep, args = cmd.strip().partition(" ")
+    if os.path.split(exe.strip("\"'"))[1] != "ffmpeg" or "-progress " in args:
+        return cmd
+    return f"{exe} -progress pipe:1 {args}"
+
+
+class Encode_log:
+    """
+    Keeps the last few lines an encoder writes to stderr and optionally
+    spills everything to a per-job file that is rotated once it gets too big.
+    """
+
+    def __init__(self, lines=100, spill=None, max_size=0):
+        self.lines = deque(maxlen=max(lines, 1))
+        self.spill = spill if max_size else None
+        self.max_size = max_size
+        self.file = None
+        self.partial = b""
+        self.status = False
+
+    def add(self, line, status=False):
+        if self.spill:
+            self.write(line + b"\n")
+        if not line.strip():
+            return
+        # status lines overwrite each other like they would on a terminal
+        if status and self.status and self.lines:
+            self.lines[-1] = line
+        else:
+            self.lines.append(line)
+        self.status = status
+
+    def feed(self, data):
+        *lines, self.partial = re.split(rb"(\r\n|\r|\n)", self.partial + data)
+        for line, end in zip(lines[::2], lines[1::2]):
+            self.add(line, end == b"\r")
+        if len(self.partial) > 65536:
+            self.add(self.partial)
+            self.partial = b""
+
+    async def read(self, stream):
+        """Consumes a subprocess stream until it's closed"""
+        try:
+            while data := await stream.read(65536):
+                self.feed(data)
+            if self.partial:
+                self.add(self.partial)
+                self.partial = b""
+        finally:
+            self.close()
+
+    def write(self, data):
+        if not self.file:
+            os.makedirs(os.path.split(self.spill)[0] or ".", exist_ok=True)
+            self.file = open(self.spill, "ab")
+        self.file.write(data)
+        if self.file.tell() < self.max_size:
+            return
+        self.file.close()
+        os.replace(self.spill, self.spill + ".1")
+        self.file = open(self.spill, "ab")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def tail(self):
+        return b"\n".join(self.lines)
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bits(value):
+    """'64k', '1.5M' or '96000' to bits per second"""
+    if not value:
+        return None
+    value = str(value).strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    if (number := to_float(value.rstrip("km"))) is None:
+        return None
+    return number * scale
+
+
+class Encode_progress:
+    """
+    Live progress of an encode; fed with ffmpeg's -progress output
+    or HandBrakeCLI's status lines.
+    Times are in seconds, sizes in bytes and bitrate in kbit/s.
+    """
+
+    def __init__(self, duration=None, out=None):
+        self.duration = duration
+        self.out = out
+        self.bitrate = None
+        self.done = False
+        self.eta = None
+        self.fps = None
+        self.frame = None
+        self.out_time = None
+        self.percentage = None
+        self.size = None
+        self.speed = None
+        self.started = time.time()
+        self.updated = None
+
+    def __str__(self):
+        if self.percentage is None:
+            return "N/A"
+        return f"{self.percentage:.2f}%"
+
+    @property
+    def projected_size(self):
+        size = self.size
+        if not size and self.out and os.path.isfile(self.out):
+            size = os.path.getsize(self.out)
+        if not (size and self.percentage):
+            return
+        return int(size * 100 / self.percentage)
+
+    def update(self, line):
+        """Returns True if line was a progress line"""
+        line = line.strip()
+        if match := HB_PROGRESS.search(line):
+            self.handbrake(match)
+        elif FF_PROGRESS.match(line):
+            key, value = line.split("=", 1)
+            self.ffmpeg(key, value.strip())
+        else:
+            return False
+        self.updated = time.time()
+        return True
+
+    def ffmpeg(self, key, value):
+        if key == "frame":
+            self.frame = int(to_float(value) or 0)
+        elif key == "fps":
+            self.fps = to_float(value)
+        elif key == "bitrate":
+            self.bitrate = to_float(value.removesuffix("kbits/s"))
+        elif key == "total_size":
+            self.size = int(to_float(value) or 0)
+        elif key == "out_time_us":
+            if (out_time := to_float(value)) is not None:
+                self.out_time = max(out_time, 0) / 1000000
+        elif key == "speed":
+            self.speed = to_float(value.removesuffix("x"))
+        elif key == "progress":
+            # a batch of keys always ends with progress=continue|end
+            self.done = value == "end"
+            self.refresh()
+
+    def handbrake(self, match):
+        pct, fps, avg, hours, minutes, seconds = match.groups()
+        self.percentage = min(float(pct), 100.0)
+        self.fps = to_float(fps)
+        if hours is not None:
+            self.eta = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        if self.duration:
+            self.out_time = self.duration * self.percentage / 100
+            elapsed = time.time() - self.started
+            self.speed = (self.out_time / elapsed) if elapsed else None
+
+    def refresh(self):
+        """Works out percentage and eta from the source duration"""
+        if not (self.duration and self.out_time is not None):
+            return
+        self.percentage = min(self.out_time * 100 / self.duration, 100.0)
+        speed = self.speed
+        if not speed:
+            elapsed = time.time() - self.started
+            speed = (self.out_time / elapsed) if elapsed else None
+        if speed:
+            self.eta = max(self.duration - self.out_time, 0) / speed
@@ -0,0 +1,73 @@
+import os
+import threading
+
+import psutil
+
+from bot.config import conf
+
+# roles given to the processes the bot spawns
+MAIN = "main"  # the encode itself
+AUX = "aux"  # ffprobe, thumbnails, muxing
+BACKGROUND = "background"  # copies and mediainfo parsing
+
+# nice value and io class per role
+PRIORITIES = {
+    MAIN: (0, "IOPRIO_CLASS_BE", 4),
+    AUX: (10, "IOPRIO_CLASS_BE", 7),
+    BACKGROUND: (19, "IOPRIO_CLASS_IDLE", None),
+}
+
+
+def role_cpus(role):
+    """
+    CPUs a role may run on; side work is kept on the first AUX_CPUS cpus
+    so the main encode has the rest to itself
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    aux = min(conf.AUX_CPUS, len(cpus) - 1)
+    if aux < 1:
+        return cpus
+    return cpus[aux:] if role == MAIN else cpus[:aux]
+
+
+def role_threads(role):
+    if not conf.GOVERNOR or role == MAIN:
+        return
+    return len(role_cpus(role))
+
+
+def apply_role(role, pid=0):
+    """Gives a process (or thread) a role's cpus and priority; pid 0 is the caller"""
+    if not conf.GOVERNOR:
+        return
+    try:
+        os.sched_setaffinity(pid, role_cpus(role))
+        nice, io_class, io_value = PRIORITIES[role]
+        if nice:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+        if io_class := getattr(psutil, io_class, None):
+            psutil.Process(pid or None).ionice(io_class, io_value)
+    except (AttributeError, OSError, psutil.Error):
+        pass
+
+
+def governed(role):
+    """A preexec_fn that gives a new process its role before it starts"""
+    if not conf.GOVERNOR or not hasattr(os, "sched_setaffinity"):
+        return
+    return lambda: apply_role(role)
+
+
+def govern_thread(role):
+    """Gives the calling thread a role, linux schedules threads on their own"""
+    apply_role(role, threading.get_native_id())
+
+
+def with_threads(cmd, role):
+    """Caps the threads of an ffmpeg command to the cpus its role can use"""
+    if not (threads := role_threads(role)):
+        return cmd
+    exe, _sep, args = cmd.strip().partition(" ")
+    if os.path.split(exe.strip("\"'"))[1] != "ffmpeg" or "-threads " in args:
+        return cmd
+    return f"{exe} -threads {threads} -filter_threads {threads} {args}"
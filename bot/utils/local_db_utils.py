@@ -1,6 +1,17 @@
 import pickle
 
-from bot import _bot, local_cdb, local_qdb, local_qdb2, local_rdb, local_udb
+from bot import (
+    _bot,
+    local_cdb,
+    local_ddb,
+    local_mdb,
+    local_qdb,
+    local_qdb2,
+    local_rdb,
+    local_tdb,
+    local_udb,
+    local_xdb,
+)
 
 from .bot_utils import list_to_str
 from .os_utils import file_exists
@@ -34,8 +45,44 @@ def load_local_db():
             local_format = pickle.load(file)
         _bot.custom_rename = local_format
 
+    if file_exists(local_xdb):
+        with open(local_xdb, "rb") as file:
+            local_results = pickle.load(file)
+        _bot.results.update(local_results)
 
-def save2db_lcl():
+    if file_exists(local_ddb):
+        with open(local_ddb, "rb") as file:
+            local_dead = pickle.load(file)
+        _bot.dead_letters.update(local_dead)
+
+    if file_exists(local_mdb):
+        with open(local_mdb, "rb") as file:
+            local_quality = pickle.load(file)
+        _bot.quality.update(local_quality)
+
+    if file_exists(local_tdb):
+        with open(local_tdb, "rb") as file:
+            local_tiers = pickle.load(file)
+        _bot.tiers.update(local_tiers)
+
+
+def save2db_lcl(db="queue"):
+    if db == "results":
+        with open(local_xdb, "wb") as file:
+            pickle.dump(_bot.results, file)
+        return
+    if db == "dead_letters":
+        with open(local_ddb, "wb") as file:
+            pickle.dump(_bot.dead_letters, file)
+        return
+    if db == "quality":
+        with open(local_mdb, "wb") as file:
+            pickle.dump(_bot.quality, file)
+        return
+    if db == "tiers":
+        with open(local_tdb, "wb") as file:
+            pickle.dump(_bot.tiers, file)
+        return
     with open(local_qdb, "wb") as file:
         pickle.dump(_bot.queue, file)
     with open(local_qdb2, "wb") as file:
@@ -13,16 +13,35 @@ import pymediainfo
 
 from bot import ffmpeg_file, signal, version_file
 
-from .bot_utils import post_to_tgph, sync_to_async
+from .bot_utils import background_call, post_to_tgph, sync_to_async
+from .ffmpeg_utils import (
+    last_crop,
+    media_duration,
+    media_end,
+    output_problem,
+    source_problem,
+    stable_crop,
+    to_float,
+)
+from .governor import AUX, governed, role_threads
 from .log_utils import log, logger
 
 
-async def enshell(cmd):
+async def enshell(cmd, role=None):
     # Create a subprocess and wait for it to finish
     process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=governed(role) if role else None,
     )
-    stdout, stderr = await process.communicate()
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # don't leave the command running for nothing
+        process.kill()
+        await process.wait()
+        raise
 
     # Return the output of the command and the process object
     return (process, stdout.decode(), stderr.decode())
@@ -37,7 +56,7 @@ async def is_running(proc):
 
 async def info(file, full=False):
     try:
-        out = await sync_to_async(
+        out = await background_call(
             pymediainfo.MediaInfo.parse, file, output="HTML", full=full
         )
         if len(out) > 65536:
@@ -172,7 +191,8 @@ async def get_stream_duration(file):
     result = 0
     try:
         out = await enshell(
-            f'ffprobe -hide_banner -show_streams -show_format -print_format json """{file}"""'
+            f'ffprobe -hide_banner -show_streams -show_format -print_format json """{file}"""',
+            AUX,
         )
         details = json.loads(out[1])
         result = round(float(details.get("format").get("duration")))
@@ -182,6 +202,97 @@ async def get_stream_duration(file):
         return result
 
 
+async def probe(file):
+    """ffprobe's streams and format of a file as a dict, None on failure"""
+    try:
+        out = await enshell(
+            f'ffprobe -hide_banner -show_streams -show_format -print_format json """{file}"""',
+            AUX,
+        )
+        return json.loads(out[1])
+    except Exception:
+        await logger(Exception)
+
+
+async def last_packet(file, since=0):
+    """
+    Timestamp of a file's last video packet, reading only what comes after
+    'since' seconds; 0 if there is none and None on failure
+    """
+    try:
+        out = await enshell(
+            f"ffprobe -v error -read_intervals {since:.3f}% -select_streams v:0 "
+            f'-show_entries packet=pts_time -of csv=p=0 """{file}"""',
+            AUX,
+        )
+        times = (to_float(x.split(",")[0]) for x in out[1].split())
+        return max((x for x in times if x is not None), default=0)
+    except Exception:
+        await logger(Exception)
+
+
+async def validate_source(file):
+    """
+    Checks a source before it's encoded, a container with no index to read
+    the duration from is remuxed first; returns what's wrong with it or None
+    """
+    details = await probe(file)
+    if details and details.get("streams") and not media_duration(details):
+        fixed = "{0} [Repaired]{1}".format(*os.path.splitext(file))
+        process = (
+            await enshell(
+                f'ffmpeg -v error -i """{file}""" -map 0 -c copy -ignore_unknown '
+                f'"""{fixed}""" -y',
+                AUX,
+            )
+        )[0]
+        if process.returncode == 0:
+            os.replace(fixed, file)
+            details = await probe(file)
+        s_remove(fixed)
+    if problem := source_problem(details):
+        return problem
+    end = await last_packet(file, max(media_end(details) - 30, 0))
+    return source_problem(details, end)
+
+
+async def detect_crop(file, samples=6):
+    """
+    Runs cropdetect on a few keyframes at points spread over a file, all at
+    the same time; returns the crop as (w, h, x, y) and the source's
+    (width, height), or None if there's nothing worth cropping
+    """
+    details = await probe(file) or {}
+    streams = details.get("streams", [])
+    video = next((x for x in streams if x.get("codec_type") == "video"), None)
+    if not (video and (duration := media_duration(details))):
+        return
+    width, height = video.get("width"), video.get("height")
+    points = (duration * (i + 1) / (samples + 1) for i in range(samples))
+    outs = await asyncio.gather(
+        *(
+            enshell(
+                f"ffmpeg -hide_banner -skip_frame nokey -ss {point:.3f} "
+                f'-i """{file}""" -map 0:v:0 -vf cropdetect=round=2 -frames:v 3 '
+                "-f null -",
+                AUX,
+            )
+            for point in points
+        )
+    )
+    rects = [rect for out in outs if (rect := last_crop(out[2]))]
+    # black frames give no crop, too few samples with one can't be trusted
+    if len(rects) < samples // 2:
+        return
+    if crop := stable_crop(rects, width, height):
+        return crop, (width, height)
+
+
+async def validate_output(cmd, source, out):
+    """Compares an encode's output with its source, returns what's wrong or None"""
+    return output_problem(cmd, await probe(source), await probe(out))
+
+
 async def get_video_thumbnail(file, output="thumb2.jpg", with_dur=False):
     try:
         duration = await get_stream_duration(file)
@@ -190,8 +301,10 @@ async def get_video_thumbnail(file, output="thumb2.jpg", with_dur=False):
         if duration == 0:
             duration = 3
         tduration = duration // 2
+        threads = role_threads(AUX) or cpu_count() // 2
         out = await enshell(
-            f'ffmpeg -hide_banner -loglevel error -ss {tduration} -i """{file}""" -vf thumbnail -q:v 1 -frames:v 1 -threads {cpu_count() // 2} {output} -y'
+            f'ffmpeg -hide_banner -loglevel error -ss {tduration} -i """{file}""" -vf thumbnail -q:v 1 -frames:v 1 -threads {threads} {output} -y',
+            AUX,
         )
         if not file_exists(output):
             return None
@@ -209,7 +322,7 @@ async def get_stream_info(file):
         if Path(file + ".aria2").is_file():
             return None, None
         out = await enshell(
-            f'ffprobe -hide_banner -show_streams -print_format json """{file}"""'
+            f'ffprobe -hide_banner -show_streams -print_format json """{file}"""', AUX
         )
         details = json.loads(out[1])
         a_lang = ""
@@ -0,0 +1,70 @@
+import statistics
+
+from bot import asyncio, time
+from bot.config import _bot
+
+from .db_utils import save2db
+from .ffmpeg_utils import media_duration, quality_filter, quality_scores
+from .governor import AUX
+from .os_utils import enshell, probe
+
+HISTORY = 200
+
+
+async def measure_quality(source, output, samples, length, crop=None):
+    """
+    Compares 'samples' segments of 'length' seconds spread over an output
+    with the same segments of its source, all at the same time;
+    returns the mean SSIM and PSNR or None if neither could be measured
+    """
+    details = await probe(output) or {}
+    streams = details.get("streams", [])
+    video = next((x for x in streams if x.get("codec_type") == "video"), None)
+    if not (video and (duration := media_duration(details))):
+        return
+    vfilter = quality_filter(video.get("width"), video.get("height"), crop)
+    length = min(length, duration / samples)
+    points = (duration * (i + 1) / (samples + 1) - length / 2 for i in range(samples))
+    outs = await asyncio.gather(
+        *(
+            enshell(
+                f"ffmpeg -hide_banner -nostats -ss {point:.3f} -t {length:.3f} "
+                f'-i """{output}""" -ss {point:.3f} -t {length:.3f} '
+                f'-i """{source}""" -lavfi "{vfilter}" -f null -',
+                AUX,
+            )
+            for point in points
+        )
+    )
+    scores = [quality_scores(out[2]) for out in outs]
+    ssim = [x[0] for x in scores if x[0] is not None]
+    psnr = [x[1] for x in scores if x[1] is not None]
+    if not (ssim or psnr):
+        return
+    return (
+        statistics.mean(ssim) if ssim else None,
+        statistics.mean(psnr) if psnr else None,
+    )
+
+
+def quality_text(scores):
+    ssim, psnr = scores
+    text = [f"SSIM `{ssim:.4f}`" if ssim is not None else None]
+    text.append(f"PSNR `{psnr:.2f}dB`" if psnr is not None else None)
+    return " ".join(x for x in text if x)
+
+
+async def record_quality(key, name, param_file, scores, tier=None):
+    """Keeps an output's measured quality with the profile and tier it was made with"""
+    _bot.quality.pop(key, None)
+    _bot.quality[key] = {
+        "name": name,
+        "params": param_file,
+        "tier": tier,
+        "ssim": scores[0],
+        "psnr": scores[1],
+        "time": time.time(),
+    }
+    while len(_bot.quality) > HISTORY:
+        _bot.quality.pop(next(iter(_bot.quality)))
+    await save2db("quality")
@@ -0,0 +1,91 @@
+import statistics
+
+from bot import ffmpeg_file, ffmpeg_tier1, ffmpeg_tier2, time
+from bot.config import _bot, conf
+
+from .db_utils import save2db
+from .os_utils import file_exists
+
+# ffmpeg.txt followed by the faster tiers, in order
+TIER_FILES = (ffmpeg_file, ffmpeg_tier1, ffmpeg_tier2)
+FULL_HD = 1920 * 1080
+# encode seconds per second of 1080p source until there are encodes to go by
+DEFAULT_COST = 1.0
+# a 24 minute 1080p episode
+TYPICAL_SOURCE = (1440, FULL_HD)
+HISTORY = 200
+
+
+def tier_hours():
+    """Backlog (in hours) past which each faster tier is used, from TIER_HOURS"""
+    try:
+        return [float(x) for x in conf.TIER_HOURS.split()][: len(TIER_FILES) - 1]
+    except ValueError:
+        return []
+
+
+def encode_cost():
+    """
+    Encode seconds per second of 1080p source with ffmpeg.txt,
+    the median of the recorded encodes that used it
+    """
+    costs = [
+        x["elapsed"] / x["duration"] * FULL_HD / x["pixels"]
+        for x in _bot.tiers.values()
+        if not x["tier"] and x.get("elapsed") and x["duration"] and x["pixels"]
+    ]
+    return statistics.median(costs) if costs else DEFAULT_COST
+
+
+def typical_source():
+    """Mean duration and pixel count of the recorded sources"""
+    records = [x for x in _bot.tiers.values() if x["duration"] and x["pixels"]]
+    if not records:
+        return TYPICAL_SOURCE
+    return (
+        statistics.mean(x["duration"] for x in records),
+        statistics.mean(x["pixels"] for x in records),
+    )
+
+
+def pick_tier(duration, pixels, queued, slots=1):
+    """
+    Picks the parameter tier for a source from the predicted backlog:
+    how long it and the 'queued' items after it would take to encode
+    with ffmpeg.txt on 'slots' encode slots;
+    returns the tier (0 is ffmpeg.txt) and the backlog in hours
+    """
+    cost = encode_cost()
+    duration, pixels = duration or TYPICAL_SOURCE[0], pixels or FULL_HD
+    t_duration, t_pixels = typical_source()
+    work = duration * pixels + queued * t_duration * t_pixels
+    backlog = work * cost / FULL_HD / max(slots, 1) / 3600
+    tier = 0
+    for i, hours in enumerate(tier_hours(), start=1):
+        if backlog >= hours and file_exists(TIER_FILES[i]):
+            tier = i
+    return tier, backlog
+
+
+def record_tier(key, name, tier, duration, pixels, queued, backlog):
+    """Keeps what a tier was picked from so the decisions can be audited"""
+    _bot.tiers.pop(key, None)
+    _bot.tiers[key] = {
+        "name": name,
+        "tier": tier,
+        "duration": duration,
+        "pixels": pixels,
+        "queued": queued,
+        "backlog": backlog,
+        "elapsed": None,
+        "time": time.time(),
+    }
+    while len(_bot.tiers) > HISTORY:
+        _bot.tiers.pop(next(iter(_bot.tiers)))
+
+
+async def finish_tier(key, elapsed=None):
+    """Adds how long the encode took to its record and saves it"""
+    if record := _bot.tiers.get(key):
+        record["elapsed"] = elapsed
+    await save2db("tiers")
@@ -7,33 +7,35 @@ from bot.fun.stuff import lvbar
 from bot.utils.ani_utils import qparse
 from bot.utils.batch_utils import get_batch_list
 from bot.utils.bot_utils import (
-    encode_info,
+    active_items,
+    enc_progress,
     encode_job,
-    get_codec,
+    get_codecs,
     get_pause_status,
+    get_slots,
     sync_to_async,
 )
 from bot.utils.log_utils import logger
 
 
-async def batch_status_preview(msg, v, f):
+async def batch_status_preview(msg, v, f, einfo):
     msg += "  **CURRENTLY QUEUED ITEMS IN BATCH:**\n" f"{lvbar}\n"
-    blist, left = await get_batch_list(encode_info._current, v=v, f=f, get_nleft=True)
+    blist, left = await get_batch_list(einfo._current, v=v, f=f, get_nleft=True)
     for name, i in zip(blist, itertools.count(start=1)):
         msg += f"{i}. `{name}`\n"
     if left:
         msg += f"__+{left} more…__\n"
-    if not blist and encode_info.current:
+    if not blist and einfo.current:
         loc = await sync_to_async(enquotes)
         msg += f"Nothing Here; While you wait:\n\n{loc}\n"
     return msg
 
 
-async def queue_status_preview(start, msg, queue):
+async def queue_status_preview(msg, queue):
     msg += "    **CURRRENT ITEMS ON QUEUE:**\n" f"{lvbar}\n"
-    for key, i in zip(list(queue.keys())[start:], itertools.count(start=1)):
+    for key, i in zip(list(queue.keys()), itertools.count(start=1)):
         if i > 6:
-            r = len(queue) - i if start else (len(queue) + 1) - i
+            r = (len(queue) + 1) - i
             msg += f"__+{r} more…__\n"
             break
         out = queue.get(key)
@@ -57,27 +59,44 @@ async def encodestat():
         i = 0
         msg = str()
         s = "Currently Encoding:" if get_pause_status() != 0 else "Paused:"
-        if file_name := encode_info.current:
-            i = 1
-            msg += f"```{s}\n{file_name}```\n\n"
-        key = list(_bot.queue.keys())[0]
-        out = _bot.queue.get(key)
-        v, f, m, n, au = out[2]
-        if m[1].lower() == "batch.":
-            msg = await batch_status_preview(msg, v, f)
-            single = False
-        else:
-            msg = await queue_status_preview(i, msg, _bot.queue)
-        if len(_bot.queue) == 1 and single and encode_info.current:
+        for slot in get_slots():
+            if file_name := slot.info.current:
+                i += 1
+                stage = s
+                if conf.PIPELINE and slot.stage and get_pause_status() != 0:
+                    stage = f"{slot.stage}:"
+                msg += f"```{stage}\n{file_name}```\n"
+                progress = enc_progress().get(slot.job.id)
+                if progress and progress.percentage is not None:
+                    done = int(progress.percentage // 10)
+                    bar = conf.FINISHED_PROGRESS_STR * done
+                    bar += conf.UN_FINISHED_PROGRESS_STR * (10 - done)
+                    msg += f"{bar} `{progress}`\n"
+                msg += "\n"
+        # items held by a slot, whatever their place on the queue
+        active = active_items()
+        for slot in get_slots():
+            if not (out := _bot.queue.get(slot.queue_id)):
+                continue
+            v, f, m, n, au = out[2]
+            if m[1].lower() == "batch.":
+                msg = await batch_status_preview(msg, v, f, slot.info)
+                single = False
+        waiting = {k: x for k, x in _bot.queue.items() if k not in active}
+        if single and waiting:
+            msg = await queue_status_preview(msg, waiting)
+        if not waiting and single and i:
             loc = await sync_to_async(enquotes)
             msg += f"Nothing Here; While you wait:\n\n{loc}"
-        elif not single and (r := (len(_bot.queue) - 1)):
+        elif not single and (r := len(waiting)):
             msg += f"\n__(+{r} more item(s) on queue.)__ \n"
     except Exception:
         # pass
         await logger(Exception)
     me = await tele.get_me()
-    codec = await get_codec(encode_job.pending())
+    # the profiles being worked on by every busy slot
+    files = [x for slot in get_slots() if slot.queue_id and (x := slot.job.pending())]
+    codec = await get_codecs(dict.fromkeys(files or [encode_job.pending()]))
     msg += f"\n\nYours truly,\n  {enmoji()} `{me.first_name}`"
     msg += f"\n    == {codec} =="
     return msg
@@ -109,18 +128,24 @@ async def autostat():
             return (
                 _bot.queue == check.queue
                 and _bot.batch_queue == check.batch
-                and check.file == encode_info._current
+                and check.file == currents()
                 and check.state == (get_pause_status() == 0)
-                and check.job == encode_job.pending()
+                and check.job == jobs()
             )
 
+        def currents():
+            return tuple(slot.info._current for slot in get_slots())
+
+        def jobs():
+            return tuple(slot.job.pending() for slot in get_slots())
+
         def wait():
             if conditions():
                 return True
             check.batch.clear(), check.batch.update(_bot.batch_queue)
             check.queue.clear(), check.queue.update(_bot.queue)
-            check.file = encode_info._current
-            check.job = encode_job.pending()
+            check.file = currents()
+            check.job = jobs()
             check.state = get_pause_status() == 0
             return False
 
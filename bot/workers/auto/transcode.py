@@ -1,8 +1,11 @@
+import traceback
 from os.path import split as path_split
 from os.path import splitext as split_ext
 from shutil import copy2 as copy_file
 
-from bot import asyncio, mux_file, pyro, tele, time
+from pyrogram.enums import ParseMode
+
+from bot import asyncio, ffmpeg_file, mux_file, os, pyro, tele, time
 from bot.config import conf
 from bot.others.exceptions import AlreadyDl
 from bot.startup.before import entime
@@ -13,12 +16,35 @@ from bot.utils.batch_utils import (
     mark_file_as_done,
 )
 from bot.utils.bot_utils import enc_canceller as e_cancel
-from bot.utils.bot_utils import encode_info as einfo
-from bot.utils.bot_utils import encode_job as ejob
-from bot.utils.bot_utils import get_bqueue, get_queue, get_var, hbs
+from bot.utils.bot_utils import (
+    get_bqueue,
+    get_queue,
+    get_slots,
+    get_stage,
+    get_var,
+    hbs,
+)
 from bot.utils.bot_utils import time_formatter as tf
+from bot.utils.cache_utils import (
+    add_result,
+    get_result,
+    params_hash,
+    result_key,
+    source_id,
+)
 from bot.utils.db_utils import save2db
-from bot.utils.log_utils import logger
+from bot.utils.failure_utils import clear_failure, global_fault, item_failed
+from bot.utils.ffmpeg_utils import (
+    COPY_CMD,
+    Stream_plan,
+    add_video_filter,
+    copy_rules,
+    media_duration,
+    merge_mux_args,
+    merge_outputs,
+)
+from bot.utils.governor import AUX
+from bot.utils.log_utils import log, logger
 from bot.utils.msg_utils import (
     bc_msg,
     enpause,
@@ -27,15 +53,34 @@ from bot.utils.msg_utils import (
     report_encode_status,
     report_failed_download,
 )
-from bot.utils.os_utils import file_exists, info, pos_in_stm, s_remove, size_of
-from bot.workers.downloaders.dl_helpers import cache_dl
+from bot.utils.os_utils import (
+    detect_crop,
+    dir_exists,
+    file_exists,
+    info,
+    pos_in_stm,
+    probe,
+    s_remove,
+    size_of,
+    validate_output,
+    validate_source,
+)
+from bot.utils.quality_utils import measure_quality, quality_text, record_quality
+from bot.utils.tier_utils import TIER_FILES, finish_tier, pick_tier, record_tier
+from bot.workers.downloaders.dl_helpers import Stream_source, cache_dl, is_direct_link
 from bot.workers.downloaders.download import Downloader as downloader
+from bot.workers.encoders.encode import Chunked_process
 from bot.workers.encoders.encode import Encoder as encoder
+from bot.workers.encoders.encode import (
+    Sized_process,
+    Split_process,
+    prune_checkpoints,
+    resume_key,
+)
 from bot.workers.uploaders.dump import dumpdl
+from bot.workers.uploaders.upload import Progressive_upload as progressive_upload
 from bot.workers.uploaders.upload import Uploader as uploader
 
-thumb2 = "thumb2.jpg"
-
 
 async def another(text, title, epi, sea, metadata, dl):
     a_auto_disp = "-disposition:a auto"
@@ -72,7 +117,45 @@ async def another(text, title, epi, sea, metadata, dl):
     return text
 
 
-async def forward_(name, out, ds, mi, f, ani, n, pf):
+async def mux_into(ffmpeg, title, epi, sea, metadata, dl, plan=None):
+    """Returns the encode's command with mux.txt's arguments in it or None"""
+    with open(mux_file, "r") as file:
+        mux_args = file.read().rstrip("\n").rstrip()
+    if not merge_mux_args(ffmpeg, mux_args):
+        return
+    mux_args = await another(mux_args, title, epi, sea, metadata, dl)
+    # dispositions are picked from the source's streams, not the planned ones
+    mux_args = plan.dispositions(mux_args) if plan else mux_args
+    return merge_mux_args(ffmpeg, mux_args)
+
+
+async def choose_tier(key, name, file, queued, slots):
+    """Picks and records the parameter tier of a source, 0 being ffmpeg.txt"""
+    details = await probe(file) or {}
+    streams = details.get("streams", [])
+    video = next((x for x in streams if x.get("codec_type") == "video"), {})
+    duration = media_duration(details)
+    pixels = (video.get("width") or 0) * (video.get("height") or 0)
+    tier, backlog = pick_tier(duration, pixels, queued, slots)
+    record_tier(key, name, tier, duration, pixels, queued, backlog)
+    log(e=f"Tier {tier} for {name}: {queued} queued, {backlog:.2f}h of backlog")
+    return tier
+
+
+def plan_streams(ffmpeg, details, size=None):
+    """Returns the plan for the encode's streams or None"""
+    langs, rules = conf.KEEP_LANGS.split(), copy_rules(conf.COPY_CODECS)
+    # a copied video can't be encoded to a size
+    plan = Stream_plan(ffmpeg, details, langs, rules, copy_video=not size)
+    if plan.error:
+        log(e=f"Not planning streams: {plan.error}")
+        return
+    log(e=f"Planned streams: {plan}")
+    return plan
+
+
+async def forward_(name, out, ds, mi, f, ani, n, pf, slot):
+    einfo, ejob = slot.info, slot.job
     fb = conf.FBANNER
     fc = conf.FCHANNEL
     fs = conf.FSTICKER
@@ -80,7 +163,16 @@ async def forward_(name, out, ds, mi, f, ani, n, pf):
         return
     try:
         pic_id, f_msg = await f_post(
-            name, out, ani, conf.FCODEC, mi, _filter=f, evt=fb, direct=n, p_file=pf
+            name,
+            out,
+            ani,
+            conf.FCODEC,
+            mi,
+            _filter=f,
+            evt=fb,
+            direct=n,
+            p_file=pf,
+            job=ejob,
         )
         if pic_id:
             await pyro.send_photo(photo=pic_id, caption=f_msg, chat_id=fc)
@@ -94,9 +186,9 @@ async def forward_(name, out, ds, mi, f, ani, n, pf):
     if not fb:
         queue = get_queue()
         bqueue = get_bqueue()
-        queue_id = list(queue.keys())[0]
+        queue_id = slot.queue_id
         if bqueue.get(queue_id):
-            name, _none, v_f = list(queue.values())[0]
+            name, _none, v_f = queue.get(queue_id)
             blist = await get_batch_list(einfo._current, 1, v_f[0], v_f[1], parse=False)
             if blist:
                 _pname = await qparse_t(einfo._current, v_f[0], v_f[1])
@@ -104,9 +196,9 @@ async def forward_(name, out, ds, mi, f, ani, n, pf):
                 if _pname == _pname2:
                     return
 
-        elif len(queue) > 1:
-            name, _none, v_f = list(queue.values())[0]
-            name2, _none, v_f2 = list(queue.values())[1]
+        elif len(queue) > 1 and queue_id in (keys := list(queue.keys()))[:-1]:
+            name, _none, v_f = queue.get(queue_id)
+            name2, _none, v_f2 = queue.get(keys[keys.index(queue_id) + 1])
             _pname = await qparse_t(name, v_f[0], v_f[1])
             _pname2 = await qparse_t(name2, v_f2[0], v_f2[1])
             if _pname == _pname2:
@@ -120,13 +212,22 @@ async def forward_(name, out, ds, mi, f, ani, n, pf):
         await logger(Exception)
 
 
-def skip(queue_id):
+async def after(task, coro):
+    """Runs coro once task is done"""
+    await task
+    return await coro
+
+
+def skip(queue_id, slot):
+    einfo, ejob = slot.info, slot.job
     ejob.busy = True
     ejob.done()
     if ejob.pending():
         return
     if einfo.batch:
         return
+    slot.release()
+    clear_failure(queue_id)
     bqueue = get_bqueue()
     queue = get_queue()
     try:
@@ -139,13 +240,41 @@ def skip(queue_id):
         pass
 
 
+async def post_result(result, message, chat_id):
+    """Re-posts a cached upload, returns True if it was sent"""
+    try:
+        up = await pyro.send_cached_media(
+            chat_id,
+            result["file_id"],
+            caption=result["caption"],
+            parse_mode=ParseMode.HTML,
+            reply_to_message_id=message.id,
+        )
+        if (log_channel := conf.LOG_CHANNEL) and log_channel != chat_id:
+            await up.copy(chat_id=log_channel)
+        await up.reply("`Already encoded with the current settings, reposted.`")
+        return True
+    except Exception:
+        await logger(Exception)
+
+
 async def something():
+    await asyncio.gather(*(slot_worker(slot) for slot in get_slots()))
+
+
+async def slot_worker(slot):
+    # stagger slots so they don't all grab the queue at once
+    await asyncio.sleep(slot.index * 5)
     while True:
-        await thing()
+        await thing(slot)
         # do some other stuff?
 
 
-async def thing():
+async def thing(slot):
+    einfo, ejob = slot.info, slot.job
+    download = stream = None
+    # quality samplings of the outputs being delivered
+    measuring = []
     try:
         while get_var("paused"):
             await asyncio.sleep(10)
@@ -160,14 +289,19 @@ async def thing():
                 break
             await asyncio.sleep(10)
         # user = int(OWNER.split()[0])
-        queue_id = list(queue.keys())[0]
+        queue_id = slot.claim()
+        if not queue_id:
+            await asyncio.sleep(1.5)
+            return
         chat_id, msg_id = queue_id
-        download = None
         log_channel = conf.LOG_CHANNEL
-        name, u_msg, v_f = list(queue.values())[0]
+        thumb2 = slot.thumb
+        name, u_msg, v_f = queue.get(queue_id)
         v, f, m, n, au = v_f
         ani = au[0]
         einfo.uri = au[1]
+        # target size in bytes; older queue items don't have one
+        einfo.size = au[2] if len(au) > 2 else None
         param_file = ejob.pending()
         sender_id, message = u_msg
         if not message:
@@ -184,7 +318,20 @@ async def thing():
             if name is None:
                 einfo.batch = None
                 ejob.complete()
-                skip(queue_id)
+                skip(queue_id, slot)
+                await save2db()
+                await save2db("batches")
+                await asyncio.sleep(2)
+                return
+
+        # the same release was encoded with the same settings before
+        r_source = source_id(message, einfo.uri, einfo.select)
+        r_params = params_hash(param_file, einfo.size)
+        r_key = result_key(r_source, param_file, name, v, f, n, ani)
+        if r_source and (result := get_result(r_key, r_params)):
+            if await post_result(result, message, chat_id):
+                skip(queue_id, slot)
+                mark_file_as_done(einfo.select, queue_id, ejob)
                 await save2db()
                 await save2db("batches")
                 await asyncio.sleep(2)
@@ -225,18 +372,40 @@ async def thing():
                     if m[1].split()[0].lower() == "select.":
                         einfo.select = int(m[1].split()[1])
 
-            if await cache_dl(check=True):
+            if ejob.prev_dl_client or (not slot.index and await cache_dl(check=True)):
                 raise (AlreadyDl)
 
             sdt = time.time()
             # await mssg_r.edit("`Waiting for download to complete.`")
+            # direct links are fetched in order by aria2 to be streamed
+            linked = einfo.uri and not einfo.qbit and is_direct_link(einfo.uri)
+            streamable = (
+                (conf.STREAM_LINKS if linked else conf.STREAM_ENCODE)
+                and not (conf.CHUNK_ENCODE or conf.ENCODE_WORKERS)
+                and not (conf.RESUME_ENCODES or conf.MULTI_PROFILE or einfo.size)
+                and (einfo.qbit or not einfo.uri or linked)
+            )
             download = downloader(
-                sender_id, op, _id, uri=einfo.uri, dl_info=True, qbit=einfo.qbit
+                sender_id,
+                op,
+                _id,
+                uri=einfo.uri,
+                dl_info=True,
+                qbit=einfo.qbit,
+                stream=streamable,
             )
             download._sender = sender
-            downloaded = await download.start(
-                name, None, message, msg_p, select=einfo.select
+            dl_stage = get_stage("download")
+            await dl_stage.acquire(slot)
+            dl_task = asyncio.create_task(
+                download.start(name, None, message, msg_p, select=einfo.select)
             )
+            # a streamed download gives up its stage only once it's complete
+            dl_task.add_done_callback(lambda task: dl_stage.release(slot))
+            if streamable:
+                stream = Stream_source(download, dl_task)
+                stream = stream if await stream.ready() else None
+            downloaded = await dl_task if not stream else True
             if download.is_cancelled or download.download_error:
                 f_msg = await report_failed_download(download, msg_p, name, sender_id)
                 if op:
@@ -248,8 +417,8 @@ async def thing():
                     )
             if not downloaded or download.is_cancelled:
                 ejob.complete()
-                skip(queue_id)
-                mark_file_as_done(einfo.select, queue_id)
+                skip(queue_id, slot)
+                mark_file_as_done(einfo.select, queue_id, ejob)
                 await save2db()
                 await save2db("batches")
                 if conf.COMP_MODE:
@@ -271,8 +440,8 @@ async def thing():
                 return
         except Exception:
             await logger(Exception)
-            skip(queue_id)
-            mark_file_as_done(einfo.select, queue_id)
+            skip(queue_id, slot)
+            mark_file_as_done(einfo.select, queue_id, ejob)
             await save2db()
             await save2db("batches")
             if download and conf.COMP_MODE:
@@ -280,10 +449,30 @@ async def thing():
             return
         edt = time.time()
         dtime = tf(edt - sdt)
+        # a streamed source is only complete once it has been encoded
+        if conf.VALIDATE and not stream and (problem := await validate_source(dl)):
+            reply = f"`{name}` was not encoded:\n- `{problem}`"
+            await msg_p.edit(reply)
+            await op.edit(reply) if op else None
+            skip(queue_id, slot)
+            mark_file_as_done(einfo.select, queue_id, ejob)
+            await save2db()
+            await save2db("batches")
+            return
+
+        # trade some size for speed when the backlog is long
+        tier = tier_key = None
+        if conf.TIER_HOURS and param_file == ffmpeg_file:
+            tier_key = f"{chat_id}:{msg_id}:{einfo.select or 0}"
+            queued, slots = len(get_queue()) - 1, len(get_slots())
+            t_file = stream.file if stream else dl
+            tier = await choose_tier(tier_key, name, t_file, queued, slots)
 
         d_folder, d_fname = path_split(dl)
         d_ext = split_ext(d_fname)[-1]
-        _dir = "encode"
+        _dir = slot.dir
+        if not dir_exists(_dir):
+            os.makedirs(_dir)
         file_name, metadata_name = await parse(
             name,
             d_fname,
@@ -297,7 +486,7 @@ async def thing():
         )
         out = f"{_dir}/{file_name}"
         title, epi, sn, rlsgrp = await dynamicthumb(
-            name, anilist=(not n or ani), _filter=f
+            name, thum=thumb2, anilist=(not n or ani), _filter=f
         )
 
         c_n = f"{title} {sn or str()}".strip()
@@ -310,25 +499,166 @@ async def thing():
             await op.reply("#" + c_n) if op else None
             await msg_p.reply("#" + c_n) if log_channel == chat_id else None
         if einfo.uri and conf.DUMP_LEECH is True:
-            asyncio.create_task(dumpdl(dl, name, thumb2, msg_t.chat_id, message))
+            dump = dumpdl(dl, name, thumb2, msg_t.chat_id, message)
+            asyncio.create_task(after(stream.task, dump) if stream else dump)
         if ejob.jobs() > 1:
-            await cache_dl(cached=True)
+            await cache_dl(cached=True) if not slot.index else None
             ejob.prev_dl_client = download
-        elif len(queue) > 1 and conf.CACHE_DL and not einfo.batch:
+        elif (
+            len(queue) > 1
+            and conf.CACHE_DL
+            and not einfo.batch
+            and len(get_slots()) == 1
+        ):
+            # with more than one slot the next item is picked up by another slot
             await cache_dl()
-        with open(param_file, "r") as file:
+        with open(TIER_FILES[tier] if tier else param_file, "r") as file:
             nani = file.read().rstrip()
-        ffmpeg = await another(nani, title, epi, sn, metadata_name, dl)
-
-        _set = time.time()
-        einfo.current = file_name
-        einfo._current = name
+        # probe what has been downloaded so far when streaming
+        probed = stream.file if stream else dl
+        ffmpeg = await another(nani, title, epi, sn, metadata_name, probed)
+        # crop letterboxing; a streamed source can't be sampled yet
+        crop = crop_filter = None
+        if conf.AUTO_CROP and not stream and (crop := await detect_crop(dl)):
+            crop_filter = "crop={}:{}:{}:{}".format(*crop[0])
+            ffmpeg = add_video_filter(ffmpeg, crop_filter) or ffmpeg
+        details = plan = None
+        if conf.KEEP_LANGS or conf.COPY_CODECS:
+            details = await probe(probed)
+            if plan := plan_streams(ffmpeg, details, einfo.size):
+                ffmpeg = plan.apply()
+        # mux in the same pass unless mux.txt's arguments need one of their own
+        muxed = None
+        if file_exists(mux_file):
+            muxed = await mux_into(ffmpeg, title, epi, sn, metadata_name, probed, plan)
+            ffmpeg = muxed or ffmpeg
         cmd = ffmpeg.format(dl, out)
-        encode = encoder(_id, sender, msg_t, op, True)
-        await msg_t.edit("`Waiting For Encoding To Complete`")
-        await encode.start(cmd)
-        await encode.callback(dl, out, msg_t, sender_id, stime=_set)
-        stdout, stderr = await encode.await_completion()
+
+        # encode the other pending profiles from the same decode
+        extras = []
+        if conf.MULTI_PROFILE and ejob.jobs() > 1 and not einfo.size:
+            for x_file in ejob.get_pending()[1:]:
+                x_name, x_metadata = await parse(
+                    name,
+                    d_fname,
+                    d_ext,
+                    anilist=ani,
+                    v=v,
+                    folder=d_folder,
+                    _filter=f,
+                    direct=n,
+                    p_file=x_file,
+                )
+                with open(x_file, "r") as file:
+                    x_ffmpeg = file.read().rstrip()
+                x_ffmpeg = await another(x_ffmpeg, title, epi, sn, x_metadata, dl)
+                if crop_filter:
+                    x_ffmpeg = add_video_filter(x_ffmpeg, crop_filter) or x_ffmpeg
+                x_plan = None
+                if details and (x_plan := plan_streams(x_ffmpeg, details)):
+                    x_ffmpeg = x_plan.apply()
+                x_muxed = None
+                if muxed:
+                    x_muxed = await mux_into(
+                        x_ffmpeg, title, epi, sn, x_metadata, dl, x_plan
+                    )
+                    x_ffmpeg = x_muxed or x_ffmpeg
+                extras.append((f"{_dir}/{x_name}", x_file, x_ffmpeg, bool(x_muxed)))
+            outs = [out] + [x[0] for x in extras]
+            multi_cmd = merge_outputs(
+                [(ffmpeg, out)] + [(x[2], x[0]) for x in extras], dl
+            )
+            if multi_cmd and len(set(outs)) == len(outs):
+                cmd = multi_cmd
+            else:
+                extras = []
+
+        async def begin(encode):
+            chunked = conf.CHUNK_ENCODE or conf.ENCODE_WORKERS or conf.RESUME_ENCODES
+            if einfo.size:
+                await encode.start_sized(ffmpeg, dl, out, einfo.size)
+            elif stream:
+                await encode.start_streamed(ffmpeg, stream, out)
+            elif chunked and not extras:
+                resume = None
+                if conf.RESUME_ENCODES:
+                    prune_checkpoints(get_queue())
+                    resume = resume_key(queue_id, ejob)
+                await encode.start_chunked(ffmpeg, dl, out, resume)
+            elif conf.SPLIT_STREAMS and not extras:
+                await encode.start_split(ffmpeg, dl, out)
+            else:
+                await encode.start(cmd)
+
+        # what ffmpeg.txt costs is learnt from encodes of whole sources only
+        timed = tier == 0 and not (extras or stream or einfo.size)
+        if conf.PIPELINE:
+            await msg_t.edit("`Waiting for an encode slot…`")
+        async with get_stage("encode").enter(slot):
+            _set = time.time()
+            einfo.current = file_name
+            einfo._current = name
+            encode = encoder(_id, sender, msg_t, op, ejob)
+            await msg_t.edit("`Waiting For Encoding To Complete`")
+            await begin(encode)
+            # chunked, sized and split encodes don't write the output in a single run
+            progressive = None
+            remux = file_exists(mux_file) and not muxed
+            if conf.PROGRESSIVE_UPLOAD and not (conf.UAV or remux):
+                single = (Chunked_process, Sized_process, Split_process)
+                if not isinstance(encode.process, single):
+                    progressive = progressive_upload(out)
+            await encode.callback(dl, out, msg_t, sender_id, stime=_set)
+            # a streamed source's final size isn't known yet
+            if conf.OVERSIZE_RATIO and not (einfo.size or extras or stream):
+                encode.limit_size(size_of(dl) * conf.OVERSIZE_RATIO)
+            encode.watch_stalls(conf.STALL_TIMEOUT)
+            stdout, stderr = await encode.await_completion()
+            # a streamed encode's download is cancelled along with it
+            tries = 0
+            while encode.stalled and tries < conf.STALL_RETRIES and not stream:
+                tries += 1
+                await progressive.abandon() if progressive else None
+                progressive = None
+                timed = False
+                s_remove(out, *(x[0] for x in extras))
+                decision = (
+                    f"{encode.stalled}, encoding {file_name} again "
+                    f"({tries}/{conf.STALL_RETRIES})"
+                )
+                log(e=decision)
+                await op.reply(f"`{decision}`") if op else None
+                encode = encoder(_id, sender, msg_t, op, ejob)
+                await begin(encode)
+                await encode.callback(dl, out, msg_t, sender_id, stime=_set)
+                encode.watch_stalls(conf.STALL_TIMEOUT)
+                stdout, stderr = await encode.await_completion()
+            if encode.stalled:
+                decision = f"{encode.stalled}, giving up on {file_name}"
+                log(e=decision)
+                await op.reply(f"`{decision}`") if op else None
+                stderr = (stderr or b"") + f"\n{encode.stalled}".encode()
+            if encode.oversized:
+                await progressive.abandon() if progressive else None
+                progressive = muxed = None
+                timed = False
+                s_remove(out)
+                decision = (
+                    f"Encode of {file_name} was projected to {hbs(encode.oversized)}"
+                    f" from a {hbs(size_of(dl))} source, "
+                    + ("re-encoding" if conf.OVERSIZE_FFMPEG else "remuxing")
+                    + " it instead"
+                )
+                log(e=decision)
+                await op.reply(f"`{decision}`") if op else None
+                ffmpeg = conf.OVERSIZE_FFMPEG or COPY_CMD
+                ffmpeg = await another(ffmpeg, title, epi, sn, metadata_name, dl)
+                encode = encoder(_id, sender, msg_t, op, ejob)
+                await encode.start(ffmpeg.format(dl, out))
+                await encode.callback(dl, out, msg_t, sender_id, stime=_set)
+                encode.watch_stalls(conf.STALL_TIMEOUT)
+                stdout, stderr = await encode.await_completion()
+        einfo.output = stderr
         await report_encode_status(
             encode.process,
             _id,
@@ -340,161 +670,267 @@ async def thing():
             stdout=stdout,
             exe_prefix=ffmpeg.split(maxsplit=1)[0],
         )
-        if encode.process.returncode != 0:
-            s_remove(out)
-            skip(queue_id)
-            mark_file_as_done(einfo.select, queue_id)
+        problem = None
+        if conf.VALIDATE and encode.process.returncode == 0:
+            for x_out, x_ffmpeg in [(out, ffmpeg)] + [(x[0], x[2]) for x in extras]:
+                if problem := await validate_output(x_ffmpeg, dl, x_out):
+                    reply = (
+                        f"Encode of `{path_split(x_out)[1]}` is broken:\n- `{problem}`"
+                    )
+                    await msg_t.edit(reply)
+                    await op.edit(reply) if op else None
+                    break
+        if encode.process.returncode != 0 or problem:
+            await progressive.abandon() if progressive else None
+            await finish_tier(tier_key) if tier_key else None
+            s_remove(out, *(x[0] for x in extras))
+            for i in range(len(extras) + 1):
+                skip(queue_id, slot)
+            mark_file_as_done(einfo.select, queue_id, ejob)
             e_cancel().pop(_id) if e_cancel().get(_id) else None
             await save2db()
             await save2db("batches")
             return
         eet = time.time()
         etime = tf(eet - _set)
+        if tier_key:
+            await finish_tier(tier_key, eet - _set if timed else None)
 
         await asyncio.sleep(3)
         await enpause(msg_p)
-
-        mux_args = None
-        if file_exists(mux_file):
-            with open(mux_file, "r") as file:
-                mux_args = file.read().rstrip("\n").rstrip()
-            o_out = out
-            o_fold, o_fname = path_split(out)
-            o_ext = split_ext(o_fname)[-1]
-            file_name, metadata_name = await parse(
+        crop_msg = str()
+        # not if the encode fell back to another command
+        if crop_filter and crop_filter in ffmpeg:
+            (w, h), (width, height) = crop[0][:2], crop[1]
+            crop_msg = f"Cropped from `{width}x{height}` to `{w}x{h}`\n"
+        tier_msg = f"Encoded with tier `{tier}` of the parameters\n" if tier else str()
+
+        async def deliver(
+            out,
+            param_file,
+            msg_p,
+            _id,
+            op,
+            thumb2,
+            to_log,
+            progressive=None,
+            muxed=False,
+        ):
+            mux_args = None
+            if file_exists(mux_file) and not muxed:
+                with open(mux_file, "r") as file:
+                    mux_args = file.read().rstrip("\n").rstrip()
+                o_out = out
+                o_fold, o_fname = path_split(out)
+                o_ext = split_ext(o_fname)[-1]
+                file_name, metadata_name = await parse(
+                    name,
+                    o_fname,
+                    o_ext,
+                    anilist=ani,
+                    v=v,
+                    folder=o_fold,
+                    _filter=f,
+                    direct=n,
+                    p_file=param_file,
+                )
+                out = f"{_dir}/{file_name}"
+                smt = time.time()
+                mux_args = await another(mux_args, title, epi, sn, metadata_name, o_out)
+                ffmpeg = 'ffmpeg -i """{}""" ' f"{mux_args} -codec copy" ' """{}""" -y'
+                _out = split_ext(out)[0] + " [Muxing]" + split_ext(out)[1]
+                cmd = ffmpeg.format(o_out, _out)
+                encode = encoder(_id, event=msg_t)
+                await encode.start(cmd, AUX)
+                stderr = (await encode.await_completion())[1]
+                await report_encode_status(
+                    encode.process,
+                    _id,
+                    stderr,
+                    msg_t,
+                    sender_id,
+                    out,
+                    _is="Muxing",
+                    log_msg=op,
+                )
+                if encode.process.returncode != 0:
+                    s_remove(out, _out)
+                    skip(queue_id, slot)
+                    mark_file_as_done(einfo.select, queue_id, ejob)
+                    e_cancel().pop(_id) if e_cancel().get(_id) else None
+                    await save2db()
+                    await save2db("batches")
+                    return
+                s_remove(o_out)
+                os.replace(_out, out)
+                emt = time.time()
+                mtime = tf(emt - smt)
+
+            # sample the output's quality while it uploads
+            quality = None
+            if conf.QUALITY_SAMPLES:
+                quality = asyncio.create_task(
+                    measure_quality(
+                        dl,
+                        out,
+                        conf.QUALITY_SAMPLES,
+                        conf.QUALITY_LENGTH,
+                        crop_filter if crop_msg else None,
+                    )
+                )
+                measuring.append(quality)
+            sut = time.time()
+            fname = path_split(out)[1]
+            pcap = await custcap(
                 name,
-                o_fname,
-                o_ext,
+                fname,
                 anilist=ani,
-                v=v,
-                folder=o_fold,
+                ver=v,
+                encoder=conf.ENCODER,
                 _filter=f,
                 direct=n,
                 p_file=param_file,
+                folder=f"{_dir}/",
             )
-            out = f"{_dir}/{file_name}"
-            smt = time.time()
-            mux_args = await another(mux_args, title, epi, sn, metadata_name, o_out)
-            ffmpeg = 'ffmpeg -i """{}""" ' f"{mux_args} -codec copy" ' """{}""" -y'
-            _out = split_ext(out)[0] + " [Muxing]" + split_ext(out)[1]
-            cmd = ffmpeg.format(o_out, _out)
-            encode = encoder(_id, event=msg_t)
-            await encode.start(cmd)
-            stderr = (await encode.await_completion())[1]
-            await report_encode_status(
-                encode.process,
-                _id,
-                stderr,
-                msg_t,
-                sender_id,
-                out,
-                _is="Muxing",
-                log_msg=op,
+            await op.edit(f"`Uploading…` `{out}`") if op else None
+            upload = uploader(sender_id, _id, thumb2)
+            up = await upload.start(
+                msg_t.chat_id, out, msg_p, thumb2, pcap, message, progressive
             )
-            if encode.process.returncode != 0:
-                s_remove(out, _out)
-                skip(queue_id)
-                mark_file_as_done(einfo.select, queue_id)
-                e_cancel().pop(_id) if e_cancel().get(_id) else None
+            if upload.is_cancelled:
+                m = f"`Upload of {out} was cancelled`"
+                if sender_id != upload.canceller:
+                    canceller = await pyro.get_users(upload.canceller)
+                    # m += f"by [{canceller.first_name}](tg://user?id={upload.canceller})"
+                    m += f"by {canceller.mention()}"
+                m += "!"
+                await msg_p.edit(m)
+                if op:
+                    await op.edit(m)
+                quality.cancel() if quality else None
+                skip(queue_id, slot)
+                mark_file_as_done(einfo.select, queue_id, ejob)
                 await save2db()
                 await save2db("batches")
+                s_remove(thumb2, out)
                 return
-            s_remove(o_out)
-            copy_file(_out, out)
-            s_remove(_out)
-            emt = time.time()
-            mtime = tf(emt - smt)
-
-        sut = time.time()
-        fname = path_split(out)[1]
-        pcap = await custcap(
-            name,
-            fname,
-            anilist=ani,
-            ver=v,
-            encoder=conf.ENCODER,
-            _filter=f,
-            direct=n,
-            p_file=param_file,
-        )
-        await op.edit(f"`Uploading…` `{out}`") if op else None
-        upload = uploader(sender_id, _id)
-        up = await upload.start(msg_t.chat_id, out, msg_p, thumb2, pcap, message)
-        if upload.is_cancelled:
-            m = f"`Upload of {out} was cancelled`"
-            if sender_id != upload.canceller:
-                canceller = await pyro.get_users(upload.canceller)
-                # m += f"by [{canceller.first_name}](tg://user?id={upload.canceller})"
-                m += f"by {canceller.mention()}"
-            m += "!"
-            await msg_p.edit(m)
-            if op:
-                await op.edit(m)
-            skip(queue_id)
-            mark_file_as_done(einfo.select, queue_id)
-            await save2db()
-            await save2db("batches")
-            s_remove(thumb2, out)
-            return
-        eut = time.time()
-        utime = tf(eut - sut)
-
-        await msg_p.delete()
-        await op.delete() if op else None
-        await up.copy(chat_id=log_channel) if op else None
-
-        org_s = size_of(dl)
-        out_s = size_of(out)
-        pe = 100 - ((out_s / org_s) * 100)
-        per = str(f"{pe:.2f}") + "%"
-        mux_msg = f"Muxed in `{mtime}`\n" if mux_args else str()
-
-        text = str()
-        mi = ejob.sminfo = await info(dl) if not ejob.sminfo else ejob.sminfo
-        forward_task = asyncio.create_task(
-            forward_(name, out, up, mi, f, ani, n, param_file)
-        )
-
-        text += f"**Source:** `[{rlsgrp}]`"
-        if mi:
-            text += f"\n\nMediainfo: **[(Source)]({mi})**"
-        mi_msg = await up.reply(
-            text,
-            disable_web_page_preview=True,
-            quote=True,
-        )
-        await mi_msg.copy(chat_id=log_channel) if op else None
-
-        st_msg = await up.reply(
-            f"**Encode Stats:**\n\nOriginal Size: "
-            f"`{hbs(org_s)}`\nEncoded Size: `{hbs(out_s)}`\n"
-            f"Encoded Percentage: `{per}`\n\n"
-            f"{'Cached' if einfo.cached_dl else 'Downloaded'} in `{dtime}`\n"
-            f"Encoded in `{etime}`\n{mux_msg}Uploaded in `{utime}`",
-            disable_web_page_preview=True,
-            quote=True,
-        )
-        await st_msg.copy(chat_id=log_channel) if op else None
-        await forward_task
+            eut = time.time()
+            utime = tf(eut - sut)
+            # a faster tier's output isn't what ffmpeg.txt would have made
+            if r_source and not (tier and param_file == ffmpeg_file):
+                x_key = result_key(r_source, param_file, name, v, f, n, ani)
+                await add_result(x_key, params_hash(param_file, einfo.size), up)
+
+            await msg_p.delete()
+            await op.delete() if op else None
+            await up.copy(chat_id=log_channel) if to_log else None
+
+            org_s = size_of(dl)
+            out_s = size_of(out)
+            pe = 100 - ((out_s / org_s) * 100)
+            per = str(f"{pe:.2f}") + "%"
+            mux_msg = f"Muxed in `{mtime}`\n" if mux_args else str()
+            q_msg = str()
+            if quality and (scores := await quality):
+                q_msg = f"Sampled Quality: {quality_text(scores)}\n"
+                q_key = f"{chat_id}:{msg_id}:{einfo.select or 0}:{param_file}"
+                q_tier = tier if param_file == ffmpeg_file else None
+                await record_quality(
+                    q_key, path_split(out)[1], param_file, scores, q_tier
+                )
+
+            # one output at a time so the last one forwarded knows it's the last
+            async with ejob.lock:
+                text = str()
+                mi = ejob.sminfo = await info(dl) if not ejob.sminfo else ejob.sminfo
+                forward_task = asyncio.create_task(
+                    forward_(name, out, up, mi, f, ani, n, param_file, slot)
+                )
+
+                text += f"**Source:** `[{rlsgrp}]`"
+                if mi:
+                    text += f"\n\nMediainfo: **[(Source)]({mi})**"
+                mi_msg = await up.reply(
+                    text,
+                    disable_web_page_preview=True,
+                    quote=True,
+                )
+                await mi_msg.copy(chat_id=log_channel) if to_log else None
+
+                st_msg = await up.reply(
+                    f"**Encode Stats:**\n\nOriginal Size: "
+                    f"`{hbs(org_s)}`\nEncoded Size: `{hbs(out_s)}`\n"
+                    f"Encoded Percentage: `{per}`\n{crop_msg}{tier_msg}{q_msg}\n"
+                    f"{'Cached' if einfo.cached_dl else 'Downloaded'} in `{dtime}`\n"
+                    f"Encoded in `{etime}`\n{mux_msg}Uploaded in `{utime}`",
+                    disable_web_page_preview=True,
+                    quote=True,
+                )
+                await st_msg.copy(chat_id=log_channel) if to_log else None
+                await forward_task
+
+                skip(queue_id, slot)
+                mark_file_as_done(einfo.select, queue_id, ejob)
+                await save2db()
+                await save2db("batches")
+            s_remove(thumb2)
+            s_remove(out)
 
-        skip(queue_id)
-        mark_file_as_done(einfo.select, queue_id)
-        await save2db()
-        await save2db("batches")
-        s_remove(thumb2)
-        s_remove(out)
+        deliveries = [
+            deliver(
+                out,
+                param_file,
+                msg_p,
+                _id,
+                op,
+                thumb2,
+                bool(op),
+                progressive,
+                bool(muxed),
+            )
+        ]
+        for x_out, x_file, x_ffmpeg, x_muxed in extras:
+            x_msg = await msg_p.reply("`Upload Pending…`", quote=True)
+            x_thumb = f"{split_ext(thumb2)[0]}_p{len(deliveries)}.jpg"
+            copy_file(thumb2, x_thumb) if file_exists(thumb2) else None
+            x_id = f"{x_msg.chat.id}:{x_msg.id}"
+            deliveries.append(
+                deliver(
+                    x_out, x_file, x_msg, x_id, None, x_thumb, bool(op), None, x_muxed
+                )
+            )
+        try:
+            async with get_stage("upload").enter(slot):
+                await asyncio.gather(*deliveries)
+        finally:
+            # no-op unless delivery failed before the upload was finished
+            await progressive.abandon() if progressive else None
 
-    except Exception:
+    except Exception as e:
         await logger(Exception)
-        error = (
-            "Due to an unknown error "
-            "bot has been paused indefinitely\n"
-            "check logs for more info."
-        )
-        l_msg = await bc_msg(error)
-        entime.pause_indefinitely(l_msg)
+        # only pause for what would break every other item too
+        if fault := global_fault(e):
+            error = (
+                f"Due to an error ({fault}) "
+                "bot has been paused indefinitely\n"
+                "check logs for more info."
+            )
+            l_msg = await bc_msg(error)
+            entime.pause_indefinitely(l_msg)
+        elif queue_id := slot.queue_id:
+            ejob.complete()
+            slot.release()
+            trace = traceback.format_exc()
+            if name := await item_failed(queue_id, trace, einfo.output):
+                await bc_msg(
+                    f"`{name}` kept failing and was moved to the dead letters, "
+                    "see /failed."
+                )
 
     finally:
+        for quality in measuring:
+            quality.cancel()
+        await asyncio.gather(*measuring, return_exceptions=True)
         einfo.reset()
         if not ejob.pending():
             ejob.reset(force=True)
@@ -84,6 +84,129 @@ async def get_files_from_torrent(hash, tag=None, qb=None):
     return file_list
 
 
+class Stream_source:
+    """
+    Follows a download that's still in progress so the source
+    can be read (and encoded) from the start while the rest arrives.
+    """
+
+    # containers ffmpeg can read front to back without seeking
+    exts = (".mkv", ".webm", ".ts", ".m2ts", ".flv")
+    min_size = 16 * 1024 * 1024
+
+    def __init__(self, download, task):
+        self.download = download
+        self.task = task
+        self.qb_file = None
+
+    @property
+    def done(self):
+        return self.task.done()
+
+    @property
+    def file(self):
+        """The file that's being written to"""
+        if not (path := self.download.path):
+            return
+        # pyrogram writes to a .temp file and qbittorrent may add .!qB until done
+        for file in (path, f"{path}.temp", f"{path}.!qB"):
+            if os.path.isfile(file):
+                return file
+
+    def failed(self):
+        download = self.download
+        return download.is_cancelled or bool(download.download_error)
+
+    async def available(self):
+        """Number of bytes that can be read from the start of the file"""
+        if not (file := self.file):
+            return 0
+        if self.done or not (self.download.qbit or self.download.uri_gid):
+            # telegram downloads are written in order
+            return os.path.getsize(file)
+        if not self.download.qbit:
+            return await self.aria2_available()
+        qb, _hash = self.download.qb, self.download.uri_gid
+        if not self.qb_file:
+            props = await sync_to_async(qb.torrents_properties, torrent_hash=_hash)
+            files = await sync_to_async(qb.torrents_files, torrent_hash=_hash)
+            offset = 0
+            for tfile in files:
+                if tfile.name == self.download.file_name:
+                    self.qb_file = offset, tfile.size, props.piece_size
+                    break
+                offset += tfile.size
+            else:
+                return 0
+        offset, size, piece_size = self.qb_file
+        states = await sync_to_async(qb.torrents_piece_states, torrent_hash=_hash)
+        first = piece = offset // piece_size
+        while piece < len(states) and states[piece] == 2:
+            piece += 1
+        if piece == first:
+            return 0
+        return max(min(piece * piece_size - offset, size), 0)
+
+    async def aria2_available(self):
+        """
+        Bytes aria2 has fetched from the start of the file without a gap;
+        pieces are fetched in order but several at a time
+        """
+        aria2, gid = self.download.aria2, self.download.uri_gid
+        download = await sync_to_async(aria2.get_download, gid)
+        pieces = 0
+        for char in download.bitfield or str():
+            bits = int(char, 16)
+            if bits == 15:
+                pieces += 4
+                continue
+            for mask in (8, 4, 2):
+                if not bits & mask:
+                    break
+                pieces += 1
+            break
+        return min(pieces * download.piece_length, download.total_length)
+
+    async def ready(self):
+        """
+        Waits for enough of the source to start encoding;
+        returns False if it can't be streamed or finished downloading first
+        """
+        while not self.done:
+            if self.failed():
+                return False
+            path = self.download.path
+            if path and not path.lower().endswith(self.exts):
+                return False
+            if await self.available() >= self.min_size:
+                return True
+            await asyncio.sleep(1)
+        return False
+
+    async def feed(self, writer):
+        """Writes the download to ffmpeg's stdin as it arrives"""
+        pos = 0
+        try:
+            with open(self.file, "rb") as file:
+                while True:
+                    done = self.done
+                    end = await self.available()
+                    while pos < end and (data := file.read(min(end - pos, 1048576))):
+                        writer.write(data)
+                        await writer.drain()
+                        pos += len(data)
+                    if done or self.failed():
+                        break
+                    await asyncio.sleep(1)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading
+            pass
+        except Exception:
+            await logger(Exception)
+        finally:
+            writer.close()
+
+
 async def download2(dl, file, message=None, e=None):
     try:
         if not message:
@@ -112,6 +235,12 @@ async def download2(dl, file, message=None, e=None):
         await logger(Exception)
 
 
+def is_direct_link(url):
+    """Whether a link is a plain http(s) file rather than a torrent"""
+    path = url.split("?", 1)[0].lower()
+    return path.startswith(("http://", "https://")) and not path.endswith(".torrent")
+
+
 async def get_leech_name(url, try_jd=False):
     """
     Get filename from URL using aria2, with JDownloader fallback
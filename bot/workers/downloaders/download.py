@@ -33,6 +33,7 @@ class Downloader:
         dl_info=False,
         folder="downloads/",
         qbit=None,
+        stream=False,
     ):
         self.sender = int(sender)
         self.callback_data = "cancel_download"
@@ -55,6 +56,8 @@ class Downloader:
         self.path = None
         self.qb = None
         self.qbit = qbit
+        # fetch in order so the file can be read while it downloads
+        self.stream = stream
         self.unfin_str = conf.UN_FINISHED_PROGRESS_STR
         self.display_dl_info = _bot.display_additional_dl_info
         if conf.PAUSE_ON_DL_INFO:
@@ -179,9 +182,10 @@ class Downloader:
             if not self.aria2:
                 self.download_error = "E404: Aria2 is currently not available."
                 raise Exception(self.download_error)
-            downloads = await sync_to_async(
-                self.aria2.add, self.uri, {"dir": f"{os.getcwd()}/{self.dl_folder}"}
-            )
+            options = {"dir": f"{os.getcwd()}/{self.dl_folder}"}
+            if self.stream:
+                options["stream-piece-selector"] = "inorder"
+            downloads = await sync_to_async(self.aria2.add, self.uri, options)
             self.uri_gid = downloads[0].gid
             download = await sync_to_async(self.aria2.get_download, self.uri_gid)
             while True:
@@ -217,6 +221,8 @@ class Downloader:
                 seeding_time_limit=0,
                 is_paused=False,
                 tags=self.id,
+                is_sequential_download=self.stream or None,
+                is_first_last_piece_priority=self.stream or None,
             )
             self.time = ttt = time.time()
             if result.lower() == "ok.":
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+
+from bot.utils.ffmpeg_utils import Encode_progress, sample_cmd
+from bot.utils.governor import AUX, governed, role_threads
+from bot.utils.os_utils import s_remove
+
+from .encode import encode_log, read_progress
+
+
+class Bench_result:
+    """What encoding the samples with one candidate took and produced"""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.error = None
+        self.elapsed = 0
+        self.frames = 0
+        self.sampled = 0
+        self.size = 0
+
+    def __str__(self):
+        return self.error or self.cmd
+
+    def fps(self, jobs=1):
+        return self.frames * jobs / self.elapsed if self.elapsed else 0
+
+    def projected_time(self, duration, jobs=1):
+        """Time a full encode would take with every bench job's cpus"""
+        if not self.sampled:
+            return 0
+        return duration * self.elapsed / (self.sampled * jobs)
+
+    def projected_size(self, duration):
+        return int(self.size * duration / self.sampled) if self.sampled else 0
+
+
+def candidate_cmd(params):
+    """Wraps bare ffmpeg options the way ffmpeg.txt has them"""
+    params = params.strip()
+    if "{}" in params:
+        return params
+    return f'ffmpeg -i """{{}}""" {params} """{{}}"""'
+
+
+def bench_budget(jobs=None):
+    """How many samples run at once and with how many threads each"""
+    cpus = role_threads(AUX) or os.cpu_count() or 1
+    jobs = jobs or max(cpus // 4, 1)
+    return jobs, max(cpus // jobs, 1)
+
+
+def sample_points(duration, segments, length):
+    """Spreads the samples evenly over the source, away from its ends"""
+    length = min(length, duration / segments)
+    step = duration / (segments + 1)
+    return [max(step * (i + 1) - length / 2, 0) for i in range(segments)], length
+
+
+async def encode_sample(args, result):
+    start = time.time()
+    progress = Encode_progress()
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=governed(AUX),
+    )
+    stderr = encode_log()
+    await asyncio.gather(stderr.read(proc.stderr), read_progress(proc.stdout, progress))
+    await proc.wait()
+    if proc.returncode != 0:
+        error = stderr.tail().decode(errors="replace").strip().splitlines()
+        result.error = error[-1] if error else f"ffmpeg exited with {proc.returncode}"
+        return
+    result.elapsed += time.time() - start
+    result.frames += progress.frame or 0
+    result.sampled += progress.out_time or 0
+    result.size += os.path.getsize(args[-2])
+
+
+async def run_bench(
+    candidates, source, duration, workdir, segments=3, length=20, jobs=None
+):
+    """
+    Encodes samples of source with each candidate command, 'jobs' at a time
+    returns a Bench_result per candidate and the number of jobs used
+    """
+    jobs, threads = bench_budget(jobs)
+    points, length = sample_points(duration, segments, length)
+    lock = asyncio.Semaphore(jobs)
+    results = [Bench_result(cmd) for cmd in candidates]
+    os.makedirs(workdir, exist_ok=True)
+
+    async def sample(result, i, j, start):
+        out = os.path.join(workdir, f"{i}_{j}.mkv")
+        args = sample_cmd(result.cmd, source, out, round(start, 3), length, threads)
+        if not args:
+            result.error = "Not an 'ffmpeg -i {} [options] {}' command"
+            return
+        async with lock:
+            if not result.error:
+                await encode_sample(args, result)
+        s_remove(out)
+
+    try:
+        await asyncio.gather(
+            *(
+                sample(result, i, j, start)
+                for i, result in enumerate(results)
+                for j, start in enumerate(points)
+            )
+        )
+    finally:
+        s_remove(workdir, folders=True)
+    return results, jobs
@@ -1,15 +1,558 @@
 import asyncio
 import os
+import re
+import signal
 
-from bot import Button
+import psutil
+
+from bot import Button, resume_dir
 from bot.config import conf
 from bot.fun.emojis import enmoji
-from bot.utils.bot_utils import code, decode
+from bot.utils.bot_utils import code, decode, enc_progress
 from bot.utils.bot_utils import encode_job as ejob
-from bot.utils.bot_utils import get_codec
-from bot.utils.log_utils import logger
+from bot.utils.bot_utils import get_codec, hbs
+from bot.utils.ffmpeg_utils import (
+    Chunk_plan,
+    Encode_log,
+    Encode_progress,
+    Size_plan,
+    Split_plan,
+    with_progress,
+)
+from bot.utils.governor import MAIN, governed, with_threads
+from bot.utils.log_utils import log, logger
+from bot.utils.os_utils import get_stream_duration, probe, s_remove, size_of
+
+from . import remote
 
 def_enc_msg = "**Currently Encoding {}:**\n└`{}`\n\n{}**⏳This Might Take A While⏳**"
+log_dir = "encode_logs"
+# percent of an encode done before its projected size is trusted
+OVERSIZE_AFTER = 10
+# seconds between the watchdog's looks at an encode
+STALL_CHECK = 15
+# cpu seconds an encode has to use between looks to count as working
+STALL_CPU = 0.5
+
+
+def resume_key(queue_id, job):
+    """Names the checkpoint of a queue item's current profile"""
+    chat_id, msg_id = queue_id
+    return f"{chat_id}_{msg_id}_{job.get_pending_index()}"
+
+
+def prune_checkpoints(queue):
+    """Removes the checkpoints of items no longer in the queue"""
+    if not os.path.isdir(resume_dir):
+        return
+    keys = tuple(f"{chat_id}_{msg_id}_" for chat_id, msg_id in queue)
+    for name in os.listdir(resume_dir):
+        if not name.startswith(keys):
+            s_remove(os.path.join(resume_dir, name), folders=True)
+
+
+def encode_log(name=None):
+    """An Encode_log that spills to a per-job file when ENCODE_LOG_SIZE is set"""
+    spill = os.path.join(log_dir, f"{name.replace(':', '_')}.log") if name else None
+    return Encode_log(conf.ENCODE_LOG_LINES, spill, conf.ENCODE_LOG_SIZE * 1048576)
+
+
+def kill_group(proc):
+    """Kills a process started in a session of its own and everything it started"""
+    try:
+        if (pgid := os.getpgid(proc.pid)) != os.getpgrp():
+            os.killpg(pgid, signal.SIGKILL)
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def kill_encode(process):
+    """Kills an encode, whether a process started by Encoder.start() or a stand-in"""
+    if isinstance(process, asyncio.subprocess.Process):
+        kill_group(process)
+    else:
+        process.kill()
+
+
+def process_cpu(pids):
+    """CPU seconds used by processes and their children, ignoring those that are gone"""
+    total = 0
+    for pid in pids:
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+        except psutil.Error:
+            continue
+        for x in procs:
+            try:
+                times = x.cpu_times()
+                total += times.user + times.system
+            except psutil.Error:
+                pass
+    return total
+
+
+async def read_progress(stdout, progress):
+    """Feeds stdout to the progress object; returns anything else printed"""
+    other = encode_log()
+    buffer = b""
+    while data := await stdout.read(4096):
+        # HandBrakeCLI ends its status lines with a carriage return
+        *lines, buffer = re.split(rb"[\r\n]", buffer + data)
+        for line in lines:
+            if not progress.update(line.decode(errors="replace")):
+                other.add(line)
+    if buffer and not progress.update(buffer.decode(errors="replace")):
+        other.add(buffer)
+    return other.tail()
+
+
+class Streamed_process:
+    """
+    Stands in for the encoding process while the source is still downloading;
+    ffmpeg reads the download through a pipe and if that fails the source
+    is encoded again from the file once the download completes.
+    """
+
+    def __init__(self, stream_cmd, cmd, source, progress, name=None):
+        self.stream_cmd = stream_cmd
+        self.cmd = cmd
+        self.source = source
+        self.progress = progress
+        self.name = name
+        self.killed = False
+        self.pid = None
+        self.proc = None
+        self.returncode = None
+        self.stderr = b""
+        self.task = asyncio.create_task(self.run())
+
+    def __str__(self):
+        return "#streamed"
+
+    def kill(self):
+        self.killed = True
+        self.source.download.is_cancelled = True
+        if self.proc:
+            kill_group(self.proc)
+
+    async def ffmpeg(self, cmd, source=None):
+        proc = await asyncio.create_subprocess_shell(
+            with_progress(cmd),
+            stdin=asyncio.subprocess.PIPE if source else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=governed(MAIN),
+            start_new_session=True,
+        )
+        self.proc, self.pid = proc, proc.pid
+        stderr = encode_log(self.name)
+        tasks = [stderr.read(proc.stderr), read_progress(proc.stdout, self.progress)]
+        if source:
+            tasks.append(source.feed(proc.stdin))
+        await asyncio.gather(*tasks)
+        await proc.wait()
+        self.stderr = stderr.tail()
+        if proc.returncode == 0 and stderr.spill:
+            s_remove(stderr.spill, f"{stderr.spill}.1")
+        return proc.returncode
+
+    async def downloaded(self):
+        """Waits for the download, returns True if it completed"""
+        result = await self.source.task
+        if result and not self.source.failed():
+            return True
+        error = self.source.download.download_error or "Download failed."
+        self.stderr = error.encode()
+        return False
+
+    async def run(self):
+        try:
+            code = await self.ffmpeg(self.stream_cmd, self.source)
+            if self.killed:
+                return self.finish(code)
+            if not await self.downloaded():
+                return self.finish(1)
+            if code == 0:
+                return self.finish(0)
+            # the source can't be read as a stream after all
+            log(e=f"Streamed encode failed, encoding {self.source.file} again")
+            self.progress.out_time = 0
+            self.progress.refresh()
+            self.finish(await self.ffmpeg(self.cmd))
+        except Exception as e:
+            await logger(Exception)
+            self.stderr = str(e).encode()
+            self.finish(1)
+
+    def finish(self, code):
+        self.returncode = -9 if self.killed and not code else code
+
+    async def communicate(self):
+        await self.task
+        return b"", self.stderr
+
+    async def wait(self):
+        await self.task
+        return self.returncode
+
+
+class Chunked_process:
+    """
+    Stands in for the encoding process while a source is encoded in chunks;
+    splits at keyframes, encodes the chunks in parallel locally and on
+    any remote workers, joins them and muxes the result with the source's
+    other streams.
+    """
+
+    def __init__(
+        self, plan, duration, workers, remotes=(), progress=None, resume=False
+    ):
+        self.plan = plan
+        self.duration = duration
+        self.progress = progress
+        self.resume = resume
+        self.cancelled = False
+        self.done = set()
+        self.seconds = None
+        self.total = 0
+        self.workers = workers
+        self.remotes = remotes
+        self.chunks = asyncio.Queue()
+        self.conns = []
+        self.killed = False
+        self.pending = 0
+        # bumped whenever a remote worker reports that its chunk moved on
+        self.activity = 0
+        self.pid = None
+        self.procs = []
+        self.returncode = None
+        self.stderr = b""
+        self.task = asyncio.create_task(self.run())
+
+    def __str__(self):
+        return "#chunked"
+
+    def kill(self):
+        self.cancelled = True
+        self.stop()
+
+    def stop(self):
+        self.killed = True
+        for proc in self.procs:
+            kill_group(proc)
+        for conn in self.conns:
+            conn.close()
+
+    async def step(self, args):
+        if self.killed:
+            return -9
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=governed(MAIN),
+            start_new_session=True,
+        )
+        self.procs.append(proc)
+        stderr = encode_log()
+        await stderr.read(proc.stderr)
+        await proc.wait()
+        self.procs.remove(proc)
+        if proc.returncode != 0 and not self.killed:
+            self.stderr = stderr.tail()
+        return proc.returncode
+
+    async def next_chunk(self):
+        """Returns the next chunk to encode or None when there's nothing left"""
+        while not self.killed and self.pending:
+            try:
+                return self.chunks.get_nowait()
+            except asyncio.QueueEmpty:
+                # a chunk on a lost worker may still come back
+                await asyncio.sleep(1)
+
+    def chunk_done(self, chunk, code, stderr=None):
+        if not code:
+            self.pending -= 1
+            if self.resume:
+                self.done.add(os.path.split(chunk)[1])
+                self.plan.checkpoint(self.seconds, self.done)
+            if self.progress:
+                done = self.total - self.pending
+                self.progress.out_time = self.duration * done / self.total
+                self.progress.refresh()
+            return
+        if stderr and not self.killed:
+            self.stderr = stderr
+        # no point carrying on with the rest
+        self.stop()
+
+    def active(self):
+        self.activity += 1
+
+    async def local_worker(self):
+        while chunk := await self.next_chunk():
+            self.chunk_done(chunk, await self.step(self.plan.encode_cmd(chunk)))
+
+    async def remote_worker(self, address):
+        failures = 0
+        while chunk := await self.next_chunk():
+            try:
+                code, stderr = await remote.encode_chunk(
+                    address,
+                    self.plan.encode_args(),
+                    chunk,
+                    self.plan.encoded(chunk),
+                    conf.ENCODE_WORKERS_TOKEN,
+                    self.conns,
+                    self.active,
+                )
+            except (OSError, ValueError) as e:
+                # a garbled reply is as good as a lost worker
+                self.chunks.put_nowait(chunk)
+                if self.killed:
+                    return
+                failures += 1
+                log(e=f"Lost encode worker {address} ({failures}/3): {e}")
+                if failures == 3:
+                    return
+                await asyncio.sleep(5 * failures)
+                continue
+            failures = 0
+            self.chunk_done(chunk, code, stderr)
+
+    async def run(self):
+        plan = self.plan
+        try:
+            if self.resume and (checkpoint := plan.load_checkpoint()):
+                self.seconds, self.done = checkpoint
+                log(e=f"Resuming {plan.infile} from {len(self.done)} encoded chunks")
+            else:
+                s_remove(plan.workdir, folders=True)
+                os.makedirs(plan.workdir, exist_ok=True)
+                # a few chunks per worker so a slow chunk doesn't hold up the rest
+                workers = self.workers + len(self.remotes)
+                self.seconds = max(self.duration // (workers * 3), 30)
+                if code := await self.step(plan.split_cmd(self.seconds)):
+                    return self.finish(code)
+                if self.resume:
+                    plan.checkpoint(self.seconds, self.done)
+            for chunk in plan.chunks():
+                self.total += 1
+                if os.path.split(chunk)[1] in self.done:
+                    continue
+                self.chunks.put_nowait(chunk)
+                self.pending += 1
+            if self.progress and self.done:
+                self.progress.out_time = self.duration * len(self.done) / self.total
+                self.progress.refresh()
+            await asyncio.gather(
+                *(self.local_worker() for i in range(self.workers)),
+                *(self.remote_worker(address) for address in self.remotes),
+            )
+            if self.killed:
+                return self.finish(-9 if not self.stderr else 1)
+            if self.pending:
+                self.stderr = b"All encode workers were lost."
+                return self.finish(1)
+            if code := await self.step(plan.concat_cmd()):
+                return self.finish(code)
+            self.finish(await self.step(plan.mux_cmd()))
+        except Exception as e:
+            await logger(Exception)
+            self.stderr = str(e).encode()
+            self.finish(1)
+        finally:
+            # keep the checkpoint unless it's of no further use
+            if not self.resume or self.cancelled or self.returncode == 0:
+                s_remove(plan.workdir, folders=True)
+
+    def finish(self, code):
+        self.returncode = -9 if self.killed and not code else code
+
+    async def communicate(self):
+        await self.task
+        return b"", self.stderr
+
+    async def wait(self):
+        await self.task
+        return self.returncode
+
+
+class Sized_process:
+    """
+    Stands in for the encoding process while a source is encoded to a
+    target size; runs the first pass if the encoder gets two, then the
+    final pass, and runs the final pass once more with a corrected
+    bitrate if the output missed the size by more than the tolerance.
+    """
+
+    def __init__(self, plan, progress, name=None):
+        self.plan = plan
+        self.progress = progress
+        self.name = name
+        self.killed = False
+        self.pid = None
+        self.proc = None
+        self.returncode = None
+        self.stderr = b""
+        self.task = asyncio.create_task(self.run())
+
+    def __str__(self):
+        return "#sized"
+
+    def kill(self):
+        self.killed = True
+        if self.proc:
+            kill_group(self.proc)
+
+    async def step(self, args):
+        if self.killed:
+            return -9
+        self.progress.out_time = 0
+        self.progress.refresh()
+        proc = await asyncio.create_subprocess_exec(
+            args[0],
+            "-progress",
+            "pipe:1",
+            *args[1:],
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=governed(MAIN),
+            start_new_session=True,
+        )
+        self.proc, self.pid = proc, proc.pid
+        stderr = encode_log(self.name)
+        await asyncio.gather(
+            stderr.read(proc.stderr), read_progress(proc.stdout, self.progress)
+        )
+        await proc.wait()
+        self.stderr = stderr.tail()
+        if proc.returncode == 0 and stderr.spill:
+            s_remove(stderr.spill, f"{stderr.spill}.1")
+        return proc.returncode
+
+    def missed(self):
+        """How far off the target size the output is, as a fraction"""
+        return abs(size_of(self.plan.outfile) - self.plan.size) / self.plan.size
+
+    async def run(self):
+        plan = self.plan
+        try:
+            os.makedirs(plan.workdir, exist_ok=True)
+            if plan.two_pass() and (code := await self.step(plan.first_pass_cmd())):
+                return self.finish(code)
+            if code := await self.step(plan.final_cmd()):
+                return self.finish(code)
+            if (missed := self.missed()) > conf.TARGET_SIZE_TOLERANCE / 100:
+                log(e=f"{plan.outfile} missed its size by {missed:.1%}, encoding again")
+                plan.adjust(size_of(plan.outfile))
+                code = await self.step(plan.final_cmd())
+            self.finish(code)
+        except Exception as e:
+            await logger(Exception)
+            self.stderr = str(e).encode()
+            self.finish(1)
+        finally:
+            s_remove(plan.workdir, folders=True)
+
+    def finish(self, code):
+        self.returncode = -9 if self.killed and not code else code
+
+    async def communicate(self):
+        await self.task
+        return b"", self.stderr
+
+    async def wait(self):
+        await self.task
+        return self.returncode
+
+
+class Split_process:
+    """
+    Stands in for the encoding process while a source's video and audio
+    tracks are encoded at the same time in processes of their own;
+    muxes them with the source's other streams once all of them are done.
+    """
+
+    def __init__(self, plan, progress, name=None):
+        self.plan = plan
+        self.progress = progress
+        self.name = name
+        self.killed = False
+        self.pid = None
+        self.procs = []
+        self.returncode = None
+        self.stderr = b""
+        self.task = asyncio.create_task(self.run())
+
+    def __str__(self):
+        return "#split"
+
+    def kill(self):
+        self.killed = True
+        for proc in self.procs:
+            kill_group(proc)
+
+    async def step(self, args, progress=None):
+        if self.killed:
+            return -9
+        if progress:
+            args = [args[0], "-progress", "pipe:1", *args[1:]]
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE if progress else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=governed(MAIN),
+            start_new_session=True,
+        )
+        self.procs.append(proc)
+        self.pid = self.pid or proc.pid
+        stderr = encode_log(self.name if progress else None)
+        tasks = [stderr.read(proc.stderr)]
+        if progress:
+            tasks.append(read_progress(proc.stdout, progress))
+        await asyncio.gather(*tasks)
+        await proc.wait()
+        self.procs.remove(proc)
+        if proc.returncode != 0 and not self.killed:
+            self.stderr = stderr.tail()
+            # the other tracks are of no use without this one
+            self.kill()
+        elif proc.returncode == 0 and stderr.spill:
+            s_remove(stderr.spill, f"{stderr.spill}.1")
+        return proc.returncode
+
+    async def run(self):
+        plan = self.plan
+        try:
+            os.makedirs(plan.workdir, exist_ok=True)
+            codes = await asyncio.gather(
+                self.step(plan.video_cmd(), self.progress),
+                *(self.step(plan.audio_cmd(*track)) for track in plan.tracks),
+            )
+            if code := next((x for x in codes if x), 0):
+                return self.finish(1 if self.stderr else code)
+            self.finish(await self.step(plan.mux_cmd()))
+        except Exception as e:
+            await logger(Exception)
+            self.stderr = str(e).encode()
+            self.finish(1)
+        finally:
+            s_remove(plan.workdir, folders=True)
+
+    def finish(self, code):
+        self.returncode = -9 if self.killed and not code else code
+
+    async def communicate(self):
+        await self.task
+        return b"", self.stderr
+
+    async def wait(self):
+        await self.task
+        return self.returncode
 
 
 class Encoder:
@@ -18,10 +561,19 @@ class Encoder:
         self.enc_id = _id
         self.event = event
         self.log_msg = log
+        self.oversized = None
         self.process = None
+        self.progress = Encode_progress()
+        self.reader = None
+        self.stderr = None
+        self.stderr_reader = None
         self.req_clean = False
         self.sender = sender
-        self.sjob = sjob
+        self.size_watcher = None
+        self.stalled = None
+        self.watchdog = None
+        # sjob: the slot's Encode_job, or True for the default job
+        self.sjob = ejob if sjob is True else sjob
         self.log_enc_id = None
         if self.log_msg:
             self.log_enc_id = f"{log.chat_id}:{log.id}"
@@ -29,28 +581,172 @@ class Encoder:
     def __str__(self):
         return "#WIP"
 
-    async def start(self, cmd):
+    async def start(self, cmd, role=MAIN):
+        """role: governs the process, AUX for muxing and other side work"""
         process = await asyncio.create_subprocess_shell(
-            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            with_progress(with_threads(cmd, role)),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=governed(role),
+            start_new_session=True,
         )
         self.process = process
+        self.reader = asyncio.create_task(self.read_progress())
+        self.stderr = encode_log(self.enc_id)
+        self.stderr_reader = asyncio.create_task(self.stderr.read(process.stderr))
         return process
 
+    async def read_progress(self):
+        return await read_progress(self.process.stdout, self.progress)
+
+    async def start_chunked(self, ffmpeg, dl, out, resume=None):
+        """
+        Encodes in parallel chunks if the source is long enough
+        and the command allows it, otherwise falls back to start()
+        resume: key to checkpoint the chunks under so the encode
+        can pick up where it left off after a restart
+        """
+        cmd = ffmpeg.format(dl, out)
+        workdir = os.path.join(os.path.split(out)[0] or ".", "chunks")
+        if resume:
+            workdir = os.path.join(resume_dir, resume)
+        plan = Chunk_plan(ffmpeg, dl, out, workdir)
+        if plan.error:
+            log(e=f"Not encoding in chunks: {plan.error}")
+            return await self.start(cmd)
+        duration = await get_stream_duration(dl)
+        if not duration or duration < conf.CHUNK_MIN_DURATION:
+            return await self.start(cmd)
+        self.progress.duration = duration
+        remotes = conf.ENCODE_WORKERS.split()
+        self.process = Chunked_process(
+            plan,
+            duration,
+            conf.CHUNK_ENCODE or int(not remotes),
+            remotes,
+            self.progress,
+            bool(resume),
+        )
+        return self.process
+
+    async def start_streamed(self, ffmpeg, source, out):
+        """
+        Encodes from a download that's still in progress
+        falls back to start() once it completes if ffmpeg can't read a pipe
+        """
+        cmd = ffmpeg.format(source.download.path, out)
+        if os.path.split(ffmpeg.split(maxsplit=1)[0].strip("\"'"))[1] != "ffmpeg":
+            await source.task
+            return await self.start(cmd)
+        self.progress.duration = await get_stream_duration(source.file)
+        self.process = Streamed_process(
+            ffmpeg.format("pipe:0", out), cmd, source, self.progress, self.enc_id
+        )
+        return self.process
+
+    async def start_split(self, ffmpeg, dl, out):
+        """
+        Encodes the video and audio tracks at the same time
+        falls back to start() if the command or source doesn't allow it
+        """
+        cmd = ffmpeg.format(dl, out)
+        workdir = os.path.join(os.path.split(out)[0] or ".", "tracks")
+        plan = Split_plan(ffmpeg, dl, out, workdir)
+        if not plan.error:
+            plan.select(await probe(dl))
+        if plan.error:
+            log(e=f"Not splitting streams: {plan.error}")
+            return await self.start(cmd)
+        self.process = Split_process(plan, self.progress, self.enc_id)
+        return self.process
+
+    async def start_sized(self, ffmpeg, dl, out, size):
+        """
+        Encodes to a target size in bytes
+        falls back to start() if the command or source doesn't allow it
+        """
+        cmd = ffmpeg.format(dl, out)
+        workdir = os.path.join(os.path.split(out)[0] or ".", "passes")
+        plan = Size_plan(ffmpeg, dl, out, size, workdir)
+        if not plan.error:
+            plan.estimate(await probe(dl))
+        if plan.error:
+            log(e=f"Not encoding to a size: {plan.error}")
+            return await self.start(cmd)
+        self.progress.duration = plan.duration
+        self.process = Sized_process(plan, self.progress, self.enc_id)
+        return self.process
+
+    def limit_size(self, limit):
+        """Aborts the encode once its output is projected to exceed limit bytes"""
+        self.size_watcher = asyncio.create_task(self.watch_size(limit))
+
+    async def watch_size(self, limit):
+        while self.process.returncode is None:
+            await asyncio.sleep(10)
+            if (self.progress.percentage or 0) < OVERSIZE_AFTER:
+                continue
+            if (projected := self.progress.projected_size or 0) > limit:
+                self.oversized = projected
+                kill_encode(self.process)
+                return
+
+    def watch_stalls(self, timeout):
+        """Kills the encode once it has made no progress for timeout seconds"""
+        if not timeout:
+            return
+        self.watchdog = asyncio.create_task(self.watch_progress(timeout))
+
+    async def watch_progress(self, timeout):
+        """
+        Progress is the output's timestamp and size, the cpu time of the
+        encode's processes or a remote worker's word that its chunk moved on;
+        without any of them for timeout seconds
+        the reason is kept in stalled and the encode is killed
+        """
+        last, cpu, still = None, 0, 0
+        while self.process.returncode is None:
+            await asyncio.sleep(STALL_CHECK)
+            process, progress = self.process, self.progress
+            pids = [x.pid for x in getattr(process, "procs", ())] or [process.pid]
+            out = progress.out
+            size = size_of(out) if out and os.path.isfile(out) else 0
+            used = process_cpu(x for x in pids if x)
+            state = (progress.out_time, size, getattr(process, "activity", None))
+            if state != last or used - cpu >= STALL_CPU:
+                last, cpu, still = state, used, 0
+                continue
+            still += STALL_CHECK
+            if still < timeout or self.process.returncode is not None:
+                continue
+            self.stalled = (
+                f"Encode stalled for {still}s at {progress.out_time or 0:.0f}s "
+                f"of the source with {hbs(size) or 'nothing'} written and no cpu used"
+            )
+            log(e=f"{self.enc_id}: {self.stalled}")
+            kill_encode(process)
+            return
+
     async def callback(self, dl, en, event, user, text=def_enc_msg, stime=None):
         try:
             self.req_clean = True
             code(self.process, dl, en, user, stime, self.enc_id)
+            enc_progress().update({self.enc_id: self.progress})
+            self.progress.out = en
+            if not self.progress.duration:
+                self.progress.duration = await get_stream_duration(dl)
             out = (os.path.split(en))[1]
             wah = 0
+            job = self.sjob
             a_msg = (
-                f"**{ejob.get_pending_pos()} Job**\n└`{(await get_codec(ejob.pending()))}`\n\n"
-                if self.sjob and ejob.get_pending_pos()
+                f"**{job.get_pending_pos()} Job**\n└`{(await get_codec(job.pending()))}`\n\n"
+                if job and job.get_pending_pos()
                 else str()
             )
             c_button = [Button.inline("Cancel", data=f"skip{wah}")]
             (
                 c_button.append(Button.inline("❌ all jobs", data=f"jskip{wah}"))
-                if self.sjob and ejob.jobs() > 1
+                if job and job.jobs() > 1
                 else None
             )
             e_msg = await event.edit(
@@ -66,6 +762,7 @@ class Encoder:
             )
             if self.log_msg and self.sender:
                 code(self.process, dl, en, user, stime, self.log_enc_id)
+                enc_progress().update({self.log_enc_id: self.progress})
                 sau = (os.path.split(dl))[1]
                 e_log = await self.log_msg.edit(
                     f"**User:**\n└[{self.sender.first_name}](tg://user?id={user})\n\n{a_msg}**Currently Encoding:**\n└`{out}`\n\n**Source File:**\n└`{sau}`",
@@ -82,14 +779,26 @@ class Encoder:
     async def await_completion(self):
         action = "game" if conf.ALLOW_ACTION is True else "cancel"
         async with self.client.action(self.event.chat_id, action):
-            com = await self.process.communicate()
+            if self.reader:
+                stdout = (await asyncio.gather(self.stderr_reader, self.reader))[1]
+                await self.process.wait()
+                com = (stdout, self.stderr.tail())
+            else:
+                com = await self.process.communicate()
+            self.progress.done = self.process.returncode == 0
+            self.size_watcher.cancel() if self.size_watcher else None
+            self.watchdog.cancel() if self.watchdog else None
+            if self.progress.done and self.stderr and self.stderr.spill:
+                s_remove(self.stderr.spill, f"{self.stderr.spill}.1")
             # while True:
             # if not await is_running(self.process):
             # break
             # await asyncio.sleep(5)
         if self.req_clean:
             decode(self.enc_id, pop=True)
+            enc_progress().pop(self.enc_id, None)
             if self.log_enc_id:
                 decode(self.log_enc_id, pop=True)
+                enc_progress().pop(self.log_enc_id, None)
 
         return com
@@ -0,0 +1,388 @@
+"""
+Remote chunk encoding.
+
+Run a worker on each encode box with:
+    python3 bot/workers/encoders/remote.py tcp:0.0.0.0:9200 --token TOKEN
+    python3 bot/workers/encoders/remote.py unix:/tmp/enc_worker.sock
+
+and list the workers in the bot's ENCODE_WORKERS var; a token is required
+unless the worker only listens on a unix socket or loopback address.
+
+Every request is a single json line followed by the raw chunk, the worker
+replies with keepalive lines while it encodes, then a json line followed
+by the encoded chunk. Only ffmpeg options that can't read or write files
+other than the chunk and its output are accepted.
+This module only uses the standard library so workers don't need the bot's
+dependencies installed.
+"""
+
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import deque
+
+BLOCK_SIZE = 1024 * 1024
+HEADER_LIMIT = 2**20
+# seconds between a worker's keepalives while it encodes
+KEEPALIVE = 15
+# seconds without anything from the other end before it's taken as lost
+IO_TIMEOUT = 120
+
+# options that read or write files of their own
+FILE_OPTS = {
+    "-attach",
+    "-dump_attachment",
+    "-i",
+    "-passlogfile",
+    "-progress",
+    "-report",
+    "-sdp_file",
+    "-vstats",
+    "-vstats_file",
+}
+FILTER_OPTS = ("-af", "-filter", "-filter_complex", "-lavfi", "-vf")
+# filters that open files or talk to the outside
+FILE_FILTERS = {
+    "amovie",
+    "ass",
+    "azmq",
+    "asendcmd",
+    "drawtext",
+    "frei0r",
+    "frei0r_src",
+    "ladspa",
+    "libvmaf",
+    "lut1d",
+    "lut3d",
+    "lv2",
+    "metadata",
+    "ametadata",
+    "movie",
+    "psnr",
+    "sendcmd",
+    "signature",
+    "ssim",
+    "subtitles",
+    "vidstabdetect",
+    "vidstabtransform",
+    "zmq",
+}
+FILTER_NAME = re.compile(r"(?:^|[,;])\s*(?:\[[^\]]*\]\s*)*([A-Za-z0-9_]+)")
+# absolute paths, parent folders, home folders and urls
+PATH_REGEX = re.compile(r"(?:^|[=:,;'\"|])\s*(?:/|~|\.\.)|://|\\\\")
+
+LOGS = logging.getLogger("enc_worker")
+
+
+class Lines(deque):
+    """The last lines of a process's output and how many there were"""
+
+    count = 0
+
+    def extend(self, lines):
+        self.count += len(lines)
+        super().extend(lines)
+
+    def append(self, line):
+        self.count += 1
+        super().append(line)
+
+
+async def read_lines(proc, lines):
+    """Keeps the last lines of stderr instead of buffering all of it"""
+    buffer = b""
+    while data := await proc.stderr.read(BLOCK_SIZE):
+        # ffmpeg's status line only ends with a carriage return
+        *new, buffer = re.split(rb"[\r\n]+", buffer + data)
+        lines.extend(new)
+        buffer = buffer[-BLOCK_SIZE:]
+    if buffer:
+        lines.append(buffer)
+    await proc.wait()
+
+
+def parse_address(address):
+    """'tcp:host:port' or 'unix:/path/to/socket' -> (kind, target)"""
+    kind, _sep, target = address.strip().partition(":")
+    if kind == "unix" and target:
+        return kind, target
+    if kind == "tcp":
+        host, _sep, port = target.rpartition(":")
+        if host and port.isdigit():
+            return kind, (host, int(port))
+    raise ValueError(f"Invalid worker address: {address}")
+
+
+async def connect(address):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(target, limit=HEADER_LIMIT)
+    return await asyncio.open_connection(*target, limit=HEADER_LIMIT)
+
+
+async def send_header(writer, header):
+    writer.write(json.dumps(header).encode() + b"\n")
+    await writer.drain()
+
+
+async def read_header(reader, timeout=IO_TIMEOUT):
+    """Reads a json line; raises ConnectionError if none comes or it isn't valid"""
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    except asyncio.TimeoutError:
+        raise ConnectionError(f"Nothing received for {timeout}s")
+    except ValueError as e:
+        raise ConnectionError(f"Invalid header: {e}")
+    if not line.endswith(b"\n"):
+        raise ConnectionError("Connection closed")
+    try:
+        header = json.loads(line)
+    except ValueError as e:
+        raise ConnectionError(f"Invalid header: {e}")
+    if not isinstance(header, dict):
+        raise ConnectionError("Invalid header")
+    return header
+
+
+async def send_file(writer, path):
+    with open(path, "rb") as file:
+        while data := file.read(BLOCK_SIZE):
+            writer.write(data)
+            await writer.drain()
+
+
+async def receive_file(reader, path, size):
+    with open(path, "wb") as file:
+        while size > 0:
+            try:
+                data = await asyncio.wait_for(
+                    reader.read(min(size, BLOCK_SIZE)), IO_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"Nothing received for {IO_TIMEOUT}s")
+            if not data:
+                raise ConnectionError("Connection closed mid transfer")
+            file.write(data)
+            size -= len(data)
+
+
+async def encode_chunk(
+    address, args, chunk, out, token=None, conns=None, on_progress=None
+):
+    """
+    Sends a chunk to a worker and saves the encoded chunk to out;
+    on_progress is called whenever the worker reports that ffmpeg moved on.
+    Returns the worker's ffmpeg exit code and stderr;
+    raises ConnectionError (or OSError) if the worker is lost.
+    """
+    reader, writer = await connect(address)
+    conns.append(writer) if conns is not None else None
+    try:
+        header = {
+            "op": "encode",
+            "args": args,
+            "name": os.path.split(chunk)[1],
+            "size": os.path.getsize(chunk),
+            "token": token,
+        }
+        await send_header(writer, header)
+        await send_file(writer, chunk)
+        progress = None
+        while "alive" in (reply := await read_header(reader)):
+            if reply["alive"] != progress:
+                progress = reply["alive"]
+                on_progress() if on_progress else None
+        if not isinstance(reply.get("status"), int):
+            raise ConnectionError("Invalid reply")
+        if not reply["status"]:
+            if not (isinstance(size := reply.get("size"), int) and size > 0):
+                raise ConnectionError("Worker sent back an empty chunk")
+            await receive_file(reader, out, size)
+        return reply["status"], str(reply.get("error") or str()).encode()
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(str(e))
+    finally:
+        conns.remove(writer) if conns is not None else None
+        writer.close()
+
+
+async def ping(address, token=None):
+    try:
+        reader, writer = await connect(address)
+        try:
+            await send_header(writer, {"op": "ping", "token": token})
+            return not (await read_header(reader)).get("status")
+        finally:
+            writer.close()
+    except OSError:
+        return False
+
+
+def unsafe_arg(args):
+    """
+    The first option of a chunk's encoding args that could make ffmpeg
+    read or write a file other than the chunk and its output, None if none;
+    relative names stay in the job's own temporary folder
+    """
+    if not (
+        isinstance(args, dict)
+        and all(isinstance(args.get(x), list) for x in ("global", "input", "output"))
+    ):
+        return "Malformed args"
+    args = args["global"] + args["input"] + args["output"]
+    for i, arg in enumerate(args):
+        if not isinstance(arg, str):
+            return repr(arg)
+        name = arg.split(":", 1)[0]
+        value = args[i + 1] if i + 1 < len(args) else str()
+        if name in FILE_OPTS or name.startswith("-/") or "script" in name:
+            return arg
+        if name == "-f" and value != "matroska":
+            return f"{arg} {value}"
+        if name in FILTER_OPTS and FILE_FILTERS & set(FILTER_NAME.findall(value)):
+            return f"{arg} {value}"
+        if PATH_REGEX.search(arg):
+            return arg
+
+
+#######! WORKER !#######
+
+
+class Worker:
+    def __init__(self, ffmpeg="ffmpeg", token=None, jobs=1, workdir=None):
+        self.ffmpeg = ffmpeg
+        self.token = token
+        self.sem = asyncio.Semaphore(jobs)
+        self.workdir = workdir
+
+    async def reply(self, writer, status, error=str(), path=None):
+        size = os.path.getsize(path) if path else 0
+        await send_header(writer, {"status": status, "error": error, "size": size})
+        await send_file(writer, path) if path else None
+
+    async def handle(self, reader, writer):
+        try:
+            header = await read_header(reader)
+            token = str(header.get("token") or str()).encode()
+            if self.token and not hmac.compare_digest(token, self.token.encode()):
+                return await self.reply(writer, 1, "Invalid token")
+            if header.get("op") == "ping":
+                return await self.reply(writer, 0)
+            if header.get("op") != "encode":
+                return await self.reply(writer, 1, "Unknown operation")
+            if bad := unsafe_arg(header.get("args")):
+                return await self.reply(writer, 1, f"Refused option: {bad}")
+            async with self.sem:
+                await self.encode(reader, writer, header)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            LOGS.info("Client went away")
+        except Exception:
+            LOGS.exception("Error while handling request")
+        finally:
+            writer.close()
+
+    async def encode(self, reader, writer, header):
+        args = header["args"]
+        tmp = tempfile.mkdtemp(prefix="enc_", dir=self.workdir)
+        try:
+            src = os.path.join(tmp, "chunk" + os.path.splitext(header["name"])[1])
+            out = os.path.join(tmp, "encoded.mkv")
+            await receive_file(reader, src, int(header["size"]))
+            LOGS.info(f"Encoding {header['name']}")
+            proc = await asyncio.create_subprocess_exec(
+                self.ffmpeg,
+                *args["global"],
+                *args["input"],
+                "-i",
+                src,
+                *args["output"],
+                out,
+                "-y",
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=tmp,
+            )
+            stderr = Lines(maxlen=100)
+            task = asyncio.create_task(read_lines(proc, stderr))
+            # nothing else is sent after the chunk, so this only returns when the client is gone
+            gone = asyncio.create_task(reader.read(1))
+            while not (task.done() or gone.done()):
+                await asyncio.wait(
+                    (task, gone), timeout=KEEPALIVE, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not (task.done() or gone.done()):
+                    # what ffmpeg printed and wrote so far tells the client it's moving
+                    size = os.path.getsize(out) if os.path.isfile(out) else 0
+                    await send_header(writer, {"alive": [stderr.count, size]})
+            if not task.done():
+                LOGS.info(f"Client went away, stopping {header['name']}")
+                proc.kill()
+                await task
+                return
+            gone.cancel()
+            stderr = b"\n".join(stderr).decode(errors="replace")
+            if proc.returncode:
+                return await self.reply(writer, proc.returncode, stderr[-4000:])
+            if not (os.path.isfile(out) and os.path.getsize(out)):
+                return await self.reply(writer, 1, f"Empty output\n{stderr[-4000:]}")
+            await self.reply(writer, 0, path=out)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    async def serve(self, address):
+        kind, target = parse_address(address)
+        if kind == "unix":
+            server = await asyncio.start_unix_server(
+                self.handle, target, limit=HEADER_LIMIT
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle, *target, limit=HEADER_LIMIT
+            )
+        LOGS.info(f"Encode worker listening on {address}")
+        async with server:
+            await server.serve_forever()
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remote chunk encoding worker")
+    parser.add_argument("address", help="tcp:HOST:PORT or unix:PATH")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable")
+    parser.add_argument("--token", default=None, help="shared ENCODE_WORKERS_TOKEN")
+    parser.add_argument(
+        "--jobs", default=1, type=int, help="chunks to encode at the same time"
+    )
+    parser.add_argument("--workdir", default=None, help="folder for temporary files")
+    args = parser.parse_args()
+    kind, target = parse_address(args.address)
+    if kind == "tcp" and not (args.token or is_loopback(target[0])):
+        parser.error("--token is required to listen on a network address")
+    logging.basicConfig(
+        format="%(asctime)s | %(name)s | [%(levelname)s] | %(message)s",
+        level=logging.INFO,
+    )
+    worker = Worker(args.ffmpeg, args.token, max(args.jobs, 1), args.workdir)
+    try:
+        asyncio.run(worker.serve(args.address))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,21 @@ from bot import asyncio, botStartTime, pyro, time
 from bot.config import _bot
 from bot.utils.ani_utils import qparse
 from bot.utils.batch_utils import get_batch_list
-from bot.utils.bot_utils import decode, enc_canceller
-from bot.utils.bot_utils import encode_job as ejob
-from bot.utils.bot_utils import get_queue, hbs, time_formatter, u_cancelled
+from bot.utils.bot_utils import (
+    decode,
+    enc_canceller,
+    enc_progress,
+    get_queue,
+    get_slot,
+    get_slots,
+    hbs,
+    time_formatter,
+    u_cancelled,
+)
 from bot.utils.log_utils import logger
 from bot.utils.msg_utils import clean_old_message, turn, user_is_owner
 from bot.utils.os_utils import file_exists, s_remove
+from bot.workers.encoders.encode import kill_encode
 
 #######! ENCODE CALLBACK HANDLERS !#######
 
@@ -56,17 +65,18 @@ async def pres(e):
         if not req_info:
             return await clean_old_message(e)
         process, dl, out, user_id, stime = req_info
+        slot = get_slot(job_id=_id) or get_slots()[0]
         _dir, ename = os.path.split(out)
         os.path.split(dl)[1]
-        if _dir != "encode":
+        if _dir != slot.dir:
             ans = f"Muxing:\n{ename}"
             return await e.answer(ans, alert=True)
         queue = get_queue()
         length = len(queue)
         ansa = str()
-        if file_exists("thumb2.jpg"):
+        if file_exists(slot.thumb):
             ansa += "\n\nAnilist thumbnail:\nYes"
-        file_name, _id, v_f = list(queue.values())[0]
+        file_name, _id, v_f = queue.get(slot.queue_id) or list(queue.values())[0]
         v, f, m, n, au = v_f
         if m[1].lower() == "batch.":
             _dir, name_ = os.path.split(dl)
@@ -115,13 +125,13 @@ async def skip(e, skip_jobs=False):
 
     if skip_jobs:
         ans = "Cancelling encoding and all pending jobs, please wait…"
-        if not ejob.id == _id:
+        if not (slot := get_slot(job_id=_id)):
             return await clean_old_message(e)
-        ejob.complete()
-        _bot.cached = False
+        slot.job.complete()
+        _bot.cached = False if not slot.index else _bot.cached
 
     await e.answer(ans)
-    process.kill()
+    kill_encode(process)
     # await e.delete()
     # s_remove(dl)
     s_remove(en)
@@ -142,8 +152,10 @@ async def stats(e):
         if not req_info:
             return await clean_old_message(e)
         process, dl, out, user_id, stime = req_info
-        ot = hbs(int(Path(out).stat().st_size))
-        ov = hbs(int(Path(dl).stat().st_size))
+        # chunked encodes only write the output at the very end
+        ot = hbs(int(Path(out).stat().st_size)) if file_exists(out) else "0 B"
+        # streamed encodes start before the download completes
+        ov = hbs(int(Path(dl).stat().st_size)) if file_exists(dl) else "…"
         _dir, name = os.path.split(dl)
         input = (name[:45] + "…") if len(name) > 45 else name
         currentTime = time_formatter(time.time() - botStartTime)
@@ -153,8 +165,20 @@ async def stats(e):
         free = hbs(free)
         elapsed = time_formatter(time.time() - stime)
         cpuUsage = psutil.cpu_percent(interval=0.5)
+        progress = enc_progress().get(_id)
+        prog = str()
+        if progress and progress.percentage is not None:
+            # callback answers are capped at 200 characters, keep it short
+            ot += f" ({progress})"
+            if progress.eta:
+                prog += f"\n\nETA:\n{time_formatter(progress.eta)}"
+            if size := progress.projected_size:
+                prog += f"\n\nProjected size:\n~{hbs(size)}"
+            if progress.speed:
+                prog += f"\n\nSpeed: {progress.speed:.2f}x"
+                prog += f" @ {progress.fps:g}fps" if progress.fps else str()
         if data == "0":
-            ans = f"Downloaded:\n{ov}\n\nFileName:\n{input}\n\nEncoded:\n{ot}\n\nElapsed time:\n{elapsed}"
+            ans = f"FileName:\n{input}\n\nDownloaded:\n{ov}\n\nEncoded:\n{ot}\n\nElapsed time:\n{elapsed}{prog}"
         elif data == "1":
             ans = f"CPU: {cpuUsage}%\n\nTotal Disk Space:\n{total}\n\nBot Uptime:\n{currentTime}\n\nUsed: {used}  Free: {free}"
         elif data == "2":
@@ -198,7 +222,9 @@ async def dl_stat(client, query):
         file_name = (os.path.split(d.file_name))[1]
         ov = hbs(int(Path(dls).stat().st_size))
         queue = get_queue()
-        ver, fil, mode, n, au = (list(queue.values())[0])[2]
+        slot = get_slot(job_id=_id) or get_slots()[0]
+        q_item = queue.get(slot.queue_id) or list(queue.values())[0]
+        ver, fil, mode, n, au = q_item[2]
         q = await qparse(file_name, ver, fil, n, au[0])
         ans = f"➡️:\n{q}"
         ans += "\n\n"
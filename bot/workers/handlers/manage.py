@@ -13,26 +13,30 @@ from bot import (
     mux_file,
     parse_file,
     rename_file,
+    resume_dir,
     rss_dict_lock,
     thumb,
 )
 from bot.config import _bot, conf
 from bot.startup.before import entime
-from bot.utils.bot_utils import encode_job as ejob
 from bot.utils.bot_utils import (
     get_aria2,
     get_bqueue,
+    get_filename,
     get_html,
     get_pause_status,
     get_queue,
     get_var,
+    hbs,
     list_to_str,
+    reset_jobs,
     split_text,
     string_escape,
     sync_to_async,
     time_formatter,
 )
 from bot.utils.db_utils import save2db, save2db2
+from bot.utils.failure_utils import dead_letter_summary, requeue
 from bot.utils.log_utils import logger
 from bot.utils.msg_utils import (
     avoid_flood,
@@ -46,6 +50,7 @@ from bot.utils.msg_utils import (
 )
 from bot.utils.os_utils import (
     file_exists,
+    get_stream_duration,
     kill_process,
     qclean,
     re_x,
@@ -54,7 +59,10 @@ from bot.utils.os_utils import (
     x_or_66,
 )
 from bot.utils.rss_utils import schedule_rss, scheduler
+from bot.utils.tier_utils import encode_cost
 from bot.workers.downloaders.dl_helpers import get_qbclient
+from bot.workers.downloaders.download import Downloader as downloader
+from bot.workers.encoders.bench import candidate_cmd, run_bench
 
 
 async def nuke(event, args, client):
@@ -178,6 +186,7 @@ async def clean(event, args, client):
         await save2db()
         await save2db("batches")
         await qclean()
+        s_remove(resume_dir, folders=True)
         await clean_all_aria2()
         try:
             await clean_all_qb()
@@ -367,7 +376,7 @@ async def change(event, args, client):
             ffile.write(str(args) + "\n")
 
         await save2db2(args, db)
-        ejob.reset() if s else None
+        reset_jobs() if s else None
         await event.reply(
             f"<pre>\n<code class='language-Changed ffmpeg{s} CLI parameters to:'>{args}</code>\n</pre>",
             parse_mode="html",
@@ -488,7 +497,7 @@ async def reffmpeg2(event, args, client):
                     await save2db2(conf.FFMPEG4, f"ffmpeg{s}")
                     res = f"<pre>\n<code class='Reseted ffmpeg{s} CLI parameters to:'>{conf.FFMPEG4}</code>\n</pre>"
 
-        ejob.reset()
+        reset_jobs()
         await event.reply(
             res,
             parse_mode="html",
@@ -497,6 +506,187 @@ async def reffmpeg2(event, args, client):
         await logger(Exception)
 
 
+async def bench(event, args, client):
+    """
+    Benchmark encoding params on short samples of a replied video or queue item.
+    Candidates go on the lines after the command, one per line, either as
+    ffmpeg.txt style commands or just the options between input and output;
+    without candidates the current ffmpeg params are benchmarked.
+    Arguments:
+        -q <int> queue item to sample instead of a replied video
+        -n <int> number of samples (3)
+        -l <int> length of each sample in seconds (20)
+        -j <int> samples to encode at the same time
+    Example:
+        /bench -n 4
+        -preset veryfast -c:v libx265 -crf 27
+        -preset slow -c:v libx265 -crf 25
+    """
+    if not user_is_owner(event.sender_id):
+        return await try_delete(event)
+    download = msg = None
+    try:
+        args, *candidates = (args or str()).split("\n")
+        flag = get_args("-j", "-l", "-n", "-q", to_parse=args)
+        for value in (flag.j, flag.l, flag.n, flag.q):
+            if value and not value.isdigit():
+                return await event.reply(f"`{bench.__doc__}`")
+        candidates = [x for x in candidates if x.strip()]
+        if not candidates:
+            with open(ffmpeg_file, "r") as file:
+                candidates = [file.read().strip()]
+        candidates = [candidate_cmd(x) for x in candidates]
+        link = qbit = select = None
+        if flag.q:
+            queue = get_queue()
+            if int(flag.q) > len(queue) - 1:
+                return await event.reply("`Kindly pass a valid queue number.`")
+            key = list(queue.keys())[int(flag.q)]
+            name, u_msg, (v, f, m, n, au) = queue[key]
+            if m[1].lower() == "batch.":
+                return await event.reply("`Batches can't be benchmarked.`")
+            link, qbit = au[1], m[0] == "qbit"
+            if m[1].split()[0].lower() == "select.":
+                select = int(m[1].split()[1])
+            message = u_msg[1] or await client.get_messages(*key)
+        elif event.is_reply:
+            rep_event = await event.get_reply_message()
+            message = await client.get_messages(event.chat_id, rep_event.id)
+            if not (message.video or message.document):
+                return await event.reply("`Reply to a video to benchmark it.`")
+            name = get_filename(message)
+        else:
+            return await event.reply(f"`{bench.__doc__}`")
+        msg = await client.send_message(
+            event.chat_id,
+            f"`Downloading {name} for benchmarking…`",
+            reply_to_message_id=event.id,
+        )
+        download = downloader(
+            _id=f"{msg.chat.id}:{msg.id}", uri=link, folder="bench/", qbit=qbit
+        )
+        await download.start(name, 0, message, msg, select=select)
+        if download.is_cancelled or download.download_error:
+            return await msg.edit(f"`{download.download_error or 'Cancelled.'}`")
+        if not (duration := await get_stream_duration(download.path)):
+            return await msg.edit("`Could not get the duration of the source.`")
+        segments, length = int(flag.n or 3), int(flag.l or 20)
+        await msg.edit(
+            f"`Encoding {segments} samples of {length}s "
+            f"with {len(candidates)} candidate(s)…`"
+        )
+        results, jobs = await run_bench(
+            candidates,
+            download.path,
+            duration,
+            "bench/samples",
+            segments,
+            length,
+            int(flag.j or 0),
+        )
+        text = f"**Benchmark of** `{name}` __({time_formatter(duration)})__\n"
+        for result, i in zip(results, itertools.count(1)):
+            text += f"\n**{i}.** `{result.cmd}`\n"
+            if result.error:
+                text += f"  **Failed:** `{result.error}`\n"
+                continue
+            text += (
+                f"  **FPS:** `{result.fps(jobs):.2f}`"
+                f"  **Time:** `{time_formatter(result.projected_time(duration, jobs))}`"
+                f"  **Size:** `{hbs(result.projected_size(duration))}`\n"
+            )
+        text += f"\n__Projected from {segments}×{length}s samples, {jobs} at a time.__"
+        await avoid_flood(msg.edit, text)
+    except Exception as e:
+        await logger(Exception)
+        await event.reply(f"An error occurred\n  - {str(e)}")
+    finally:
+        if download:
+            await download.clean_download()
+
+
+async def tiers(event, args, client):
+    """
+    Show which parameter tier the latest encodes were given and why.
+    Arguments:
+        <int> number of decisions to show (10)
+    """
+    if not user_is_owner(event.sender_id):
+        return await try_delete(event)
+    try:
+        if args and not args.isdigit():
+            return await event.reply(f"`{tiers.__doc__}`")
+        records = list(_bot.tiers.values())[-max(int(args or 10), 1) :]
+        if not records:
+            return await event.reply("`No tier decisions have been recorded.`")
+        text = (
+            "**Parameter tiers** "
+            f"__(ffmpeg.txt: {encode_cost():.2f}s per second of 1080p)__\n"
+        )
+        for x in reversed(records):
+            text += (
+                f"\n**Tier {x['tier']}:** `{x['name']}`\n"
+                f"  **Source:** `{time_formatter(x['duration'])}`"
+                f"  **Queued:** `{x['queued']}`"
+                f"  **Backlog:** `{x['backlog']:.2f}h`\n"
+            )
+            if x["elapsed"]:
+                text += f"  **Encoded in:** `{time_formatter(x['elapsed'])}`\n"
+        await avoid_flood(event.reply, text)
+    except Exception as e:
+        await logger(Exception)
+        await event.reply(f"An error occurred\n  - {str(e)}")
+
+
+async def dead_letters(event, args, client):
+    """
+    List the queue items that kept failing and were taken off the queue.
+    Arguments:
+        <int> show the traceback and encoder output of an item
+        -r <int|all> put an item (or all of them) back in the queue
+        -c clear the list
+    """
+    if not user_is_owner(event.sender_id):
+        return await try_delete(event)
+    try:
+        arg, args = get_args(
+            "-r", ["-c", "store_true"], to_parse=args or str(), get_unknown=True
+        )
+        keys = list(_bot.dead_letters.keys())
+        if arg.c:
+            _bot.dead_letters.clear()
+            await save2db("dead_letters")
+            return await event.reply("`Cleared the dead letters.`")
+        if not keys:
+            return await event.reply("`No item has been taken off the queue.`")
+        if arg.r:
+            if arg.r.casefold() != "all" and not (
+                arg.r.isdigit() and 0 < int(arg.r) <= len(keys)
+            ):
+                return await event.reply("`Kindly pass a valid item number.`")
+            picked = keys if arg.r.casefold() == "all" else [keys[int(arg.r) - 1]]
+            names = [await requeue(key) for key in picked]
+            text = "**Queued again:**\n" + "\n".join(f"`{x}`" for x in names)
+            return await avoid_flood(event.reply, text)
+        if args:
+            if not (args.isdigit() and 0 < int(args) <= len(keys)):
+                return await event.reply(f"`{dead_letters.__doc__}`")
+            dead = _bot.dead_letters[keys[int(args) - 1]]
+            text = f"**{dead['item'][0]}**\n{dead_letter_summary(dead)}\n\n"
+            text += f"**Traceback:**\n`{(dead['traceback'] or '-')[-1500:]}`\n\n"
+            text += f"**Encoder output:**\n`{(dead['output'] or '-')[-1500:]}`"
+            return await avoid_flood(event.reply, text)
+        text = "**Dead letters:**\n"
+        for i, dead in enumerate(_bot.dead_letters.values(), start=1):
+            text += (
+                f"\n**{i}.** `{dead['item'][0]}`\n  __{dead_letter_summary(dead)}__\n"
+            )
+        await avoid_flood(event.reply, text)
+    except Exception as e:
+        await logger(Exception)
+        await event.reply(f"An error occurred\n  - {str(e)}")
+
+
 async def version2(event, args, client):
     """
     Tag a realese with what numbers you specify:
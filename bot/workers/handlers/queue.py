@@ -5,6 +5,7 @@ from bot.fun.quips import enquip4
 from bot.utils.ani_utils import qparse
 from bot.utils.batch_utils import batch_preview, clean_batch
 from bot.utils.bot_utils import (
+    active_items,
     bot_is_paused,
     check_cmds,
     get_bqueue,
@@ -19,6 +20,7 @@ from bot.utils.bot_utils import (
     is_magnet,
     is_url,
     is_video_file,
+    parse_size,
     pause,
     rm_pause,
     sdict,
@@ -27,6 +29,7 @@ from bot.utils.bot_utils import (
     video_mimetype,
 )
 from bot.utils.db_utils import save2db
+from bot.utils.failure_utils import clear_failure
 from bot.utils.log_utils import logger
 from bot.utils.msg_utils import (
     get_args,
@@ -187,6 +190,7 @@ async def enleech(event, args: str, client, direct=False):
         -n new_filename.mp4 (rename the processed file.)
         -tc caption_tag (tag caption type as…)
         -tf file_tag (tag file_as)
+        -ts size (encode to a target size, e.g. 350M or 1.2G)
         -v number (tag according to version number)
     Both flags override /filter & /v
 
@@ -200,7 +204,7 @@ async def enleech(event, args: str, client, direct=False):
         return
     anilist = True
     cust_fil = cust_v = str()
-    force_name = None
+    force_name = size = None
     mode = "None"
     o_args = None
     queue = get_queue()
@@ -219,6 +223,7 @@ async def enleech(event, args: str, client, direct=False):
             "-n",
             "-tc",
             "-tf",
+            "-ts",
             "-v",
             ["-da", "store_false"],
             to_parse=args,
@@ -234,6 +239,10 @@ async def enleech(event, args: str, client, direct=False):
         anilist = flag.da
         cust_v = flag.v
         force_name = flag.n
+        if flag.ts and not (size := parse_size(flag.ts)):
+            return await event.reply(
+                "`Value for '-ts' arg has to be a size like 350M or 1.2G.`"
+            )
     if getattr(event.reply_to, "forum_topic", None):
         topic_id = (
             top if (top := event.reply_to.reply_to_top_id) else event.reply_to_msg_id
@@ -300,7 +309,7 @@ async def enleech(event, args: str, client, direct=False):
                                         cust_fil or get_f(),
                                         ("aria2", mode),
                                         force_name,
-                                        (anilist, uri),
+                                        (anilist, uri, size),
                                     ),
                                 ]
                             }
@@ -346,7 +355,7 @@ async def enleech(event, args: str, client, direct=False):
                             cust_fil or get_f(),
                             ("aria2", mode),
                             force_name,
-                            (anilist, uri),
+                            (anilist, uri, size),
                         ),
                     ]
                 }
@@ -382,6 +391,7 @@ async def enleech2(event, args: str, client, direct=False):
         -s (select a file for encoding __ through indexing)
         -tc caption_tag (tag caption type as…)
         -tf file_tag (tag file_as)
+        -ts size (encode to a target size, e.g. 350M or 1.2G)
         -v number (tag according to version number)
     Both flags override /filter & /v
 
@@ -395,7 +405,7 @@ async def enleech2(event, args: str, client, direct=False):
         return
     anilist = True
     cust_fil = cust_v = flag = str()
-    force_name = None
+    force_name = size = None
     queue = get_queue()
     invalid_msg = "`Invalid torrent/direct link`"
     mode = "None"
@@ -415,6 +425,7 @@ async def enleech2(event, args: str, client, direct=False):
             "-s",
             "-tc",
             "-tf",
+            "-ts",
             "-v",
             ["-b", "store_true"],
             ["-da", "store_false"],
@@ -432,6 +443,10 @@ async def enleech2(event, args: str, client, direct=False):
         anilist = flag.da
         cust_v = flag.v
         force_name = flag.n
+        if flag.ts and not (size := parse_size(flag.ts)):
+            return await event.reply(
+                "`Value for '-ts' arg has to be a size like 350M or 1.2G.`"
+            )
         if flag.s and not flag.s.isdigit():
             return await event.reply("`Value for '-s' arg has to be digit.`")
     if getattr(event.reply_to, "forum_topic", None):
@@ -546,7 +561,7 @@ async def enleech2(event, args: str, client, direct=False):
                                         cust_fil or get_f(),
                                         ("qbit", mode),
                                         force_name,
-                                        (anilist, uri),
+                                        (anilist, uri, size),
                                     ),
                                 ]
                             }
@@ -621,7 +636,7 @@ async def enleech2(event, args: str, client, direct=False):
                             cust_fil or get_f(),
                             ("qbit", mode),
                             force_name,
-                            (anilist, uri),
+                            (anilist, uri, size),
                         ),
                     ]
                 }
@@ -636,7 +651,8 @@ async def enleech2(event, args: str, client, direct=False):
     except Exception as e:
         await logger(Exception)
         await rm_pause(dl_pause)
-        return await event.reply(f"An error Occurred.\n - {e}
+        return await event.reply(f"An error Occurred.\n - {e}")
+
 
 async def enjdleech(event, args: str, client, direct=False):
     """
@@ -651,6 +667,7 @@ async def enjdleech(event, args: str, client, direct=False):
         -n new_filename.mp4 (rename the processed file.)
         -tc caption_tag (tag caption type as…)
         -tf file_tag (tag file_as)
+        -ts size (encode to a target size, e.g. 350M or 1.2G)
         -v number (tag according to version number)
     Both flags override /filter & /v
 
@@ -674,7 +691,7 @@ async def enjdleech(event, args: str, client, direct=False):
     
     anilist = True
     cust_fil = cust_v = str()
-    force_name = None
+    force_name = size = None
     mode = "None"
     o_args = None
     queue = get_queue()
@@ -692,6 +709,7 @@ async def enjdleech(event, args: str, client, direct=False):
             "-n",
             "-tc",
             "-tf",
+            "-ts",
             "-v",
             ["-da", "store_false"],
             to_parse=args,
@@ -707,6 +725,10 @@ async def enjdleech(event, args: str, client, direct=False):
         anilist = flag.da
         cust_v = flag.v
         force_name = flag.n
+        if flag.ts and not (size := parse_size(flag.ts)):
+            return await event.reply(
+                "`Value for '-ts' arg has to be a size like 350M or 1.2G.`"
+            )
     
     if getattr(event.reply_to, "forum_topic", None):
         topic_id = (
@@ -779,7 +801,7 @@ async def enjdleech(event, args: str, client, direct=False):
                                         cust_fil or get_f(),
                                         ("jd", mode),  # Using 'jd' as downloader
                                         force_name,
-                                        (anilist, uri),
+                                        (anilist, uri, size),
                                     ),
                                 ]
                             }
@@ -829,7 +851,7 @@ async def enjdleech(event, args: str, client, direct=False):
                             cust_fil or get_f(),
                             ("jd", mode),  # Using 'jd' as downloader
                             force_name,
-                            (anilist, uri),
+                            (anilist, uri, size),
                         ),
                     ]
                 }
@@ -978,8 +1000,7 @@ async def pencode(message, args=None, sender_id=None, flag=None):
                 return await xxx.edit("**THIS FILE HAS ALREADY BEEN ADDED TO QUEUE**")
         anilist = True
         cust_fil = cust_v = str()
-        force_name = None
-        uri = None
+        force_name = size = uri = None
         if args:
             if not flag:
                 flag, args = get_args(
@@ -989,6 +1010,7 @@ async def pencode(message, args=None, sender_id=None, flag=None):
                     "-n",
                     "-tc",
                     "-tf",
+                    "-ts",
                     "-v",
                     to_parse=args,
                     get_unknown=True,
@@ -1003,6 +1025,11 @@ async def pencode(message, args=None, sender_id=None, flag=None):
             anilist = flag.da
             cust_v = flag.v
             force_name = flag.n
+            if flag.ts and not (size := parse_size(flag.ts)):
+                return await message.reply(
+                    "`Value for '-ts' arg has to be a size like 350M or 1.2G.`",
+                    quote=True,
+                )
         queue.update(
             {
                 (chat_id, message.id): [
@@ -1013,7 +1040,7 @@ async def pencode(message, args=None, sender_id=None, flag=None):
                         cust_fil or get_f(),
                         ("tg", "None"),
                         force_name,
-                        (anilist, uri),
+                        (anilist, uri, size),
                     ),
                 ]
             }
@@ -1112,8 +1139,10 @@ async def clearqueue(event, args, client):
             )
         q_values = list(queue.values())[i]
         await clean_batch(i)
+        key = list(queue.keys())[i]
         async with queue_lock:
-            queue.pop(list(queue.keys())[i])
+            queue.pop(key)
+        clear_failure(key)
         await event.reply(f"`{q_values[0]}` has been removed from queue")
         await save2db()
         return await save2db("batches")
@@ -1132,20 +1161,25 @@ async def clearqueue(event, args, client):
             reply += "{0}. `{1}`\n".format(i, queue.get(key)[0])
             async with queue_lock:
                 queue.pop(key)
+            clear_failure(key)
             await clean_batch(key=key)
         if not reply:
             return await event.reply("`Nothing was cleared.`")
         msg = await event.reply(btch_clr_msg + reply)
     elif args.casefold() == "all":
         reply = str()
-        s = 0 if get_pause_status() == 0 else 1
-        for key, i in zip(list(queue.keys())[s:], itertools.count(start=1)):
+        # items being worked on by an encode slot are left alone unless paused
+        active = active_items() if get_pause_status() != 0 else []
+        for key, i in zip(list(queue.keys()), itertools.count(start=1)):
+            if key in active:
+                continue
             adder = (queue.get(key)[1])[0]
             if not user_is_owner(user) and user != adder:
                 continue
             reply += "{0}. `{1}`\n".format(i, queue.get(key)[0])
             async with queue_lock:
                 queue.pop(key)
+            clear_failure(key)
             await clean_batch(key=key)
         if not reply:
             return await event.reply("`Nothing was cleared.`")
@@ -1219,6 +1253,8 @@ async def edit_queue(event, args, client):
         -rm <filter> (what_to_remove)
         -tc <filter> (tag_caption_as)
         -tf <filter> (tag_file_as)
+        -ts <size> (encode to a target size, e.g. 350M or 1.2G)
+            to disable pass 'None'
         -u (for debugging) change uri
         -v <version> (tag file with version)
             to disable versioning pass 'None'
@@ -1247,6 +1283,7 @@ async def edit_queue(event, args, client):
             "-rm",
             "-tc",
             "-tf",
+            "-ts",
             "-u",
             "-v",
             to_parse=args,
@@ -1274,19 +1311,31 @@ async def edit_queue(event, args, client):
             return await event.reply("`This item wasn't added to queue by you.`")
         key = list(queue.keys())[args]
         v, f, m, n, au = v_f_m
-        anilist, uri = au
+        anilist, uri, size = au if len(au) > 2 else (*au, None)
         anilist = (flag.a or flag.da) or anilist
         if flag.f and flag.f.casefold() in ("none", "disable", "off"):
             cust_fil = f = None
         if flag.v and flag.v.casefold() in ("none", "disable", "off"):
             cust_v = v = None
         uri = flag.u or uri
+        if flag.ts and flag.ts.casefold() in ("none", "disable", "off"):
+            size = None
+        elif flag.ts and not (size := parse_size(flag.ts)):
+            return await event.reply(
+                "`Value for '-ts' arg has to be a size like 350M or 1.2G.`"
+            )
         queue.update(
             {
                 key: [
                     flag.d or file_name,
                     s_msg,
-                    (cust_v or v, cust_fil or f, m, flag.n or n, (anilist, uri)),
+                    (
+                        cust_v or v,
+                        cust_fil or f,
+                        m,
+                        flag.n or n,
+                        (anilist, uri, size),
+                    ),
                 ]
             }
         )
@@ -25,6 +25,7 @@ from bot.utils.bot_utils import (
     u_cancelled,
     video_mimetype,
 )
+from bot.utils.governor import AUX
 from bot.utils.log_utils import logger
 from bot.utils.msg_utils import (
     avoid_flood,
@@ -570,13 +571,23 @@ async def en_mux(event, args, client):
         t_file = work_folder + root + " [Temp]" + ext
         args = args.strip()
         args = f'-i "{input_2}" ' + args if input_2 else args
+        b, d, c, rlsgrp = await dynamicthumb(
+            __loc, thumb3, anilist=ani_parse, _filter=_f
+        )
+        if "This Episode" in args and b:
+            bo = b
+            if d:
+                bo = f"Episode {d} of {b}"
+            if c:
+                bo += f" Season {c}"
+            args = args.replace(f"This Episode", bo)
         await asyncio.sleep(3)
         text = "**Currently Muxing:**\n└`{}`\n\n`using provided parameters…`"
         cmd = f'''ffmpeg -i """{dl}""" {args} """{t_file}""" -y'''
         e_id = f"{e.chat_id}:{e.id}"
         stime = time.time()
         encode = encoder(e_id, event=event)
-        await encode.start(cmd)
+        await encode.start(cmd, AUX)
         await encode.callback(dl, t_file, e, user, text, stime)
         stderr = (await encode.await_completion())[1]
         await report_encode_status(
@@ -598,44 +609,39 @@ async def en_mux(event, args, client):
             direct=forced_file,
         )
         loc = work_folder + __out
-        b, d, c, rlsgrp = await dynamicthumb(
-            __loc, thumb3, anilist=ani_parse, _filter=_f
-        )
         args2 = ""
         for arg in args.split("-"):
             if "metadata" in arg:
                 args2 += "-" + arg + " "
-        if "This Episode" in args2 and b:
-            bo = b
-            if d:
-                bo = f"Episode {d} of {b}"
-            if c:
-                bo += f" Season {c}"
-            args2 = args2.replace(f"This Episode", bo)
-        if "Fileinfo" in args2:
-            args2 = args2.replace("Fileinfo", __out1)
-        args2 = args2.strip()
-        if default_audio:
-            args2 += f" -disposition:a 0"
-            a_pos_in_stm = await pos_in_stm(t_file, default_audio, get="audio")
-            if a_pos_in_stm or a_pos_in_stm == 0:
-                args2 += f" -disposition:a:{a_pos_in_stm} default"
-        if default_sub:
-            args2 += f" -disposition:s 0"
-            s_pos_in_stm = await pos_in_stm(t_file, default_sub, get="sub")
-            if s_pos_in_stm or s_pos_in_stm == 0:
-                args2 += f" -disposition:s:{s_pos_in_stm} default"
-        cmd = f'ffmpeg -i "{t_file}" -map 0:v? -map 0:a? -map 0:s? -map 0:t? {args2} -codec copy "{loc}" -y'
-        encode = encoder(e_id, event=event)
-        await encode.start(cmd)
-        stderr = (await encode.await_completion())[1]
-        await report_encode_status(
-            encode.process, e_id, stderr, e, user, loc, _is="Editing metadata"
-        )
-        if encode.process.returncode != 0:
-            s_remove(t_file, loc)
-            return
-        s_remove(t_file)
+        remux = "Fileinfo" in args2 or default_audio or default_sub
+        # renaming is enough unless the metadata or dispositions need the muxed file
+        if not remux and check_ext(loc, get_split=True)[2] == ext:
+            os.replace(t_file, loc)
+        else:
+            if "Fileinfo" in args2:
+                args2 = args2.replace("Fileinfo", __out1)
+            args2 = args2.strip()
+            if default_audio:
+                args2 += f" -disposition:a 0"
+                a_pos_in_stm = await pos_in_stm(t_file, default_audio, get="audio")
+                if a_pos_in_stm or a_pos_in_stm == 0:
+                    args2 += f" -disposition:a:{a_pos_in_stm} default"
+            if default_sub:
+                args2 += f" -disposition:s 0"
+                s_pos_in_stm = await pos_in_stm(t_file, default_sub, get="sub")
+                if s_pos_in_stm or s_pos_in_stm == 0:
+                    args2 += f" -disposition:s:{s_pos_in_stm} default"
+            cmd = f'ffmpeg -i "{t_file}" -map 0:v? -map 0:a? -map 0:s? -map 0:t? {args2} -codec copy "{loc}" -y'
+            encode = encoder(e_id, event=event)
+            await encode.start(cmd, AUX)
+            stderr = (await encode.await_completion())[1]
+            await report_encode_status(
+                encode.process, e_id, stderr, e, user, loc, _is="Editing metadata"
+            )
+            if encode.process.returncode != 0:
+                s_remove(t_file, loc)
+                return
+            s_remove(t_file)
         cap = await custcap(
             __loc,
             __out,
@@ -308,6 +308,9 @@ upload{s} - upload from a local directory or link
 rename{s} - rename a video file/link
 m{s} - get the media info of a replied file/link
 mux{s} - remux a file
+bench{s} - benchmark encoding params on samples of a file
+tiers{s} - show the parameter tiers recent encodes used
+failed{s} - list or requeue items that kept failing
 get{s} - get current ffmpeg code
 set{s} - set custom ffmpeg code
 reset{s} - reset default ffmpeg code
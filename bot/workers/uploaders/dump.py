@@ -4,6 +4,7 @@ from os.path import split as path_split
 
 from bot import Path, pyro, pyro_errors
 from bot.config import conf
+from bot.utils.bot_utils import background_call
 from bot.utils.log_utils import logger
 from bot.utils.os_utils import parse_dl, s_remove
 from bot.workers.uploaders.upload import Uploader as uploader
@@ -14,7 +15,7 @@ h_sticker = "CAACAgEAAxkBAAI0aWKx36P2GY9Fq6xvN0SBU1V2xZYIAAKXAgACJ_hhR9HcWzoditT
 async def dumpdl(dl, name, thum, user, message):
     dmp = "dump/" + (path_split(dl))[1]
     try:
-        shutil.copy2(dl, dmp)
+        await background_call(shutil.copy2, dl, dmp)
         _dmp = Path(dmp)
         dump_ = conf.DUMP_CHANNEL or None
         fname = f"`{name}`"
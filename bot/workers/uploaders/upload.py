@@ -1,26 +1,134 @@
+import hashlib
+
+from telethon import helpers
+
 from bot import *
 from bot.config import conf
 from bot.fun.emojis import enhearts, enmoji, enmoji2
-from bot.utils.bot_utils import code, decode, hbs, time_formatter
-from bot.utils.log_utils import logger
+from bot.utils.bot_utils import code, decode, hbs, sync_to_async, time_formatter
+from bot.utils.FastTelethon import ParallelTransferrer
+from bot.utils.log_utils import log, logger
 from bot.utils.os_utils import file_exists, get_video_thumbnail
 
 
+class Progressive_upload:
+    """
+    Uploads the parts of an output ffmpeg has finished writing while the
+    encode runs, so only what's left has to be sent once it completes.
+    """
+
+    part_size = 512 * 1024
+    # telegram's limit for bots (2GB)
+    max_parts = 4000
+
+    def __init__(self, path):
+        self.path = path
+        self.file_id = helpers.generate_random_long()
+        self.finished = False
+        self.hashes = {}
+        self.transfer = None
+        self.task = asyncio.create_task(self.run())
+
+    def __str__(self):
+        return "#progressive"
+
+    async def run(self):
+        try:
+            self.transfer = ParallelTransferrer(tele)
+            await self.transfer.init_part_upload()
+            while not os.path.isfile(self.path):
+                if self.finished:
+                    return
+                await asyncio.sleep(2)
+            # the first part holds the headers ffmpeg rewrites when it's done
+            part = 1
+            with open(self.path, "rb") as file:
+                while not self.finished:
+                    # leave the part being written alone
+                    while (part + 2) * self.part_size <= os.path.getsize(self.path):
+                        file.seek(part * self.part_size)
+                        await self.send(part, -1, file.read(self.part_size))
+                        part += 1
+                    await asyncio.sleep(2)
+        except Exception:
+            self.hashes = None
+            await logger(Exception)
+
+    async def send(self, index, total, data):
+        await self.transfer.upload_part(self.file_id, index, total, data)
+        self.hashes[index] = hashlib.md5(data).digest()
+
+    async def finish(self):
+        """
+        Uploads the rest once ffmpeg has exited successfully;
+        returns the InputFileBig to send or None to upload normally
+        """
+        self.finished = True
+        await self.task
+        try:
+            size = os.path.getsize(self.path)
+            total = -(-size // self.part_size)
+            if self.hashes is None or size <= 10485760 or total > self.max_parts:
+                return
+            # reading and hashing the whole output would hold up the bot
+            for index in await sync_to_async(self.changed, total):
+                await self.send(index, total, await sync_to_async(self.read, index))
+            return types.InputFileBig(self.file_id, total, os.path.split(self.path)[1])
+        except Exception:
+            await logger(Exception)
+        finally:
+            await self.close()
+
+    def changed(self, total):
+        """
+        Parts that differ from what was sent as ffmpeg went back and changed
+        them, followed by the last part which tells telegram how many there are
+        """
+        parts = []
+        with open(self.path, "rb") as file:
+            for index in range(total - 1):
+                digest = hashlib.md5(file.read(self.part_size)).digest()
+                if self.hashes.get(index) != digest:
+                    parts.append(index)
+        return parts + [total - 1]
+
+    def read(self, index):
+        with open(self.path, "rb") as file:
+            file.seek(index * self.part_size)
+            return file.read(self.part_size)
+
+    async def abandon(self):
+        """Stops uploading, the parts sent expire on telegram's side"""
+        self.finished = True
+        await self.task
+        await self.close()
+
+    async def close(self):
+        if self.transfer and self.transfer.senders:
+            try:
+                await self.transfer.finish_upload()
+            except Exception:
+                log(Exception)
+
+
 class Uploader:
-    def __init__(self, sender=123456, _id=None):
+    def __init__(self, sender=123456, _id=None, thumb2="thumb2.jpg"):
         self.sender = int(sender)
         self.callback_data = "cancel_upload"
         self.is_cancelled = False
         self.id = _id
         self.canceller = None
         self.force_up_as_files = False
+        self.thumb2 = thumb2
         self.time = None
         self.unfin_str = conf.UN_FINISHED_PROGRESS_STR
 
     def __str__(self):
         return "#wip"
 
-    async def start(self, from_user_id, filepath, reply, thum, caption, message):
+    async def start(
+        self, from_user_id, filepath, reply, thum, caption, message, progressive=None
+    ):
         try:
             if not thum or not (thum and file_exists(thum)):
                 if not file_exists(thumb):
@@ -30,6 +138,12 @@ class Uploader:
             code(self, index=self.id)
             fm = f"**From folder:** `{os.path.split(filepath)[0]}`"
             fm += f"\n**File:** `{os.path.split(filepath)[1]}`"
+            if progressive:
+                s = await self.finish_progressive(
+                    progressive, from_user_id, reply, thum, caption, message
+                )
+                if s:
+                    return s
             if conf.UAV and not self.force_up_as_files:
                 s = await self.upload_video(
                     caption, filepath, fm, from_user_id, message, reply, thum
@@ -73,10 +187,35 @@ class Uploader:
             decode(self.id, pop=True)
             await logger(Exception)
 
+    async def finish_progressive(
+        self, progressive, from_user_id, reply, thum, caption, message
+    ):
+        async with tele.action(from_user_id, "file"):
+            await reply.edit("🔺Finishing upload🔺")
+            self.time = time.time()
+            file = await progressive.finish()
+            if not file:
+                return
+            try:
+                sent = await tele.send_file(
+                    message.chat.id,
+                    file=file,
+                    caption=caption,
+                    thumb=thum,
+                    force_document=True,
+                    reply_to=message.id,
+                )
+            except Exception:
+                # fall back to uploading the whole file
+                await logger(Exception)
+                return
+        decode(self.id, pop=True)
+        return await pyro.get_messages(sent.chat_id, sent.id)
+
     async def upload_video(
         self, caption, filepath, fm, from_user_id, message, reply, thum
     ):
-        thum = "thumb2.jpg" if not thum or thum == thumb else thum
+        thum = self.thumb2 if not thum or thum == thumb else thum
         out = await get_video_thumbnail(filepath, thum, with_dur=True)
         thum, dur = out if len(out) > 1 else (out, 0)
         async with tele.action(from_user_id, "file"):